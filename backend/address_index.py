@@ -0,0 +1,248 @@
+import base64
+from pathlib import Path
+from typing import Iterable, Literal, NamedTuple
+
+import numpy as np
+
+ADDRESS_DTYPE = np.dtype("S20")
+CURSOR_SCORE_DTYPE = np.dtype("<f4")
+
+
+def parse_address(address: str) -> bytes:
+    """
+    Convert a hex address (with or without 0x, any case) to its 20 raw bytes.
+    """
+    address = address.strip().lower()
+    if address.startswith("0x"):
+        address = address[2:]
+    if len(address) != 40:
+        raise ValueError(f"Invalid address {address}")
+    return bytes.fromhex(address)
+
+
+def format_address(key: bytes) -> str:
+    # numpy strips trailing null bytes from fixed-width bytes
+    return "0x" + key.ljust(ADDRESS_DTYPE.itemsize, b"\0").hex()
+
+
+def encode_cursor(key: bytes, proba: float) -> str:
+    raw = key.ljust(ADDRESS_DTYPE.itemsize, b"\0") + np.array(proba, CURSOR_SCORE_DTYPE).tobytes()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[bytes, float]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode())
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor}")
+    if len(raw) != ADDRESS_DTYPE.itemsize + CURSOR_SCORE_DTYPE.itemsize:
+        raise ValueError(f"Invalid cursor {cursor}")
+    key = raw[: ADDRESS_DTYPE.itemsize]
+    proba = np.frombuffer(raw[ADDRESS_DTYPE.itemsize :], CURSOR_SCORE_DTYPE)[0]
+    return key, float(proba)
+
+
+def load_columns(folder: Path) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Addresses are stored sorted, so the arrays are used as they are on disk
+    return (
+        np.load(folder / "addresses.npy", mmap_mode="r"),
+        np.load(folder / "probas.npy", mmap_mode="r"),
+        np.load(folder / "values.npy", mmap_mode="r"),
+    )
+
+
+class Subset(NamedTuple):
+    # Positions in the index, in address order and in (score, address) order
+    by_address: np.ndarray
+    by_score: np.ndarray
+    # Probabilities of by_score, sorted ascending
+    sorted_probas: np.ndarray
+
+
+class Page(NamedTuple):
+    positions: np.ndarray
+    next_cursor: str | None
+    total: int
+
+
+class AddressIndex:
+    """
+    Compact lookup table of address -> probability.
+
+    Addresses are stored as sorted 20-byte keys next to a float32 array of
+    probabilities, so lookups are a binary search and the memory footprint is
+    24 bytes per address.
+    """
+
+    def __init__(
+        self,
+        addresses: np.ndarray,
+        probas: np.ndarray,
+        values: np.ndarray | None = None,
+    ):
+        assert addresses.dtype == ADDRESS_DTYPE, "addresses must be 20-byte keys"
+        assert addresses.shape == probas.shape, "addresses and probas must match"
+        assert values is None or values.shape == probas.shape, "values must match probas"
+        self.addresses = addresses
+        self.probas = probas
+        self.values = values
+        self.score_order = np.argsort(probas, kind="stable")
+        self.sorted_probas = probas[self.score_order]
+        self._all = Subset(np.arange(len(probas)), self.score_order, self.sorted_probas)
+        self._subsets: dict[tuple[float, float], Subset] = {}
+
+    @classmethod
+    def from_user_probas(
+        cls,
+        user_probas: dict[str, float],
+        user_values: dict[str, float] | None = None,
+    ) -> "AddressIndex":
+        addresses = np.array(
+            [parse_address(address) for address in user_probas.keys()],
+            dtype=ADDRESS_DTYPE,
+        )
+        probas = np.fromiter(user_probas.values(), dtype=np.float32, count=len(addresses))
+        order = np.argsort(addresses, kind="stable")
+        values = None
+        if user_values is not None:
+            values = np.fromiter(
+                (user_values.get(address, np.nan) for address in user_probas.keys()),
+                dtype=np.float32,
+                count=len(addresses),
+            )[order]
+        return cls(addresses[order], probas[order], values)
+
+    @classmethod
+    def load(cls, folder: Path) -> "AddressIndex":
+        """
+        Memory-map a columnar prod data folder (see ml_pipeline.postprocessing).
+        """
+        return cls(*load_columns(folder))
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def positions(self, addresses: Iterable[str]) -> np.ndarray:
+        """
+        Position of each address in the index, or -1 if it is not present.
+        """
+        keys = np.array([parse_address(address) for address in addresses], dtype=ADDRESS_DTYPE)
+        if len(self) == 0:
+            return np.full(len(keys), -1)
+        positions = np.searchsorted(self.addresses, keys)
+        positions = np.minimum(positions, len(self) - 1)
+        return np.where(self.addresses[positions] == keys, positions, -1)
+
+    def lookup(self, address: str) -> float | None:
+        position = self.positions([address])[0]
+        return float(self.probas[position]) if position >= 0 else None
+
+    def percentiles(self, probas: np.ndarray) -> np.ndarray:
+        """
+        Percentage of addresses with a probability strictly lower than each of `probas`.
+        """
+        below = np.searchsorted(self.sorted_probas, probas, side="left")
+        return 100 * below / max(len(self), 1)
+
+    def subset(self, value_range: tuple[float, float] | None = None) -> Subset:
+        """
+        Sorted views over the addresses whose value lies in [lower, higher).
+        """
+        if value_range is None:
+            return self._all
+        if value_range not in self._subsets:
+            if self.values is None:
+                raise ValueError("No per-address values available to filter by group")
+            lower, higher = value_range
+            mask = (self.values >= lower) & (self.values < higher)
+            by_score = self.score_order[mask[self.score_order]]
+            self._subsets[value_range] = Subset(
+                np.flatnonzero(mask), by_score, self.probas[by_score]
+            )
+        return self._subsets[value_range]
+
+    def page(
+        self,
+        order_by: Literal["score", "address"] = "score",
+        descending: bool = False,
+        cursor: str | None = None,
+        limit: int = 100,
+        min_proba: float = -np.inf,
+        max_proba: float = np.inf,
+        value_range: tuple[float, float] | None = None,
+    ) -> Page:
+        """
+        Slice of positions in the requested order, starting after `cursor`.
+
+        Every slice comes from the precomputed sorted arrays: the score order
+        is a contiguous range after the probability filter, the address order
+        is scanned in chunks only when a probability filter is set.
+        """
+        subset = self.subset(value_range)
+        # Compare in the stored precision so the bounds are inclusive
+        min_proba = self.probas.dtype.type(min_proba)
+        max_proba = self.probas.dtype.type(max_proba)
+        lower = np.searchsorted(subset.sorted_probas, min_proba, side="left")
+        upper = np.searchsorted(subset.sorted_probas, max_proba, side="right")
+        total = max(int(upper - lower), 0)
+
+        if order_by == "score":
+            ordered = subset.by_score[lower:upper]
+            start, stop = 0, len(ordered)
+            if cursor is not None:
+                key, proba = decode_cursor(cursor)
+                sorted_probas = subset.sorted_probas[lower:upper]
+                ties_start = np.searchsorted(sorted_probas, proba, side="left")
+                ties_stop = np.searchsorted(sorted_probas, proba, side="right")
+                ties = ordered[ties_start:ties_stop]
+                side = "left" if descending else "right"
+                key_position = np.searchsorted(self.addresses, key, side=side)
+                position = ties_start + np.searchsorted(ties, key_position, side="left")
+                start, stop = (0, position) if descending else (position, len(ordered))
+            selected = ordered[start:stop]
+            selected = selected[::-1] if descending else selected
+            positions = selected[: limit + 1]
+        else:
+            ordered = subset.by_address
+            start, stop = 0, len(ordered)
+            if cursor is not None:
+                key, _ = decode_cursor(cursor)
+                side = "left" if descending else "right"
+                key_position = np.searchsorted(self.addresses, key, side=side)
+                position = np.searchsorted(ordered, key_position, side="left")
+                start, stop = (0, position) if descending else (position, len(ordered))
+            positions = self._scan(
+                ordered[start:stop], descending, limit + 1, min_proba, max_proba
+            )
+
+        next_cursor = None
+        if len(positions) > limit:
+            positions = positions[:limit]
+            last = positions[-1]
+            next_cursor = encode_cursor(self.addresses[last], self.probas[last])
+        return Page(positions, next_cursor, total)
+
+    def _scan(
+        self,
+        ordered: np.ndarray,
+        descending: bool,
+        limit: int,
+        min_proba: float,
+        max_proba: float,
+    ) -> np.ndarray:
+        ordered = ordered[::-1] if descending else ordered
+        if min_proba == -np.inf and max_proba == np.inf:
+            return ordered[:limit]
+
+        chunk_size = max(4 * limit, 1024)
+        found = []
+        n_found = 0
+        for chunk_start in range(0, len(ordered), chunk_size):
+            chunk = ordered[chunk_start : chunk_start + chunk_size]
+            probas = self.probas[chunk]
+            chunk = chunk[(probas >= min_proba) & (probas <= max_proba)]
+            found.append(chunk[: limit - n_found])
+            n_found += len(found[-1])
+            if n_found >= limit:
+                break
+        return np.concatenate(found) if found else ordered[:0]
@@ -0,0 +1,154 @@
+import io
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+from address_index import ADDRESS_DTYPE, parse_address
+from shap_rendering import plot_beeswarm, plot_waterfall
+
+# Written by the pipeline's shap stage (see ml_pipeline.shap_plots)
+ADDRESS_SHAP_FOLDER = "shap_values"
+
+
+class Explanation(NamedTuple):
+    address: str
+    base_value: float
+    feature_names: list[str]
+    features: np.ndarray
+    values: np.ndarray
+
+
+class AddressShap:
+    """
+    SHAP values of every prod address, memory mapped.
+
+    Addresses are sorted 20-byte keys, so looking up an address is a binary
+    search and returns its row of the (addresses, features) float32 matrix.
+    """
+
+    def __init__(
+        self,
+        addresses: np.ndarray,
+        values: np.ndarray,
+        features: np.ndarray,
+        feature_names: list[str],
+        base_value: float,
+        version: tuple = (),
+    ):
+        assert addresses.dtype == ADDRESS_DTYPE, "addresses must be 20-byte keys"
+        assert values.shape == features.shape == (len(addresses), len(feature_names))
+        self.addresses = addresses
+        self.values = values
+        self.features = features
+        self.feature_names = feature_names
+        self.base_value = base_value
+        # Identifies the files loaded, to key what is derived from them
+        self.version = version
+
+    @classmethod
+    def load(cls, folder: Path) -> "AddressShap":
+        with open(folder / "meta.json") as f:
+            meta = json.load(f)
+        stat = (folder / "values.npy").stat()
+        return cls(
+            np.load(folder / "addresses.npy", mmap_mode="r"),
+            np.load(folder / "values.npy", mmap_mode="r"),
+            np.load(folder / "features.npy", mmap_mode="r"),
+            meta["feature_names"],
+            meta["base_value"],
+            version=(stat.st_mtime_ns, stat.st_size),
+        )
+
+    def position(self, address: str) -> int | None:
+        key = parse_address(address)
+        position = int(np.searchsorted(self.addresses, key))
+        if position < len(self.addresses) and self.addresses[position] == key:
+            return position
+        return None
+
+    def explain(self, address: str) -> Explanation | None:
+        position = self.position(address)
+        if position is None:
+            return None
+        return Explanation(
+            address=address,
+            base_value=self.base_value,
+            feature_names=self.feature_names,
+            features=np.asarray(self.features[position]),
+            values=np.asarray(self.values[position]),
+        )
+
+
+def _png(figure) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def render_waterfall(explanation: Explanation, max_display: int = 10) -> bytes:
+    """
+    PNG waterfall plot of an explanation, drawn like the pipeline's example
+    plots (see shap_rendering).
+    """
+    return _png(
+        plot_waterfall(
+            explanation.values,
+            explanation.features,
+            explanation.feature_names,
+            explanation.base_value,
+            max_display=max_display,
+        )
+    )
+
+
+def render_beeswarm(
+    shap_data: AddressShap,
+    max_display: int = 20,
+    max_points: int = 10_000,
+    seed: int = 0,
+) -> bytes:
+    """
+    PNG beeswarm plot of the SHAP values of (a seeded sample of max_points)
+    addresses: the same plot the plots stage writes to beeswarm.png when not
+    run headless.
+    """
+    return _png(
+        plot_beeswarm(
+            shap_data.values,
+            shap_data.features,
+            shap_data.feature_names,
+            max_display=max_display,
+            max_points=max_points,
+            seed=seed,
+        )
+    )
+
+
+class ImageCache:
+    """
+    Bounded LRU of rendered images, shared by the request threads.
+    """
+
+    def __init__(self, max_images: int = 1024):
+        assert max_images > 0, "max_images must be greater than 0"
+        self.max_images = max_images
+        self._images: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key: tuple, image: bytes) -> None:
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
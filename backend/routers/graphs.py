@@ -1,20 +1,50 @@
-from fastapi import APIRouter
+import os
+from pathlib import Path
+from typing import Callable
+
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 import base64
 
+from address_index import parse_address
+from address_shap import (
+    ADDRESS_SHAP_FOLDER,
+    AddressShap,
+    Explanation,
+    ImageCache,
+    render_beeswarm,
+    render_waterfall,
+)
+from store import store
+
 router = APIRouter(
     prefix="/graphs",
     tags=["graphs"],
 )
 
+# Plots rendered on request, shared by all protocols
+rendered_images = ImageCache(max_images=int(os.environ.get("WATERFALL_CACHE_IMAGES", 1024)))
+
 
 class Graph(BaseModel):
     image: str
 
 
-@router.get("/shap/{protocol}")
-def get_full_shap(protocol: str) -> Graph:
-    path = f"results/{protocol}/beeswarm.png"
+class FeatureContribution(BaseModel):
+    name: str
+    value: float
+    shap: float
+
+
+class AddressShapValues(BaseModel):
+    address: str
+    base_value: float
+    output: float
+    # Sorted by decreasing absolute SHAP value
+    features: list[FeatureContribution]
+
+
+def load_graph(path: Path) -> Graph:
     with open(path, "rb") as image_file:
         encoded_string = base64.b64encode(image_file.read())
     return Graph(
@@ -22,12 +52,101 @@ def get_full_shap(protocol: str) -> Graph:
     )
 
 
+def get_cached_graph(protocol: str, filename: str) -> Graph:
+    try:
+        return store.load(protocol, filename, load_graph)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"{filename} not found for {protocol}")
+
+
+def get_address_shap_data(protocol: str) -> AddressShap | None:
+    """
+    The per-address SHAP values of protocol, or None for results from
+    before they were computed.
+    """
+    try:
+        if not store.path(protocol, ADDRESS_SHAP_FOLDER).is_dir():
+            return None
+        return store.load(protocol, ADDRESS_SHAP_FOLDER, AddressShap.load, key="address_shap")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No results for {protocol}")
+
+
+def explain_address(shap_data: AddressShap, address: str) -> Explanation:
+    try:
+        explanation = shap_data.explain(address)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if explanation is None:
+        raise HTTPException(status_code=404, detail=f"No explanation for {address}")
+    return explanation
+
+
+def get_rendered_graph(key: tuple, render: Callable[[], bytes]) -> Graph:
+    image = rendered_images.get(key)
+    if image is None:
+        try:
+            image = render()
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Rendering plots requires matplotlib")
+        rendered_images.put(key, image)
+    return Graph(image=base64.b64encode(image).decode("utf-8"))
+
+
+@router.get("/shap/{protocol}")
+def get_full_shap(protocol: str) -> Graph:
+    try:
+        rendered = store.path(protocol, "beeswarm.png").is_file()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No results for {protocol}")
+    shap_data = None if rendered else get_address_shap_data(protocol)
+    if shap_data is None:
+        return get_cached_graph(protocol, "beeswarm.png")
+
+    # Headless pipeline runs leave the plot to render from the SHAP values
+    return get_rendered_graph(
+        ("beeswarm", protocol, shap_data.version), lambda: render_beeswarm(shap_data)
+    )
+
+
+@router.get("/shap/{protocol}/{address}/values")
+def get_address_shap_values(protocol: str, address: str) -> AddressShapValues:
+    shap_data = get_address_shap_data(protocol)
+    if shap_data is None:
+        raise HTTPException(status_code=404, detail=f"No SHAP values for {protocol}")
+    explanation = explain_address(shap_data, address)
+    order = sorted(
+        range(len(explanation.values)), key=lambda i: -abs(float(explanation.values[i]))
+    )
+    return AddressShapValues(
+        address=address,
+        base_value=explanation.base_value,
+        output=explanation.base_value + float(explanation.values.sum()),
+        features=[
+            FeatureContribution(
+                name=explanation.feature_names[i],
+                value=float(explanation.features[i]),
+                shap=float(explanation.values[i]),
+            )
+            for i in order
+        ],
+    )
+
+
 @router.get("/shap/{protocol}/{address}")
 def get_address_shap(protocol: str, address: str) -> Graph:
-    idx = hash(address) % 5
-    path = f"results/{protocol}/waterfall_{idx}.png"
-    with open(path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read())
-    return Graph(
-        image=encoded_string.decode("utf-8"),
+    shap_data = get_address_shap_data(protocol)
+    if shap_data is None:
+        # Older results only have a few example plots: pick one that does
+        # not change across processes (as the frontend does)
+        try:
+            idx = int.from_bytes(parse_address(address), "big") % 5
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return get_cached_graph(protocol, f"waterfall_{idx}.png")
+
+    explanation = explain_address(shap_data, address)
+    return get_rendered_graph(
+        ("waterfall", protocol, shap_data.version, parse_address(address)),
+        lambda: render_waterfall(explanation),
     )
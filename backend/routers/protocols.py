@@ -1,9 +1,10 @@
 from fastapi import APIRouter
-import os
+
+from store import store
 
 router = APIRouter(prefix="/protocols", tags=["protocols"])
 
 
 @router.get("/")
 def get_available_protocols() -> list[str]:
-    return list(os.walk("results"))[0][1]
+    return store.protocols()
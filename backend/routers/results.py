@@ -1,7 +1,17 @@
 import json
-from fastapi import APIRouter
+from pathlib import Path
+from typing import Callable, Literal, NamedTuple, TypeVar
+
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel
 
+from address_index import AddressIndex, format_address, load_columns
+from store import store
+
+PROD_DATA_FOLDER = "prod_data"
+
+T = TypeVar("T")
+
 router = APIRouter(
     prefix="/results",
     tags=["results"],
@@ -29,14 +39,181 @@ class Stats(BaseModel):
     user_probas: dict[str, float]
 
 
-@router.get("/{protocol}")
-def get_stats(protocol: str) -> Stats:
-    path = f"results/{protocol}/prod_data.json"
-    with open(path) as results_file:
-        results = json.load(results_file)
-    results["user_probas"] = {
-        address: proba
-        for address, proba in results["user_probas"].items()
-        if proba == proba
-    }
-    return Stats(**results)
+class AddressScore(BaseModel):
+    address: str
+    proba: float | None
+    percentile: float | None
+
+
+class AddressBatch(BaseModel):
+    addresses: list[str]
+
+
+class UserProba(BaseModel):
+    address: str
+    proba: float
+
+
+class UserProbasPage(BaseModel):
+    items: list[UserProba]
+    next_cursor: str | None
+    total: int
+
+
+class CachedStats(NamedTuple):
+    stats: Stats
+    content: bytes
+    user_values: dict[str, float] | None
+
+
+def load_stats(path: Path) -> CachedStats:
+    if path.is_dir():
+        addresses, probas, values = load_columns(path)
+        results = {
+            "user_groups": load_user_groups(path),
+            "user_probas": dict(zip(map(format_address, addresses), probas.tolist())),
+        }
+        user_values = None
+    else:
+        with open(path) as results_file:
+            results = json.load(results_file)
+        results["user_probas"] = {
+            address: proba
+            for address, proba in results["user_probas"].items()
+            if proba == proba
+        }
+        user_values = results.get("user_values")
+    stats = Stats(**results)
+    return CachedStats(
+        stats=stats,
+        content=stats.model_dump_json().encode(),
+        user_values=user_values,
+    )
+
+
+def load_user_groups(path: Path) -> list[UserGroup]:
+    with open(path / "user_groups.json") as groups_file:
+        return [UserGroup(**group) for group in json.load(groups_file)]
+
+
+def prod_data_artifact(protocol: str) -> str:
+    # Prefer the columnar artifact, prod_data.json is an optional export
+    if store.path(protocol, PROD_DATA_FOLDER).is_dir():
+        return PROD_DATA_FOLDER
+    return "prod_data.json"
+
+
+def load_cached(protocol: str, loader: Callable[[Path], T], key: str) -> T:
+    try:
+        return store.load(protocol, prod_data_artifact(protocol), loader, key=key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No results for {protocol}")
+
+
+def get_cached_stats(protocol: str) -> CachedStats:
+    return load_cached(protocol, load_stats, key="stats")
+
+
+def get_user_groups(protocol: str) -> list[UserGroup]:
+    if prod_data_artifact(protocol) != PROD_DATA_FOLDER:
+        return get_cached_stats(protocol).stats.user_groups
+    return load_cached(protocol, load_user_groups, key="user_groups")
+
+
+def get_address_index(protocol: str) -> AddressIndex:
+    def load_index(path: Path) -> AddressIndex:
+        if path.is_dir():
+            return AddressIndex.load(path)
+        cached_stats = get_cached_stats(protocol)
+        return AddressIndex.from_user_probas(
+            cached_stats.stats.user_probas, cached_stats.user_values
+        )
+
+    return load_cached(protocol, load_index, key="address_index")
+
+
+def score_addresses(protocol: str, addresses: list[str]) -> list[AddressScore]:
+    index = get_address_index(protocol)
+    try:
+        positions = index.positions(addresses)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    probas = index.probas[positions] if len(index) else positions.astype(float)
+    percentiles = index.percentiles(probas)
+    return [
+        AddressScore(
+            address=address,
+            proba=float(proba) if position >= 0 else None,
+            percentile=float(percentile) if position >= 0 else None,
+        )
+        for address, position, proba, percentile in zip(
+            addresses, positions, probas, percentiles
+        )
+    ]
+
+
+@router.get("/{protocol}", response_model=Stats)
+def get_stats(protocol: str) -> Response:
+    # The validated payload is serialized once per file version
+    return Response(
+        content=get_cached_stats(protocol).content,
+        media_type="application/json",
+    )
+
+
+@router.get("/{protocol}/users")
+def get_user_probas(
+    protocol: str,
+    order_by: Literal["score", "address"] = "score",
+    descending: bool = False,
+    cursor: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    min_proba: float | None = None,
+    max_proba: float | None = None,
+    group: str | None = None,
+) -> UserProbasPage:
+    value_range = None
+    if group is not None:
+        user_groups = get_user_groups(protocol)
+        matches = [g for g in user_groups if g.label == group]
+        if not matches:
+            raise HTTPException(status_code=404, detail=f"Unknown group {group}")
+        value_range = (matches[0].lower, matches[0].higher)
+
+    index = get_address_index(protocol)
+    try:
+        page = index.page(
+            order_by=order_by,
+            descending=descending,
+            cursor=cursor,
+            limit=limit,
+            # Unbounded by default: regression outputs are not in [0, 1]
+            min_proba=min_proba if min_proba is not None else float("-inf"),
+            max_proba=max_proba if max_proba is not None else float("inf"),
+            value_range=value_range,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return UserProbasPage(
+        items=[
+            UserProba(address=format_address(address), proba=float(proba))
+            for address, proba in zip(
+                index.addresses[page.positions], index.probas[page.positions]
+            )
+        ],
+        next_cursor=page.next_cursor,
+        total=page.total,
+    )
+
+
+@router.get("/{protocol}/address/{address}")
+def get_address_score(protocol: str, address: str) -> AddressScore:
+    (score,) = score_addresses(protocol, [address])
+    if score.proba is None:
+        raise HTTPException(status_code=404, detail=f"No results for {address}")
+    return score
+
+
+@router.post("/{protocol}/address")
+def get_address_scores(protocol: str, batch: AddressBatch) -> list[AddressScore]:
+    return score_addresses(protocol, batch.addresses)
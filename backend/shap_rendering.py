@@ -0,0 +1,153 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.figure import Figure
+
+# The SHAP plots of the pipeline (ml_pipeline.rendering), kept here so that
+# the backend only needs numpy and matplotlib; tests/test_shap_rendering.py
+# checks that both draw the same images. Plots are drawn on their own
+# Figure with the object-oriented Agg API, never through pyplot's global
+# state, so renders in concurrent request threads do not share state.
+
+POSITIVE_COLOR = "#ff0051"
+NEGATIVE_COLOR = "#008bfb"
+# Low to high feature values in the beeswarm, as shap colors them
+FEATURE_VALUE_CMAP = LinearSegmentedColormap.from_list(
+    "feature_value", [NEGATIVE_COLOR, "#7c27bc", POSITIVE_COLOR]
+)
+
+
+def _figure(figsize: tuple[float, float]) -> Figure:
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def plot_beeswarm(
+    values: np.ndarray,
+    features: np.ndarray,
+    feature_names: list[str],
+    max_display: int = 20,
+    max_points: int = 10_000,
+    seed: int = 0,
+) -> Figure:
+    """
+    SHAP values of the rows of features, one row of points per feature
+    (the most important on top), spread vertically where they are dense
+    and colored by the feature value.
+
+    At most max_points rows are drawn, sampled with seed, since more do
+    not change the picture but render slowly.
+    """
+    rng = np.random.default_rng(seed)
+    if len(values) > max_points:
+        # Sorted, so that memory mapped arrays are read in order
+        rows = np.sort(rng.choice(len(values), size=max_points, replace=False))
+        values, features = values[rows], features[rows]
+    values = np.asarray(values, dtype=np.float32)
+    features = np.asarray(features, dtype=np.float32)
+
+    order = np.argsort(-np.abs(values).mean(axis=0), kind="stable")[:max_display]
+    figure = _figure((8, 0.4 * len(order) + 1.5))
+    ax = figure.add_subplot()
+    for position, i in enumerate(order[::-1]):
+        shap_values, feature_values = values[:, i], features[:, i]
+        # Jitter in proportion to the density of points around each value
+        counts, edges = np.histogram(shap_values, bins=100)
+        density = counts[np.clip(np.digitize(shap_values, edges) - 1, 0, len(counts) - 1)]
+        jitter = rng.uniform(-1, 1, len(shap_values)) * 0.4 * density / max(counts.max(), 1)
+
+        low, high = np.nanpercentile(feature_values, [5, 95]) if len(feature_values) else (0, 1)
+        colors = np.clip((feature_values - low) / max(high - low, 1e-9), 0, 1)
+        known = ~np.isnan(colors)
+        ax.scatter(
+            shap_values[~known],
+            position + jitter[~known],
+            color="#777777",
+            s=16,
+            alpha=0.8,
+            linewidth=0,
+            rasterized=True,
+        )
+        points = ax.scatter(
+            shap_values[known],
+            position + jitter[known],
+            c=colors[known],
+            cmap=FEATURE_VALUE_CMAP,
+            vmin=0,
+            vmax=1,
+            s=16,
+            alpha=0.8,
+            linewidth=0,
+            rasterized=True,
+        )
+
+    ax.axvline(0, color="#999999", linewidth=1)
+    ax.set_yticks(np.arange(len(order)), [feature_names[i] for i in order[::-1]])
+    ax.set_xlabel("SHAP value (impact on model output)")
+    for side in ("top", "right", "left"):
+        ax.spines[side].set_visible(False)
+    colorbar = figure.colorbar(points, ax=ax, ticks=[0, 1], aspect=50)
+    colorbar.ax.set_yticklabels(["Low", "High"])
+    colorbar.set_label("Feature value")
+    colorbar.outline.set_visible(False)
+    figure.tight_layout()
+    return figure
+
+
+def plot_waterfall(
+    values: np.ndarray,
+    features: np.ndarray,
+    feature_names: list[str],
+    base_value: float,
+    max_display: int = 10,
+) -> Figure:
+    """
+    Waterfall of the SHAP values of one row: the largest ones, with the
+    rest summed in one bar, stacked from the base value to the output.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(-np.abs(values), kind="stable")
+    shown = order[: max_display - 1] if len(order) > max_display else order
+    bars = values[shown].tolist()
+    labels = [f"{features[i]:.4g} = {feature_names[i]}" for i in shown]
+    if len(order) > len(shown):
+        bars.append(float(values[order[len(shown) :]].sum()))
+        labels.append(f"{len(order) - len(shown)} other features")
+
+    # Bars are drawn bottom up, from the base value to the output
+    bars, labels = bars[::-1], labels[::-1]
+    starts = base_value + np.concatenate([[0], np.cumsum(bars)[:-1]])
+    output = base_value + float(np.sum(bars))
+
+    figure = _figure((8, 0.5 * len(bars) + 1.5))
+    ax = figure.add_subplot()
+    positions = np.arange(len(bars))
+    ax.barh(
+        positions,
+        bars,
+        left=starts,
+        color=[POSITIVE_COLOR if v >= 0 else NEGATIVE_COLOR for v in bars],
+    )
+    for position, start, value in zip(positions, starts, bars):
+        ax.text(
+            start + value,
+            position,
+            f" {value:+.3f} ",
+            va="center",
+            ha="left" if value >= 0 else "right",
+            fontsize=9,
+        )
+    ax.set_yticks(positions, labels)
+    ax.axvline(base_value, color="#999999", linestyle="--", linewidth=1)
+    ax.axvline(output, color="#333333", linewidth=1)
+    ax.set_xlabel(f"E[f(X)] = {base_value:.3f}    f(x) = {output:.3f}")
+    # Room for the value labels
+    ends = np.concatenate([starts, starts + bars, [base_value]])
+    padding = 0.15 * max(ends.max() - ends.min(), 1e-6)
+    ax.set_xlim(ends.min() - padding, ends.max() + padding)
+    for side in ("top", "right", "left"):
+        ax.spines[side].set_visible(False)
+    figure.tight_layout()
+    return figure
+
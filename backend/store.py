@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Entry(NamedTuple):
+    signature: tuple
+    value: Any
+
+
+class ResultsStore:
+    """
+    Process-wide cache of the artifacts under the results folder.
+
+    Each artifact is loaded once and kept in its parsed form until the file
+    backing it changes (mtime or size). Protocols are kept in a bounded LRU,
+    so a protocol that has not been requested for a while is dropped as a
+    whole when the limit is reached.
+    """
+
+    def __init__(self, root: Path = Path("results"), max_protocols: int = 8):
+        assert max_protocols > 0, "max_protocols must be greater than 0"
+        self.root = Path(root)
+        self.max_protocols = max_protocols
+        self._protocols: OrderedDict[str, dict[str, _Entry]] = OrderedDict()
+        self._protocols_list: _Entry | None = None
+        self._lock = threading.RLock()
+        self._key_locks: dict[tuple[str, str], threading.Lock] = {}
+
+    def protocols(self) -> list[str]:
+        signature = _signature(self.root)
+        with self._lock:
+            if self._protocols_list is None or self._protocols_list.signature != signature:
+                protocols = sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+                self._protocols_list = _Entry(signature, protocols)
+            return self._protocols_list.value
+
+    def path(self, protocol: str, filename: str) -> Path:
+        if protocol not in self.protocols():
+            raise FileNotFoundError(f"Protocol {protocol} not found")
+        return self.root / protocol / filename
+
+    def load(
+        self,
+        protocol: str,
+        filename: str,
+        loader: Callable[[Path], T],
+        key: str | None = None,
+    ) -> T:
+        """
+        Return the artifact `filename` of `protocol` parsed with `loader`.
+
+        `key` allows caching several derived forms of the same file.
+        """
+        # Versioned artifacts are links to their current version (see
+        # ml_pipeline.postprocessing.staged_folder): resolved once, so that
+        # all the files of a folder come from the same version
+        path = self.path(protocol, filename).resolve()
+        key = key if key is not None else filename
+        signature = _signature(path)
+        # Loads of different artifacts run concurrently: only requests for
+        # the same one wait for each other, so it is loaded once
+        with self._key_lock(protocol, key):
+            with self._lock:
+                entries = self._protocols.get(protocol)
+                if entries is not None:
+                    self._protocols.move_to_end(protocol)
+                    entry = entries.get(key)
+                    if entry is not None and entry.signature == signature:
+                        return entry.value
+
+            value = loader(path)
+
+            with self._lock:
+                entries = self._protocols.setdefault(protocol, {})
+                entries[key] = _Entry(signature, value)
+                self._protocols.move_to_end(protocol)
+                while len(self._protocols) > self.max_protocols:
+                    self._protocols.popitem(last=False)
+            return value
+
+    def _key_lock(self, protocol: str, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault((protocol, key), threading.Lock())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._protocols.clear()
+            self._protocols_list = None
+
+
+def _signature(path: Path) -> tuple:
+    stat = path.stat()
+    if path.is_dir():
+        # Folder artifacts change when any of their files do
+        return (stat.st_mtime_ns,) + tuple(
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name)
+        )
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+store = ResultsStore(
+    root=Path(os.environ.get("RESULTS_FOLDER", "results")),
+    max_protocols=int(os.environ.get("RESULTS_CACHE_PROTOCOLS", 8)),
+)
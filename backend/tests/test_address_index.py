@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+
+from address_index import ADDRESS_DTYPE, AddressIndex, decode_cursor, encode_cursor
+
+
+def make_index(n: int = 257, seed: int = 0, with_values: bool = False) -> AddressIndex:
+    rng = np.random.default_rng(seed)
+    addresses = [f"0x{i:040x}" for i in rng.choice(10 * n, size=n, replace=False)]
+    # Few distinct probabilities, so that pages split runs of ties
+    probas = rng.integers(0, 8, size=n) / 8
+    values = rng.integers(0, 100, size=n)
+    return AddressIndex.from_user_probas(
+        dict(zip(addresses, probas.tolist())),
+        dict(zip(addresses, values.tolist())) if with_values else None,
+    )
+
+
+def all_pages(index: AddressIndex, limit: int, **kwargs) -> list:
+    pages = [index.page(limit=limit, **kwargs)]
+    while pages[-1].next_cursor is not None:
+        pages.append(index.page(limit=limit, cursor=pages[-1].next_cursor, **kwargs))
+    return pages
+
+
+def expected_positions(
+    index, order_by, descending, min_proba=-np.inf, max_proba=np.inf, mask=None
+):
+    positions = np.arange(len(index))
+    probas = index.probas
+    keep = (probas >= np.float32(min_proba)) & (probas <= np.float32(max_proba))
+    if mask is not None:
+        keep &= mask
+    positions = positions[keep]
+    if order_by == "score":
+        # Ties are ordered by address, that is by position
+        positions = positions[np.lexsort((positions, probas[positions]))]
+    return positions[::-1] if descending else positions
+
+
+@pytest.mark.parametrize("key", [bytes(range(1, 21)), b"\x12" * 4 + b"\0" * 16, b"\0" * 20])
+@pytest.mark.parametrize("proba", [0.0, 0.1, 1.0, -3.5])
+def test_cursor_round_trip(key, proba):
+    decoded_key, decoded_proba = decode_cursor(encode_cursor(key, proba))
+    assert decoded_key == key
+    assert decoded_proba == float(np.float32(proba))
+
+
+def test_cursor_round_trip_from_stored_key():
+    # numpy strips the trailing null bytes of stored keys
+    stored = np.array([b"\xab" + b"\0" * 19], dtype=ADDRESS_DTYPE)[0]
+    key, _ = decode_cursor(encode_cursor(stored, 0.5))
+    assert key == b"\xab" + b"\0" * 19
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor!", encode_cursor(b"\1" * 20, 0.5)[:-4]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("order_by", ["score", "address"])
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 7, 64, 257, 1000])
+def test_pages_cover_the_order(order_by, descending, limit):
+    index = make_index()
+    pages = all_pages(index, limit, order_by=order_by, descending=descending)
+
+    assert all(len(page.positions) == limit for page in pages[:-1])
+    assert 0 < len(pages[-1].positions) <= limit
+    assert all(page.total == len(index) for page in pages)
+    np.testing.assert_array_equal(
+        np.concatenate([page.positions for page in pages]),
+        expected_positions(index, order_by, descending),
+    )
+
+
+def test_page_ending_on_the_last_row_has_no_cursor():
+    index = make_index(n=20)
+    page = index.page(limit=20)
+    assert len(page.positions) == 20
+    assert page.next_cursor is None
+    assert index.page(limit=19).next_cursor is not None
+
+
+@pytest.mark.parametrize("order_by", ["score", "address"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_filtered_pages(order_by, descending):
+    index = make_index(with_values=True)
+    value_range = (20.0, 60.0)
+    mask = (index.values >= 20) & (index.values < 60)
+    pages = all_pages(
+        index,
+        10,
+        order_by=order_by,
+        descending=descending,
+        min_proba=0.25,
+        max_proba=0.625,
+        value_range=value_range,
+    )
+    expected = expected_positions(index, order_by, descending, 0.25, 0.625, mask)
+
+    np.testing.assert_array_equal(np.concatenate([page.positions for page in pages]), expected)
+    assert pages[0].total == len(expected)
+
+
+def test_empty_filter():
+    index = make_index()
+    page = index.page(min_proba=2.0, max_proba=3.0)
+    assert len(page.positions) == 0
+    assert page.next_cursor is None
+    assert page.total == 0
+
+
+def test_positions_hit_and_miss():
+    index = AddressIndex.from_user_probas(
+        {"0x" + "22" * 20: 0.2, "0x" + "11" * 20: 0.1, "0x" + "33" * 20: 0.3}
+    )
+    positions = index.positions(["0x" + "33" * 20, "0x" + "00" * 20, "0x" + "11" * 20])
+    np.testing.assert_array_equal(positions, [2, -1, 0])
+    # Past the last key
+    assert index.positions(["0x" + "ff" * 20])[0] == -1
+    assert index.lookup("0x" + "22" * 20) == pytest.approx(0.2)
+    assert index.lookup("0x" + "44" * 20) is None
+
+
+def test_lookup_ignores_case_and_prefix():
+    address = "0x" + "ab" * 20
+    index = AddressIndex.from_user_probas({address: 0.5})
+    assert index.lookup(address.upper()) == 0.5
+    assert index.lookup(" " + address[2:] + " ") == 0.5
+    assert index.lookup("0x" + "aB" * 20) == 0.5
+
+
+@pytest.mark.parametrize(
+    "address", ["", "0x", "0x" + "ab" * 19, "0x" + "ab" * 21, "0x" + "zz" * 20]
+)
+def test_invalid_address(address):
+    index = make_index(n=10)
+    with pytest.raises(ValueError):
+        index.positions([address])
+
+
+def test_empty_index():
+    index = AddressIndex.from_user_probas({})
+    assert len(index) == 0
+    np.testing.assert_array_equal(index.positions(["0x" + "11" * 20]), [-1])
+    assert index.lookup("0x" + "11" * 20) is None
+    np.testing.assert_array_equal(index.percentiles(np.array([0.5])), [0])
+
+
+def test_percentiles():
+    index = AddressIndex.from_user_probas(
+        {f"0x{i:040x}": proba for i, proba in enumerate([0.1, 0.2, 0.2, 0.4, 0.9])}
+    )
+    # Strictly lower: ties are not counted, the lowest score is at 0
+    np.testing.assert_allclose(
+        index.percentiles(np.array([0.1, 0.2, 0.4, 0.9], dtype=np.float32)), [0, 20, 60, 80]
+    )
+    np.testing.assert_allclose(index.percentiles(np.array([-1.0, 0.3, 2.0])), [0, 60, 100])
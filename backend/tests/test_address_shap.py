@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from address_index import ADDRESS_DTYPE, format_address
+from address_shap import AddressShap, render_beeswarm, render_waterfall
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+@pytest.fixture
+def shap_data():
+    rng = np.random.default_rng(0)
+    n, n_features = 50, 12
+    addresses = np.sort(
+        np.array([rng.bytes(20) for _ in range(n)], dtype=ADDRESS_DTYPE)
+    )
+    return AddressShap(
+        addresses,
+        rng.normal(size=(n, n_features)).astype(np.float32),
+        rng.random((n, n_features)).astype(np.float32),
+        [f"feature {i}" for i in range(n_features)],
+        base_value=0.3,
+    )
+
+
+def test_explain(shap_data):
+    address = format_address(shap_data.addresses[7])
+    explanation = shap_data.explain(address.upper())
+    np.testing.assert_array_equal(explanation.values, shap_data.values[7])
+    assert shap_data.explain("0x" + "00" * 20) is None
+
+
+def test_render_with_the_pipeline_renderers(shap_data):
+    explanation = shap_data.explain(format_address(shap_data.addresses[0]))
+    assert render_waterfall(explanation).startswith(PNG_SIGNATURE)
+    assert render_beeswarm(shap_data, max_points=20).startswith(PNG_SIGNATURE)
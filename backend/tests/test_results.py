@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from address_index import ADDRESS_DTYPE, parse_address
+from routers import results
+from store import store
+
+ADDRESSES = ["0x" + "11" * 20, "0x" + "22" * 20, "0x" + "ab" * 20, "0x" + "cd" * 20]
+PROBAS = [0.1, 0.2, 0.2, 0.9]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Columnar prod data, as written by ml_pipeline.postprocessing
+    folder = tmp_path / "protocol" / results.PROD_DATA_FOLDER
+    folder.mkdir(parents=True)
+    keys = np.array([parse_address(address) for address in ADDRESSES], ADDRESS_DTYPE)
+    np.save(folder / "addresses.npy", keys)
+    np.save(folder / "probas.npy", np.array(PROBAS, dtype=np.float32))
+    np.save(folder / "values.npy", np.arange(len(ADDRESSES), dtype=np.float32))
+    (folder / "user_groups.json").write_text(json.dumps([]))
+
+    monkeypatch.setattr(store, "root", tmp_path)
+    store.clear()
+    app = FastAPI()
+    app.include_router(results.router)
+    yield TestClient(app)
+    store.clear()
+
+
+def test_address_hit(client):
+    response = client.get(f"/results/protocol/address/{ADDRESSES[3]}")
+    assert response.status_code == 200
+    assert response.json() == {
+        "address": ADDRESSES[3],
+        "proba": pytest.approx(0.9),
+        "percentile": 75.0,
+    }
+
+
+def test_address_mixed_case(client):
+    address = ADDRESSES[2].upper().replace("0X", "0x")
+    response = client.get(f"/results/protocol/address/{address}")
+    assert response.status_code == 200
+    assert response.json()["percentile"] == 25.0
+
+
+def test_address_miss(client):
+    response = client.get("/results/protocol/address/0x" + "00" * 20)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("address", ["0x1234", "0x" + "zz" * 20])
+def test_invalid_address(client, address):
+    assert client.get(f"/results/protocol/address/{address}").status_code == 422
+    response = client.post(
+        "/results/protocol/address", json={"addresses": [ADDRESSES[0], address]}
+    )
+    assert response.status_code == 422
+
+
+def test_unknown_protocol(client):
+    assert client.get(f"/results/other/address/{ADDRESSES[0]}").status_code == 404
+
+
+def test_address_batch(client):
+    missing = "0x" + "00" * 20
+    response = client.post(
+        "/results/protocol/address", json={"addresses": [ADDRESSES[1], missing, ADDRESSES[0]]}
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"address": ADDRESSES[1], "proba": pytest.approx(0.2), "percentile": 25.0},
+        {"address": missing, "proba": None, "percentile": None},
+        {"address": ADDRESSES[0], "proba": pytest.approx(0.1), "percentile": 0.0},
+    ]
+
+
+def test_empty_batch(client):
+    response = client.post("/results/protocol/address", json={"addresses": []})
+    assert response.status_code == 200
+    assert response.json() == []
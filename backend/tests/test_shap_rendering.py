@@ -0,0 +1,38 @@
+import io
+
+import numpy as np
+import pytest
+
+import shap_rendering
+
+# The pipeline is not a dependency of the backend: only checked where both are
+rendering = pytest.importorskip("ml_pipeline.rendering")
+
+
+def _png(figure) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def shap_values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(40, 12)).astype(np.float32)
+    features = rng.random((40, 12)).astype(np.float32)
+    features[3, 2] = np.nan
+    return values, features, [f"feature {i}" for i in range(12)]
+
+
+def test_same_waterfall_as_the_pipeline(shap_values):
+    values, features, names = shap_values
+    assert _png(shap_rendering.plot_waterfall(values[0], features[0], names, 0.3)) == _png(
+        rendering.plot_waterfall(values[0], features[0], names, 0.3)
+    )
+
+
+def test_same_beeswarm_as_the_pipeline(shap_values):
+    values, features, names = shap_values
+    assert _png(shap_rendering.plot_beeswarm(values, features, names, max_points=30)) == _png(
+        rendering.plot_beeswarm(values, features, names, max_points=30)
+    )
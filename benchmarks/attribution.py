@@ -0,0 +1,108 @@
+import argparse
+import warnings
+from time import perf_counter
+
+import numpy as np
+import shap
+import torch
+from torch import nn
+
+from ml_pipeline.attribution import DeepLiftExplainer, mlp_layers
+from ml_pipeline.model import FCModel, ModelWrapper
+from ml_pipeline.shap_plots import kmeans_background, shap_matrix
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="SHAP attribution benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000],
+        help="Number of rows explained",
+    )
+    parser.add_argument(
+        "--n-features",
+        type=int,
+        default=23,
+        help="Number of model inputs",
+    )
+    parser.add_argument(
+        "--background",
+        type=int,
+        default=100,
+        help="k-means clusters of the background",
+    )
+    parser.add_argument(
+        "--max-sampled-size",
+        type=int,
+        default=1_000,
+        help="Largest size for which shap's GradientExplainer and DeepExplainer are timed",
+    )
+    return parser.parse_args()
+
+
+def make_data(n_rows: int, n_features: int, seed: int = 1534) -> np.ndarray:
+    # Skewed, standardized features, like the scaled activity counts
+    rng = np.random.default_rng(seed=seed)
+    X = rng.lognormal(sigma=1.0, size=(n_rows, n_features)).astype(np.float32)
+    return (X - X.mean(axis=0)) / X.std(axis=0)
+
+
+def timed(fn, *args, **kwargs) -> tuple[float, np.ndarray]:
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def main():
+    args = get_arguments()
+    torch.manual_seed(1534)
+    model = ModelWrapper(FCModel(args.n_features)).eval()
+    # shap's DeepExplainer only sees nn.ReLU modules, not torch.relu calls
+    sequential = nn.Sequential(*mlp_layers(model)).eval()
+    background = torch.from_numpy(
+        kmeans_background(make_data(10_000, args.n_features, seed=0), args.background)
+    )
+
+    deeplift = DeepLiftExplainer(model, background)
+    gradient = shap.GradientExplainer(model, background)
+    deep = shap.DeepExplainer(sequential, background)
+
+    print("Rows explained per second")
+    print(f"{'rows':>10} {'gradient':>10} {'deep':>10} {'deeplift':>10}")
+    for n_rows in args.sizes:
+        X = torch.from_numpy(make_data(n_rows, args.n_features))
+        seconds, _ = timed(deeplift.shap_values, X)
+        sampled = [f"{'-':>10}", f"{'-':>10}"]
+        if n_rows <= args.max_sampled_size:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                gradient_seconds, _ = timed(gradient.shap_values, X, rseed=0)
+                deep_seconds, _ = timed(deep.shap_values, X)
+            sampled = [f"{n_rows / gradient_seconds:10.0f}", f"{n_rows / deep_seconds:10.0f}"]
+        print(f"{n_rows:>10} {sampled[0]} {sampled[1]} {n_rows / seconds:10.0f}")
+
+    # Accuracy on the smallest size
+    X = torch.from_numpy(make_data(min(args.sizes), args.n_features))
+    with torch.no_grad():
+        outputs = model(X)[:, 0].numpy()
+    deeplift_values = deeplift.shap_values(X)
+    gradient_values = shap_matrix(gradient.shap_values(X, rseed=0))
+    deep_values = shap_matrix(deep.shap_values(X))
+
+    print(f"\nAccuracy on {len(X)} rows (attributions up to {np.abs(deep_values).max():.3g})")
+    print(f"{'method':>10} {'max |sum - (f(x) - E[f])|':>26} {'max |diff| to deep':>19}")
+    for name, values in (
+        ("gradient", gradient_values),
+        ("deep", deep_values),
+        ("deeplift", deeplift_values),
+    ):
+        additivity = np.abs(values.sum(axis=1) + deeplift.expected_value - outputs).max()
+        print(f"{name:>10} {additivity:26.2e} {np.abs(values - deep_values).max():19.2e}")
+    correlation = np.corrcoef(gradient_values.ravel(), deeplift_values.ravel())[0, 1]
+    print(f"\nCorrelation of deeplift and gradient attributions: {correlation:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.postprocessing import generate_prod_arrays, generate_user_probas
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Post-processing benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000, 10_000_000],
+        help="Number of rows of each synthetic prod DataFrame",
+    )
+    parser.add_argument(
+        "--max-iterrows-size",
+        type=int,
+        default=100_000,
+        help="Largest size for which the iterrows baseline is timed",
+    )
+    return parser.parse_args()
+
+
+def make_prod_df(n_rows: int, nan_fraction: float = 0.01, seed: int = 1534) -> pd.DataFrame:
+    rng = np.random.default_rng(seed=seed)
+    keys = rng.integers(0, 256, size=(n_rows, 20), dtype=np.uint8)
+    predictions = rng.random(n_rows, dtype=np.float32)
+    predictions[rng.random(n_rows) < nan_fraction] = np.nan
+    return pd.DataFrame(
+        {
+            "User Address": hex_addresses(keys),
+            "prediction": predictions,
+            "Transactions": rng.integers(1, 1000, size=n_rows).astype(np.float32),
+        }
+    )
+
+
+def hex_addresses(keys: np.ndarray) -> np.ndarray:
+    digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    chars = np.empty((len(keys), 42), dtype=np.uint8)
+    chars[:, 0] = ord("0")
+    chars[:, 1] = ord("x")
+    chars[:, 2::2] = digits[keys >> 4]
+    chars[:, 3::2] = digits[keys & 0x0F]
+    return chars.view("S42").reshape(-1).astype(str).astype(object)
+
+
+def iterrows_user_probas(df: pd.DataFrame) -> dict[str, float]:
+    # Previous implementation, followed by the cleaner_script NaN filter
+    user_probas = {
+        row["User Address"]: float(row["prediction"]) for _, row in df.iterrows()
+    }
+    return {k: v for k, v in user_probas.items() if v == v}
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = perf_counter()
+    fn(*args, **kwargs)
+    return perf_counter() - start
+
+
+def main():
+    args = get_arguments()
+    print(f"{'rows':>12} {'iterrows (s)':>14} {'dict (s)':>10} {'arrays (s)':>11}")
+    for n_rows in args.sizes:
+        df = make_prod_df(n_rows)
+        baseline = (
+            f"{timed(iterrows_user_probas, df):14.3f}"
+            if n_rows <= args.max_iterrows_size
+            else f"{'-':>14}"
+        )
+        vectorized = timed(generate_user_probas, df)
+        columnar = timed(generate_prod_arrays, df, value_col="Transactions")
+        print(f"{n_rows:>12} {baseline} {vectorized:10.3f} {columnar:11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from typing import Union
+
+import numpy as np
+import torch
+from torch import nn
+
+from ml_pipeline.model import DynamicFCModel, FCModel, ModelWrapper
+
+# Chunks of rows are sized so that the (rows, background rows, layer width)
+# multipliers stay around this many elements: larger chunks are slower, as
+# their intermediates no longer fit in the CPU caches
+MAX_MULTIPLIER_ELEMENTS = 1 << 20
+
+
+def mlp_layers(model: nn.Module) -> list[nn.Module]:
+    """
+    The model as a flat list of nn.Linear, nn.ReLU and nn.Sigmoid layers.
+
+    Supports the single output MLPs of ml_pipeline.model (optionally in a
+    ModelWrapper) and nn.Sequential stacks of those layers.
+    """
+    if isinstance(model, (nn.Linear, nn.ReLU, nn.Sigmoid)):
+        return [model]
+    if isinstance(model, ModelWrapper):
+        return mlp_layers(model.model) + [nn.Sigmoid()]
+    if isinstance(model, FCModel):
+        return [
+            model.fc1,
+            nn.ReLU(),
+            model.fc2,
+            nn.ReLU(),
+            model.fc3,
+            nn.ReLU(),
+            model.output,
+        ]
+    if isinstance(model, DynamicFCModel):
+        assert not model.is_multiclass_classification, "Only single output models are supported"
+        layers = [model.fc_start, nn.ReLU()]
+        for fc in model.fc_hiddens:
+            layers += [fc, nn.ReLU()]
+        layers.append(model.fc_end)
+        if model.is_binary_classification:
+            layers.append(nn.Sigmoid())
+        return layers
+    if isinstance(model, nn.Sequential):
+        return [layer for module in model for layer in mlp_layers(module)]
+    raise TypeError(f"Unsupported model {type(model).__name__}")
+
+
+class DeepLiftExplainer:
+    """
+    DeepLIFT (rescale rule) attributions of an MLP, averaged over a
+    background as shap's DeepExplainer does.
+
+    For each row x and background row r, the multipliers are propagated
+    back in closed form: through Linear layers by their weights and through
+    ReLU and sigmoid by the secant slope (g(z_x) - g(z_r)) / (z_x - z_r).
+    The attributions of x add up exactly to f(x) minus the mean output over
+    the background (expected_value), and a chunk of rows costs one forward
+    pass and a few batched matrix products, instead of the hundreds of
+    sampled gradients of GradientExplainer.
+    """
+
+    def __init__(self, model: nn.Module, background: Union[torch.Tensor, np.ndarray]):
+        self.layers = mlp_layers(model)
+        # Repeated background rows (as k-means summaries are) become weights
+        references, counts = np.unique(
+            np.asarray(background, dtype=np.float32), axis=0, return_counts=True
+        )
+        self.references = torch.from_numpy(references)
+        self.weights = torch.from_numpy(counts / counts.sum()).float()
+        with torch.no_grad():
+            self.reference_activations = self._forward(self.references)
+        self.expected_value = float(self.weights @ self.reference_activations[-1][:, 0])
+
+    def _forward(self, X: torch.Tensor) -> list[torch.Tensor]:
+        # Input of every layer, then the output
+        activations = [X]
+        for layer in self.layers:
+            activations.append(layer(activations[-1]))
+        return activations
+
+    @torch.no_grad()
+    def _explain(self, X: torch.Tensor) -> torch.Tensor:
+        activations = self._forward(X)
+        multipliers = torch.ones(len(X), len(self.references), 1)
+        for i in reversed(range(len(self.layers))):
+            layer = self.layers[i]
+            if isinstance(layer, nn.Linear):
+                multipliers = multipliers @ layer.weight
+                continue
+
+            z_x, z_r = activations[i][:, None], self.reference_activations[i][None]
+            g_x, g_r = activations[i + 1][:, None], self.reference_activations[i + 1][None]
+            dz = z_x - z_r
+            # Where x and r (nearly) coincide, the secant is the derivative at x
+            if isinstance(layer, nn.ReLU):
+                derivative = (z_x > 0).float()
+            else:
+                derivative = g_x * (1 - g_x)
+            distinct = dz.abs() > 1e-6
+            secant = (g_x - g_r) / torch.where(distinct, dz, torch.ones_like(dz))
+            multipliers = multipliers * torch.where(distinct, secant, derivative)
+
+        deltas = X[:, None] - self.references[None]
+        return (multipliers * deltas * self.weights[None, :, None]).sum(dim=1)
+
+    def shap_values(self, X: Union[torch.Tensor, np.ndarray]) -> np.ndarray:
+        """
+        Attributions of the rows of X, as a (rows, features) float32 array.
+        """
+        X = torch.as_tensor(np.asarray(X, dtype=np.float32))
+        width = max(layer.weight.shape[1] for layer in self.layers if isinstance(layer, nn.Linear))
+        chunk_size = max(1, MAX_MULTIPLIER_ELEMENTS // (len(self.references) * width))
+        return torch.cat(
+            [self._explain(X[i : i + chunk_size]) for i in range(0, len(X), chunk_size)]
+        ).numpy()
@@ -24,8 +24,8 @@ with open(data_file, "r") as fp:
     data = json.load(fp)
 
 new_data = {
+    **data,
     "user_probas": {k: v for k, v in data["user_probas"].items() if not is_nan(v)},
-    "user_groups": data["user_groups"],
 }
 
 with open(data_file, "w") as fp:
@@ -1,137 +1,329 @@
-import itertools
+import copy
+import json
 from pathlib import Path
-from typing import List
+from typing import List, Union
 
-import matplotlib.pyplot as plt
+import numpy as np
 import torch
-from matplotlib.axes import Axes
+from scipy.special import expit
 from sklearn.metrics import (
+    average_precision_score,
     classification_report,
     confusion_matrix,
+    log_loss,
     mean_absolute_error,
     mean_squared_error,
     precision_recall_curve,
     r2_score,
+    roc_auc_score,
 )
+from torch.func import functional_call, stack_module_state, vmap
 
+# The evaluations are returned as the data of their plots, which
+# ml_pipeline.rendering draws, and as metrics: nothing is rendered here.
 
-def evaluate_models_bc(
+DEFAULT_THRESHOLDS = [0.3, 0.4, 0.5, 0.6, 0.7]
+# Metrics models can be selected on, and whether higher is better
+SELECTION_METRICS = {
+    "classification": {
+        "pr_auc": True,
+        "roc_auc": True,
+        "accuracy": True,
+        "log_loss": False,
+        "brier": False,
+        "ece": False,
+    },
+    "regression": {"mse": False, "rmse": False, "mae": False, "r2": True},
+}
+DEFAULT_SELECTION_METRIC = {"classification": "pr_auc", "regression": "mse"}
+# Selected on when no model has the selection metric (e.g. ranking metrics
+# on a single class test set)
+FALLBACK_SELECTION_METRIC = {"classification": "log_loss", "regression": "mse"}
+
+
+def model_outputs(
+    models: List[torch.nn.Module],
+    X: torch.Tensor,
+    chunk_size: int = 65536,
+) -> np.ndarray:
+    """
+    Outputs of every model on the rows of X, as a (models, rows) float32
+    array.
+
+    The models (folds of one architecture) are stacked and vmapped as in
+    training.train_ensemble, so each chunk of rows goes through all of them
+    in one inference mode pass.
+    """
+    params, buffers = stack_module_state([model.eval() for model in models])
+    base_model = copy.deepcopy(models[0]).to("meta")
+
+    def forward(member_params, member_buffers, x):
+        return functional_call(base_model, (member_params, member_buffers), (x,))
+
+    batched_forward = vmap(forward, in_dims=(0, 0, None))
+    with torch.inference_mode():
+        return torch.cat(
+            [
+                batched_forward(params, buffers, X[start : start + chunk_size]).reshape(
+                    len(models), -1
+                )
+                for start in range(0, len(X), chunk_size)
+            ],
+            dim=1,
+        ).numpy()
+
+
+def _single_class_safe(metric, y: np.ndarray, outputs: np.ndarray) -> Union[float, None]:
+    # Ranking metrics are undefined on a test set with a single class
+    if len(np.unique(y)) < 2:
+        return None
+    return float(metric(y, outputs))
+
+
+def calibration_bins(y: np.ndarray, probabilities: np.ndarray, n_bins: int = 10) -> dict:
+    """
+    Mean probability, fraction of positives and row count of n_bins equal
+    width probability bins (empty bins have None means).
+    """
+    bins = np.clip((probabilities * n_bins).astype(int), 0, n_bins - 1)
+    counts = np.bincount(bins, minlength=n_bins)
+    probability_sums = np.bincount(bins, weights=probabilities, minlength=n_bins)
+    positive_sums = np.bincount(bins, weights=y, minlength=n_bins)
+    nonempty = counts > 0
+    return dict(
+        mean_probability=[
+            float(p / c) if c else None for p, c in zip(probability_sums, counts)
+        ],
+        fraction_positive=[float(p / c) if c else None for p, c in zip(positive_sums, counts)],
+        count=counts.tolist(),
+        # Expected calibration error: mean gap weighted by the bin sizes
+        ece=float(
+            np.abs(probability_sums[nonempty] - positive_sums[nonempty]).sum() / len(y)
+        ),
+    )
+
+
+def classification_metrics(
+    y: np.ndarray,
+    probabilities: np.ndarray,
+    thresholds: List[float] = DEFAULT_THRESHOLDS,
+) -> dict:
+    y = np.asarray(y, dtype=np.float64)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    calibration = calibration_bins(y, probabilities)
+    metrics = dict(
+        roc_auc=_single_class_safe(roc_auc_score, y, probabilities),
+        pr_auc=_single_class_safe(average_precision_score, y, probabilities),
+        log_loss=float(log_loss(y, probabilities, labels=[0, 1])),
+        brier=float(np.mean((probabilities - y) ** 2)),
+        ece=calibration.pop("ece"),
+        accuracy=float(np.mean((probabilities > 0.5) == (y > 0.5))),
+        calibration=calibration,
+        thresholds={},
+    )
+    for threshold in thresholds:
+        (tn, fp), (fn, tp) = confusion_matrix(y > 0.5, probabilities > threshold, labels=[0, 1])
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        metrics["thresholds"][str(threshold)] = dict(
+            confusion_matrix=[[int(tn), int(fp)], [int(fn), int(tp)]],
+            precision=float(precision),
+            recall=float(recall),
+            f1=float(2 * precision * recall / (precision + recall)) if precision + recall else 0.0,
+        )
+    return metrics
+
+
+def regression_metrics(y: np.ndarray, predictions: np.ndarray) -> dict:
+    mse = float(mean_squared_error(y, predictions))
+    return dict(
+        mse=mse,
+        rmse=float(np.sqrt(mse)),
+        mae=float(mean_absolute_error(y, predictions)),
+        r2=float(r2_score(y, predictions)),
+    )
+
+
+def select_model(
+    model_metrics: List[dict],
+    task: str,
+    metric: Union[str, None] = None,
+) -> int:
+    """
+    Index of the best model on metric (by default the task's
+    DEFAULT_SELECTION_METRIC). Models without metrics (None, as the ones
+    with non-finite outputs) or without the metric (None or NaN, as ranking
+    metrics on a single class test set) are never selected.
+    """
+    metric = metric or DEFAULT_SELECTION_METRIC[task]
+    assert metric in SELECTION_METRICS[task], f"Cannot select {task} models on {metric}"
+    scores = np.array(
+        [
+            m[metric] if m is not None and m[metric] is not None else np.nan
+            for m in model_metrics
+        ],
+        dtype=float,
+    )
+    if np.isnan(scores).all():
+        raise ValueError(f"No model has a {metric} to be selected on")
+    best = np.nanargmax if SELECTION_METRICS[task][metric] else np.nanargmin
+    return int(best(scores))
+
+
+def evaluate_models(
     models: List[torch.nn.Module],
     test_X: torch.Tensor,
     test_y: torch.Tensor,
-    save_to: str = None,
-) -> None:
-    plt.figure(figsize=(6, 6))
-
-    # Plotting Precision-Recall curves for all models
-    for i, model in enumerate(models):
-        model.eval()  # Set the model to evaluation mode
-        with torch.no_grad():
-            outputs = torch.sigmoid(model(test_X).squeeze())
-
-        precision, recall, thresholds = precision_recall_curve(test_y, outputs)
-        plt.plot(recall, precision, marker=".", label=f"Model {i+1}")
-
-    plt.title("Precision-Recall Curve")
-    plt.xlabel("Recall")
-    plt.ylabel("Precision")
-    plt.grid()
-    plt.xlim(0, 1)
-    plt.ylim(0, 1)
-    plt.legend()
-
-    if save_to is not None:
-        plt.savefig(Path(save_to) / "precision_recall_curve.png")
+    is_classification: bool,
+    thresholds: List[float] = DEFAULT_THRESHOLDS,
+    selection_metric: Union[str, None] = None,
+    model_selected: Union[int, None] = None,
+) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Evaluate every model on the test set from a single pass of model_outputs.
+
+    Returns the plot data (with the outputs) and the metrics: those of
+    each model, and the model selected, either model_selected or the best
+    on selection_metric (see select_model). Models with NaN or infinite
+    outputs get None metrics and empty curves. When no model has the
+    selection metric, the best on the task's FALLBACK_SELECTION_METRIC is
+    selected, or else the first model, with a warning.
+    """
+    task = "classification" if is_classification else "regression"
+    # The plotted confusion matrices are the ones at 0.5
+    thresholds = sorted(set(thresholds) | {0.5})
+    test_y = np.asarray(test_y).reshape(-1)
+    outputs = model_outputs(models, test_X)
+    finite = np.isfinite(outputs).all(axis=1)
+    for i in np.flatnonzero(~finite):
+        print(f"Warning: model {i} has non-finite outputs, it is not evaluated")
+
+    if is_classification:
+        probabilities = expit(outputs)
+        evaluation = dict(test_y=test_y, outputs=outputs, probabilities=probabilities)
+        model_metrics = []
+        for i, model_probabilities in enumerate(probabilities):
+            if not finite[i]:
+                evaluation[f"precision_{i}"] = evaluation[f"recall_{i}"] = np.array([])
+                model_metrics.append(None)
+                continue
+            precision, recall, _ = precision_recall_curve(test_y, model_probabilities)
+            evaluation[f"precision_{i}"] = precision
+            evaluation[f"recall_{i}"] = recall
+            model_metrics.append(classification_metrics(test_y, model_probabilities, thresholds))
+        # NaN for the models not evaluated
+        evaluation["confusion_matrices"] = np.array(
+            [
+                m["thresholds"]["0.5"]["confusion_matrix"] if m is not None else [[np.nan] * 2] * 2
+                for m in model_metrics
+            ]
+        )
     else:
-        plt.show()
-
-    # Confusion matrices
-    num_models = len(models)
-    fig, axs = plt.subplots(1, num_models, figsize=(6 * num_models, 6))
-    if num_models == 1:
-        axs = [axs]  # Ensure axs is iterable for a single model
-
-    for i, model in enumerate(models):
-        with torch.no_grad():
-            outputs = torch.sigmoid(model(test_X).squeeze())
-        predictions = (outputs > 0.5).int()
-        conf_matrix = confusion_matrix(test_y, predictions)
-
-        ax: Axes = axs[i]
-        cax = ax.matshow(conf_matrix, cmap=plt.cm.Blues)
-        fig.colorbar(cax, ax=ax)
-        ax.set_title(f"Model {i+1}")
-        ax.set_xlabel("Predicted")
-        ax.set_ylabel("True")
-
-        # Annotate each cell with the numeric value
-        for j, k in itertools.product(
-            range(conf_matrix.shape[0]), range(conf_matrix.shape[1])
-        ):
-            ax.text(
-                k,
-                j,
-                f"{conf_matrix[j, k]}",
-                ha="center",
-                va="center",
-                color="white" if conf_matrix[j, k] > conf_matrix.max() / 2 else "black",
-                size=40,
-            )
-
-    plt.tight_layout()
-
-    if save_to is not None:
-        plt.savefig(Path(save_to) / "confusion_matrices.png")
+        model_metrics = [
+            regression_metrics(test_y, predictions) if is_finite else None
+            for predictions, is_finite in zip(outputs, finite)
+        ]
+        evaluation = dict(
+            test_y=test_y,
+            outputs=outputs,
+            predictions=outputs,
+            **{
+                name: np.array([m[name] if m is not None else np.nan for m in model_metrics])
+                for name in ("mse", "mae", "r2")
+            },
+        )
+
+    selection_metric = selection_metric or DEFAULT_SELECTION_METRIC[task]
+    if model_selected is not None:
+        selected = model_selected
+    else:
+        try:
+            selected = select_model(model_metrics, task, selection_metric)
+        except ValueError:
+            fallback = FALLBACK_SELECTION_METRIC[task]
+            try:
+                selected = select_model(model_metrics, task, fallback)
+                print(f"Warning: no model has a {selection_metric}, selected on {fallback}")
+                selection_metric = fallback
+            except ValueError:
+                print(f"Warning: no model has a {selection_metric} or a {fallback}, selected 0")
+                selected, selection_metric = 0, None
+    assert 0 <= selected < len(models), f"No model {selected} among {len(models)}"
+    metrics = dict(
+        task=task,
+        n_test=len(test_y),
+        positive_rate=float(np.mean(test_y > 0.5)) if is_classification else None,
+        selection=dict(
+            metric=selection_metric,
+            model=selected,
+            automatic=model_selected is None,
+        ),
+        models=model_metrics,
+    )
+    return evaluation, metrics
+
+
+def print_metrics(metrics: dict) -> None:
+    names = list(SELECTION_METRICS[metrics["task"]])
+    print(f"{'model':>6} " + " ".join(f"{name:>9}" for name in names))
+    for i, model_metrics in enumerate(metrics["models"]):
+        values = [model_metrics[name] if model_metrics is not None else None for name in names]
+        row = " ".join(f"{v:9.4f}" if v is not None else f"{'-':>9}" for v in values)
+        marker = " *" if i == metrics["selection"]["model"] else ""
+        print(f"{i:>6} {row}{marker}")
+    selection = metrics["selection"]
+    if not selection["automatic"]:
+        how = "given"
+    elif selection["metric"] is None:
+        how = "no model could be evaluated"
     else:
-        plt.show()
-
-    # Print classification reports
-    for i, model in enumerate(models):
-        with torch.no_grad():
-            outputs = torch.sigmoid(model(test_X).squeeze())
-        predictions = (outputs > 0.5).int()
-        conf_matrix = confusion_matrix(test_y, predictions)
-        classification_report_model = classification_report(test_y, predictions)
+        how = f"best {selection['metric']}"
+    print(f"Selected model {selection['model']} ({how})")
+
+
+def evaluate_models_bc(
+    models: List[torch.nn.Module],
+    test_X: torch.Tensor,
+    test_y: torch.Tensor,
+) -> dict[str, np.ndarray]:
+    """
+    Precision-recall curve (recall_i and precision_i) and confusion matrix
+    at 0.5 of each model i on the test set, and print their classification
+    reports.
+    """
+    evaluation, metrics = evaluate_models(models, test_X, test_y, is_classification=True)
+    for i, probabilities in enumerate(evaluation["probabilities"]):
         print(f"Classification Report for Model {i+1}:")
-        print(classification_report_model)
+        print(classification_report(evaluation["test_y"], (probabilities > 0.5).astype(int)))
+    print_metrics(metrics)
+    return evaluation
 
 
 def evaluate_models_regression(
     models: List[torch.nn.Module],
     test_X: torch.Tensor,
     test_y: torch.Tensor,
-    save_to: str = None,
-) -> None:
-    num_models = len(models)
-    fig, axs = plt.subplots(1, num_models, figsize=(6 * num_models, 6))
-
-    # Adjust for a single model
-    if num_models == 1:
-        axs = [axs]
-
-    for i, model in enumerate(models):
-        model.eval()  # Set the model to evaluation mode
-        with torch.no_grad():
-            predictions = model(test_X).squeeze()
-
-        # Calculate metrics
-        mse = mean_squared_error(test_y, predictions)
-        mae = mean_absolute_error(test_y, predictions)
-        r2 = r2_score(test_y, predictions)
-
-        # Plotting Actual vs Predicted values
-        ax: Axes = axs[i]
-        ax.scatter(test_y, predictions, alpha=0.3)
-        ax.plot([test_y.min(), test_y.max()], [test_y.min(), test_y.max()], "k--", lw=2)
-        ax.set_title(f"Model {i+1} - MSE: {mse:.2f}, MAE: {mae:.2f}, R²: {r2:.2f}")
-        ax.set_xlabel("Actual")
-        ax.set_ylabel("Predicted")
-
-        # Print metrics
-        print(f"Model {i+1} - MSE: {mse:.2f}, MAE: {mae:.2f}, R²: {r2:.2f}")
-
-    plt.tight_layout()
-    if save_to is not None:
-        plt.savefig(Path(save_to) / "actual_vs_predicted.png")
-    else:
-        plt.show()
+) -> dict[str, np.ndarray]:
+    """
+    Predictions and MSE, MAE and R² of each model on the test set, printed
+    as well.
+    """
+    evaluation, metrics = evaluate_models(models, test_X, test_y, is_classification=False)
+    print_metrics(metrics)
+    return evaluation
+
+
+def save_evaluation(evaluation: dict[str, np.ndarray], path: Path) -> None:
+    # np.savez appends .npz to other suffixes
+    with Path(path).open("wb") as f:
+        np.savez(f, **evaluation)
+
+
+def save_metrics(metrics: dict, path: Path) -> None:
+    with Path(path).open("w") as f:
+        json.dump(metrics, f, indent=2)
+
+
+def load_metrics(path: Path) -> dict:
+    with Path(path).open() as f:
+        return json.load(f)
@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Iterator, Union
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureStore:
+    """
+    Per-protocol feature table stored as Parquet, partitioned by month.
+
+    Layout: root / "{month_col}=YYYY-MM-DD" / "part-NNNNN.parquet". Months are
+    only ever appended, so ingesting a file with a new month writes just that
+    month, and reads only open the partitions and columns they ask for.
+    root / ".ingested.json" records the files already ingested.
+    """
+
+    def __init__(self, root: Path, month_col: str = "month_start"):
+        self.root = Path(root)
+        self.month_col = month_col
+
+    def months(self) -> list[str]:
+        if not self.root.is_dir():
+            return []
+        prefix = f"{self.month_col}="
+        return sorted(
+            p.name[len(prefix) :]
+            for p in self.root.iterdir()
+            if p.is_dir() and p.name.startswith(prefix)
+        )
+
+    def partition_path(self, month: str) -> Path:
+        return self.root / f"{self.month_col}={month}"
+
+    @property
+    def _ingested_path(self) -> Path:
+        return self.root / ".ingested.json"
+
+    def _ingested(self) -> dict[str, list[int]]:
+        if not self._ingested_path.is_file():
+            return {}
+        return json.loads(self._ingested_path.read_text())
+
+    def _record_ingested(self, data_file: Path) -> None:
+        stat = Path(data_file).stat()
+        ingested = self._ingested()
+        ingested[str(Path(data_file).resolve())] = [stat.st_size, stat.st_mtime_ns]
+        tmp_path = self._ingested_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(ingested))
+        os.replace(tmp_path, self._ingested_path)
+
+    def file_months(self, data_file: Path, chunksize: int = 500_000) -> set[str]:
+        # Only the month column is parsed
+        months = set()
+        for chunk in pd.read_csv(
+            data_file, usecols=[self.month_col], parse_dates=[self.month_col], chunksize=chunksize
+        ):
+            months.update(chunk[self.month_col].dt.strftime("%Y-%m-%d").unique())
+        return months
+
+    def ingest(
+        self,
+        data_file: Path,
+        numeric_cols: Union[list[str], None] = None,
+        chunksize: int = 500_000,
+        overwrite: bool = False,
+    ) -> list[str]:
+        """
+        Append the months of a feature CSV that are not in the store yet.
+
+        A file already ingested (same path, size and mtime) is skipped, and
+        so is one whose months, read from the month column alone, are all in
+        the store. Otherwise the CSV is streamed in chunks and each chunk is
+        split by month into its own part file. New partitions are written to
+        a staging folder and moved into place at the end, so a failed
+        ingestion leaves the store untouched. Returns the months written.
+        """
+        existing = set() if overwrite else set(self.months())
+        if not overwrite:
+            stat = Path(data_file).stat()
+            if self._ingested().get(str(Path(data_file).resolve())) == [
+                stat.st_size,
+                stat.st_mtime_ns,
+            ]:
+                print(f"{data_file} is already ingested into {self.root}")
+                return []
+            if self.file_months(data_file, chunksize) <= existing:
+                print(f"All months of {data_file} are in {self.root}")
+                self._record_ingested(data_file)
+                return []
+
+        staging = self.root / f".staging-{uuid.uuid4().hex}"
+        staging.mkdir(parents=True)
+
+        written = set()
+        try:
+            reader = pd.read_csv(
+                data_file,
+                dtype={c: np.float32 for c in numeric_cols or []},
+                parse_dates=[self.month_col],
+                chunksize=chunksize,
+            )
+            for chunk_idx, chunk in enumerate(reader):
+                months = chunk[self.month_col].dt.strftime("%Y-%m-%d")
+                for month, month_chunk in chunk.groupby(months, sort=False):
+                    if month in existing:
+                        continue
+                    partition = staging / self.partition_path(month).name
+                    partition.mkdir(exist_ok=True)
+                    month_chunk.to_parquet(
+                        partition / f"part-{chunk_idx:05d}.parquet", index=False
+                    )
+                    written.add(month)
+
+            for month in sorted(written):
+                target = self.partition_path(month)
+                if target.exists():
+                    shutil.rmtree(target)
+                (staging / target.name).replace(target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self._record_ingested(data_file)
+
+        print(f"Ingested months {sorted(written)} into {self.root}")
+        return sorted(written)
+
+    def iter_partitions(
+        self,
+        months: list[str],
+        columns: Union[list[str], None] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Yield the part files of the given months, reading only `columns`.
+        """
+        for month in months:
+            partition = self.partition_path(month)
+            assert partition.is_dir(), f"Month {month} not in feature store {self.root}"
+            for part in sorted(partition.glob("part-*.parquet")):
+                yield pd.read_parquet(part, columns=columns)
+
+    def read(
+        self,
+        months: list[str],
+        columns: Union[list[str], None] = None,
+    ) -> pd.DataFrame:
+        return pd.concat(self.iter_partitions(months, columns), ignore_index=True)
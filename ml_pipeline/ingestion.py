@@ -0,0 +1,114 @@
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline.feature_store import FeatureStore
+
+
+def read_feature_file(
+    data_file: Path,
+    feature_renames: dict[str, str],
+    label_cols: list[str],
+    holdout_months: list[str],
+    prod_months: list[str],
+    user_col: str = "User Address",
+    month_col: str = "month_start",
+    chunksize: int = 500_000,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Stream the feature CSV in chunks and split it into the training and prod partitions.
+
+    Only the needed columns are read, with float32 features and labels and a
+    parsed month column. Rows are routed as they are read: months not in
+    holdout_months go to the training partition (with NaNs filled with 0),
+    months in prod_months go to the prod partition. Both partitions come back
+    with features renamed and categorical addresses.
+    """
+    numeric_cols = list(feature_renames.keys()) + list(label_cols)
+    reader = pd.read_csv(
+        data_file,
+        usecols=[user_col, month_col] + numeric_cols,
+        dtype={c: np.float32 for c in numeric_cols},
+        parse_dates=[month_col],
+        chunksize=chunksize,
+    )
+    return _split_partitions(
+        reader,
+        feature_renames=feature_renames,
+        label_cols=label_cols,
+        holdout_months=holdout_months,
+        prod_months=prod_months,
+        user_col=user_col,
+        month_col=month_col,
+    )
+
+
+def read_feature_store(
+    store: FeatureStore,
+    feature_renames: dict[str, str],
+    label_cols: list[str],
+    holdout_months: list[str],
+    prod_months: list[str],
+    user_col: str = "User Address",
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Same as read_feature_file, but only reading the month partitions and
+    columns needed from a FeatureStore.
+    """
+    available_months = store.months()
+    ml_months = [m for m in available_months if m not in holdout_months]
+    prod_months = [m for m in available_months if m in prod_months]
+    columns = [user_col, store.month_col] + list(feature_renames.keys()) + list(label_cols)
+
+    return _split_partitions(
+        store.iter_partitions(ml_months + prod_months, columns),
+        feature_renames=feature_renames,
+        label_cols=label_cols,
+        holdout_months=holdout_months,
+        prod_months=prod_months,
+        user_col=user_col,
+        month_col=store.month_col,
+    )
+
+
+def _split_partitions(
+    chunks: Iterable[pd.DataFrame],
+    feature_renames: dict[str, str],
+    label_cols: list[str],
+    holdout_months: list[str],
+    prod_months: list[str],
+    user_col: str,
+    month_col: str,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    holdout_months = pd.to_datetime(holdout_months)
+    prod_months = pd.to_datetime(prod_months)
+
+    ml_chunks = []
+    prod_chunks = []
+    for chunk in chunks:
+        months = chunk[month_col]
+        ml_chunks.append(chunk[~months.isin(holdout_months)])
+        prod_chunks.append(chunk[months.isin(prod_months)])
+
+    df_to_ml = _finalize(ml_chunks, feature_renames, user_col)
+    df_to_prod = _finalize(prod_chunks, feature_renames, user_col)
+
+    filled_cols = list(feature_renames.values()) + list(label_cols)
+    df_to_ml[filled_cols] = df_to_ml[filled_cols].fillna(0)
+
+    print(f"Read {len(df_to_ml)} training rows and {len(df_to_prod)} prod rows")
+
+    return df_to_ml, df_to_prod
+
+
+def _finalize(
+    chunks: list[pd.DataFrame],
+    feature_renames: dict[str, str],
+    user_col: str,
+) -> pd.DataFrame:
+    df = pd.concat(chunks, ignore_index=True)
+    df.rename(columns=feature_renames, inplace=True)
+    df[user_col] = df[user_col].astype("category")
+    return df
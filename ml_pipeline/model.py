@@ -1,3 +1,5 @@
+import copy
+
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -14,6 +16,22 @@ class ModelWrapper(nn.Module):
         return probabilities
 
 
+class FCModel(nn.Module):
+    def __init__(self, input_size: int, hidden_size: int = 40):
+        super(FCModel, self).__init__()
+        self.fc1 = nn.Linear(input_size, hidden_size)  # First hidden layer
+        self.fc2 = nn.Linear(hidden_size, hidden_size)  # Second hidden layer
+        self.fc3 = nn.Linear(hidden_size, hidden_size)  # Third hidden layer
+        self.output = nn.Linear(hidden_size, 1)  # Output layer
+
+    def forward(self, x):
+        x = torch.relu(self.fc1(x))
+        x = torch.relu(self.fc2(x))
+        x = torch.relu(self.fc3(x))
+        x = self.output(x)
+        return x
+
+
 class DynamicFCModel(nn.Module):
     def __init__(
         self,
@@ -45,3 +63,18 @@ class DynamicFCModel(nn.Module):
         elif self.is_multiclass_classification:
             x = F.softmax(x, dim=1)
         return x
+
+
+def fold_standardization(model: nn.Module, mean, scale) -> nn.Module:
+    """
+    Copy of model taking raw features, with the standardization
+    (x - mean) / scale folded into the weights of its first nn.Linear.
+    """
+    folded = copy.deepcopy(model)
+    first = next(m for m in folded.modules() if isinstance(m, nn.Linear))
+    mean = torch.as_tensor(mean, dtype=first.weight.dtype)
+    scale = torch.as_tensor(scale, dtype=first.weight.dtype)
+    with torch.no_grad():
+        first.bias -= first.weight @ (mean / scale)
+        first.weight /= scale
+    return folded
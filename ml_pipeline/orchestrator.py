@@ -0,0 +1,256 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Union
+
+# torch and the pipeline stages are only imported in the workers, after the
+# thread limits are set, so the parent process stays light.
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "RAYON_NUM_THREADS",
+]
+
+
+def read_manifest(manifest_file: Path) -> dict[str, dict[str, Any]]:
+    """
+    Read the per-protocol pipeline configs from a JSON manifest.
+
+    The manifest has PipelineConfig fields under "defaults", shared by all
+    protocols, and the overrides of each protocol under "protocols", e.g.
+
+        {
+            "defaults": {"epochs": 30, "is_classification": true},
+            "protocols": {
+                "arbitrum": {"data_file": "data/arbitrum.csv"},
+                "base": {"data_file": "data/base.csv", "model_selected": 1}
+            }
+        }
+
+    Relative paths are resolved against the manifest folder.
+    """
+    manifest_file = Path(manifest_file)
+    with manifest_file.open() as f:
+        manifest = json.load(f)
+
+    defaults = manifest.get("defaults", {})
+    configs = {}
+    for protocol, overrides in manifest["protocols"].items():
+        config = {**defaults, **(overrides or {})}
+        for key in ("data_file", "feature_store"):
+            if config.get(key) is not None:
+                config[key] = str(manifest_file.parent / config[key])
+        configs[protocol] = config
+    return configs
+
+
+def _init_worker(n_threads: int) -> None:
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
+    import torch
+
+    # Pay the heavy imports once per worker, not once per protocol
+    import ml_pipeline.stages  # noqa: F401
+
+    torch.set_num_threads(n_threads)
+
+
+def run_protocol(
+    protocol: str,
+    config_kwargs: dict[str, Any],
+    outputs_folder: Path,
+    stages: Union[list[str], None] = None,
+    force: bool = False,
+    threads: Union[int, None] = None,
+) -> dict[str, float]:
+    from ml_pipeline.pipeline import feature_renames
+    from ml_pipeline.stages import PipelineConfig, run_pipeline
+
+    # The stages' own pools share the worker's threads, not the machine's
+    config_kwargs = {"feature_renames": feature_renames, "threads": threads, **config_kwargs}
+    config = PipelineConfig(outputs_folder=outputs_folder, **config_kwargs)
+    config.outputs_folder.mkdir(parents=True, exist_ok=True)
+    print(f"[{protocol}] Running pipeline into {outputs_folder}")
+    return run_pipeline(config, stages=stages, force=force)
+
+
+def run_protocols(
+    configs: dict[str, dict[str, Any]],
+    results_folder: Path,
+    max_workers: int = 2,
+    threads_per_worker: Union[int, None] = None,
+    stages: Union[list[str], None] = None,
+    force: bool = False,
+) -> dict[str, dict[str, Any]]:
+    """
+    Run the pipeline of each protocol into results_folder / protocol.
+
+    Protocols run concurrently in up to max_workers spawned processes, each
+    limited to threads_per_worker CPU threads (by default the CPUs split
+    evenly between workers), which the pools of its stages share. A failing
+    protocol does not stop the others.
+    Returns, per protocol, the wall time of each stage that ran, the total
+    wall time and the error if it failed.
+    """
+    results_folder = Path(results_folder)
+    max_workers = max(1, min(max_workers, len(configs)))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // max_workers)
+
+    report = {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        start_times = {}
+        futures = {}
+        for protocol, config_kwargs in configs.items():
+            start_times[protocol] = time.perf_counter()
+            future = executor.submit(
+                run_protocol,
+                protocol,
+                config_kwargs,
+                results_folder / protocol,
+                stages,
+                force,
+                threads_per_worker,
+            )
+            futures[future] = protocol
+
+        for future in as_completed(futures):
+            protocol = futures[future]
+            try:
+                report[protocol] = dict(stages=future.result(), error=None)
+            except Exception as e:
+                traceback.print_exc()
+                report[protocol] = dict(stages={}, error=f"{type(e).__name__}: {e}")
+            # Includes the time queued behind other protocols
+            report[protocol]["wall_time"] = time.perf_counter() - start_times[protocol]
+            print(f"[{protocol}] {'failed' if report[protocol]['error'] else 'done'}")
+
+    return {protocol: report[protocol] for protocol in configs}
+
+
+def format_report(report: dict[str, dict[str, Any]]) -> str:
+    """
+    Table of the seconds spent per stage (columns) for each protocol (rows).
+    """
+    stage_names = []
+    for protocol_report in report.values():
+        stage_names += [s for s in protocol_report["stages"] if s not in stage_names]
+
+    header = ["protocol"] + stage_names + ["total", "status"]
+    rows = [header]
+    for protocol, protocol_report in report.items():
+        timings = protocol_report["stages"]
+        rows.append(
+            [protocol]
+            + [f"{timings[s]:.1f}" if s in timings else "-" for s in stage_names]
+            + [
+                f"{protocol_report['wall_time']:.1f}",
+                "failed" if protocol_report["error"] else "ok",
+            ]
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows
+    )
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the ML pipeline for several protocols")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        required=True,
+        help="Path to the JSON manifest with the config of each protocol",
+    )
+    parser.add_argument(
+        "--results-folder",
+        type=str,
+        default="backend/results",
+        help="Folder where each protocol's outputs are written, as {results-folder}/{protocol}",
+    )
+    parser.add_argument(
+        "--protocols",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Only run these protocols from the manifest",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=2,
+        help="Number of protocols run concurrently",
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="CPU threads of each worker, by default the CPUs split between workers",
+    )
+    parser.add_argument(
+        "--stage",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Only run these pipeline stages (and the stale stages they depend on)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run the selected stages even if their outputs are up to date",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path to also write the timings report to, as JSON",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_arguments()
+
+    configs = read_manifest(Path(args.manifest))
+    if args.protocols is not None:
+        unknown = set(args.protocols) - set(configs)
+        assert not unknown, f"Protocols {sorted(unknown)} not in the manifest"
+        configs = {p: configs[p] for p in args.protocols}
+
+    report = run_protocols(
+        configs,
+        results_folder=Path(args.results_folder),
+        max_workers=args.max_workers,
+        threads_per_worker=args.threads_per_worker,
+        stages=args.stage,
+        force=args.force,
+    )
+
+    print("\nSeconds per stage:")
+    print(format_report(report))
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = [p for p, r in report.items() if r["error"]]
+    if failed:
+        raise SystemExit(f"Pipelines failed for: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,40 @@
 import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
 
+# Columnar prod data layout, one folder per protocol run (published with
+# staged_folder, so the folder is a link to its current version):
+#   addresses.npy    S20 raw 20-byte addresses, sorted ascending
+#   probas.npy       float32 prediction for each address, NaNs dropped
+#   values.npy       float32 value_col for each address (user group filtering)
+#   user_groups.json group statistics, as in prod_data.json
+PROD_DATA_FOLDER = "prod_data"
+ADDRESS_DTYPE = np.dtype("S20")
+
+# Nibble value of each ASCII code, 255 for non-hex characters
+_HEX_NIBBLES = np.full(128, 255, dtype=np.uint8)
+_HEX_NIBBLES[[ord(c) for c in "0123456789"]] = np.arange(10)
+_HEX_NIBBLES[[ord(c) for c in "abcdef"]] = np.arange(10, 16)
+_HEX_NIBBLES[[ord(c) for c in "ABCDEF"]] = np.arange(10, 16)
+
+
+def _sorted_quantile(sorted_values: np.ndarray, q: float) -> float:
+    # Linear interpolation, as pandas' quantile, on already sorted values
+    if len(sorted_values) == 0:
+        return np.nan
+    position = q * (len(sorted_values) - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
 
 def generate_user_groups(
     groups: list[tuple[str, float, float]],
@@ -11,33 +42,45 @@ def generate_user_groups(
     prediction_col: str,
     value_col: str,
 ) -> list[dict[str, Any]]:
+    """
+    Statistics of prediction_col and value_col for each [lower, higher) bucket of value_col.
+
+    The data is sorted by value_col once, so every bucket is a contiguous
+    slice found with a binary search, and predictions are sorted once within
+    each slice to read all the percentiles.
+    """
+    values = data[value_col].to_numpy(dtype=np.float64)
+    predictions = data[prediction_col].to_numpy(dtype=np.float64)
+
+    order = np.argsort(values, kind="stable")
+    values = values[order]
+    predictions = predictions[order]
+
+    lowers = np.searchsorted(values, [lower for _, lower, _ in groups], side="left")
+    highers = np.searchsorted(values, [higher for _, _, higher in groups], side="left")
+
     groups_data = []
-    for label, lower, higher in groups:
-        data_group = data[(data[value_col] >= lower) & (data[value_col] < higher)]
-        count = len(data_group)
-        mean = data_group[prediction_col].mean()
-        median = data_group[prediction_col].median()
-        pct25 = data_group[prediction_col].quantile(0.25)
-        pct75 = data_group[prediction_col].quantile(0.75)
-        pct10 = data_group[prediction_col].quantile(0.1)
-        pct90 = data_group[prediction_col].quantile(0.9)
-        total_value = data_group[value_col].sum()
-        mean_value = data_group[value_col].mean()
-        median_value = data_group[value_col].median()
+    for (label, lower, higher), start, stop in zip(groups, lowers, highers):
+        stop = max(start, stop)
+        group_values = values[start:stop]
+        group_predictions = np.sort(predictions[start:stop])
+        # NaN predictions are counted but sorted last and left out of the stats
+        group_predictions = group_predictions[: np.count_nonzero(~np.isnan(group_predictions))]
+        count = len(group_values)
         group_data = {
             "label": label,
             "lower": float(lower),
             "higher": float(higher),
             "count": float(count),
-            "mean": float(mean),
-            "median": float(median),
-            "pct25": float(pct25),
-            "pct75": float(pct75),
-            "pct10": float(pct10),
-            "pct90": float(pct90),
-            "value_generated": float(total_value),
-            "value_generated_mean": float(mean_value),
-            "value_generated_median": float(median_value),
+            "mean": float(group_predictions.mean()) if len(group_predictions) else np.nan,
+            "median": float(_sorted_quantile(group_predictions, 0.5)),
+            "pct25": float(_sorted_quantile(group_predictions, 0.25)),
+            "pct75": float(_sorted_quantile(group_predictions, 0.75)),
+            "pct10": float(_sorted_quantile(group_predictions, 0.1)),
+            "pct90": float(_sorted_quantile(group_predictions, 0.9)),
+            "value_generated": float(group_values.sum()),
+            "value_generated_mean": float(group_values.mean()) if count else np.nan,
+            "value_generated_median": float(_sorted_quantile(group_values, 0.5)),
         }
         groups_data.append(group_data)
 
@@ -52,18 +95,165 @@ def generate_user_probas(
     user_col: str = "User Address",
     prediction_col: str = "prediction",
 ) -> dict[str, float]:
-    return {row[user_col]: float(row[prediction_col]) for _, row in df.iterrows()}
+    # NaN predictions are dropped in the same pass
+    predictions = df[prediction_col].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(predictions)
+    return dict(
+        zip(
+            df[user_col].to_numpy()[valid].tolist(),
+            predictions[valid].tolist(),
+        )
+    )
+
+
+def generate_user_values(
+    df: pd.DataFrame,
+    user_col: str = "User Address",
+    value_col: str = "Transactions Count",
+    prediction_col: str = "prediction",
+) -> dict[str, float]:
+    # Per-address value_col, used to filter addresses by user group
+    valid = df[prediction_col].notna().to_numpy()
+    return dict(
+        zip(
+            df[user_col].to_numpy()[valid].tolist(),
+            df[value_col].to_numpy(dtype=np.float64)[valid].tolist(),
+        )
+    )
+
+
+def encode_addresses(addresses: np.ndarray) -> np.ndarray:
+    """
+    Vectorized conversion of 0x-prefixed hex addresses (any case) to 20-byte keys.
+
+    Raises ValueError if any address is not 0x followed by 40 hex characters.
+    """
+    n_chars = 2 + 2 * ADDRESS_DTYPE.itemsize
+    addresses = np.asarray(addresses, dtype=str).reshape(-1)
+    invalid = np.char.str_len(addresses) != n_chars
+    if invalid.any():
+        raise ValueError(f"Invalid address {str(addresses[invalid][0])!r}: expected {n_chars} characters")
+    codes = addresses.astype(f"U{n_chars}").view(np.uint32).reshape(-1, n_chars)
+    invalid = (codes[:, 0] != ord("0")) | ((codes[:, 1] | 0x20) != ord("x"))
+    if invalid.any():
+        raise ValueError(f"Invalid address {str(addresses[invalid][0])!r}: expected a 0x prefix")
+
+    nibbles = _HEX_NIBBLES[np.minimum(codes[:, 2:], len(_HEX_NIBBLES) - 1)]
+    invalid = (nibbles >= 16).any(axis=1)
+    if invalid.any():
+        raise ValueError(f"Invalid address {str(addresses[invalid][0])!r}: expected hex characters")
+
+    keys = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return np.ascontiguousarray(keys).view(ADDRESS_DTYPE).reshape(-1)
+
+
+def generate_prod_arrays(
+    df: pd.DataFrame,
+    user_col: str = "User Address",
+    prediction_col: str = "prediction",
+    value_col: str = "Transactions Count",
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Columnar (addresses, probas, values) arrays sorted by address, without NaN predictions.
+    """
+    probas = df[prediction_col].to_numpy(dtype=np.float32)
+    valid = ~np.isnan(probas)
+    addresses = encode_addresses(df[user_col].to_numpy()[valid])
+    probas = probas[valid]
+    values = df[value_col].to_numpy(dtype=np.float32)[valid]
+
+    order = np.argsort(addresses, kind="stable")
+    return addresses[order], probas[order], values[order]
+
+
+def staged_path(path: Path) -> Path:
+    """
+    Hidden sibling of path to write it to, before publish_staged moves it
+    into place. The backend memory maps the published files, so they must
+    never be seen half written or truncated. Hidden files are left out of
+    the pipeline's folder hashes.
+    """
+    return path.with_name(f".{path.name}.tmp")
+
+
+def publish_staged(paths: Iterable[Path]) -> None:
+    # Each file is swapped atomically, one right after the other (see
+    # staged_folder for files that must change together). Readers that
+    # mapped the previous file keep reading its (unlinked) content.
+    for path in paths:
+        os.replace(staged_path(path), path)
+
+
+@contextmanager
+def staged_folder(folder: Path) -> Iterator[Path]:
+    """
+    New version of folder to write its files into, published when the block
+    exits without error.
+
+    Swapping files one by one would let a reader pair a new addresses.npy
+    with the old probas.npy, so folder is instead a relative symlink to a
+    hidden sibling holding one version, replaced atomically by a link to the
+    new one. The backend resolves the link once per load. The previous
+    version is kept for readers that resolved it just before the swap, and
+    older ones are removed.
+    """
+    folder = Path(folder)
+    folder.parent.mkdir(parents=True, exist_ok=True)
+    version = folder.with_name(f".{folder.name}-{uuid.uuid4().hex[:12]}")
+    version.mkdir()
+    try:
+        yield version
+    except BaseException:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+
+    previous = None
+    if folder.is_symlink():
+        previous = folder.resolve()
+    elif folder.exists():
+        # A folder written before versioning is moved aside once
+        previous = folder.with_name(f".{folder.name}-{uuid.uuid4().hex[:12]}")
+        os.rename(folder, previous)
+    link = folder.with_name(f".{folder.name}.link")
+    if link.is_symlink():
+        link.unlink()
+    link.symlink_to(version.name, target_is_directory=True)
+    os.replace(link, folder)
+
+    keep = {version.resolve(), previous.resolve() if previous is not None else None}
+    for old in folder.parent.glob(f".{folder.name}-*"):
+        if old.resolve() not in keep:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def save_prod_arrays(
+    output_folder: Path,
+    addresses: np.ndarray,
+    probas: np.ndarray,
+    values: np.ndarray,
+    user_groups: list[dict[str, Any]],
+) -> None:
+    with staged_folder(output_folder) as folder:
+        np.save(folder / "addresses.npy", addresses)
+        np.save(folder / "probas.npy", probas)
+        np.save(folder / "values.npy", values)
+        with (folder / "user_groups.json").open("w") as f:
+            json.dump(user_groups, f)
 
 
 def generate_prod_data(
     df: pd.DataFrame,
     groups: list[tuple[str, float, float]],
-    output_path: Path,
+    output_folder: Path,
     user_col: str = "User Address",
     value_col: str = "Transactions Count",
     prediction_col: str = "prediction",
+    export_json: bool = False,
 ) -> None:
-    user_probas = generate_user_probas(df, user_col, prediction_col)
+    """
+    Save the prod data in columnar form to output_folder / PROD_DATA_FOLDER,
+    and optionally as output_folder / prod_data.json.
+    """
     user_groups = generate_user_groups(
         groups=groups,
         data=df,
@@ -71,9 +261,25 @@ def generate_prod_data(
         value_col=value_col,
     )
 
-    final_data = {"user_probas": user_probas, "user_groups": user_groups}
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    addresses, probas, values = generate_prod_arrays(
+        df, user_col, prediction_col, value_col
+    )
+    save_prod_arrays(
+        output_folder / PROD_DATA_FOLDER, addresses, probas, values, user_groups
+    )
+
+    if not export_json:
+        return
+
+    user_probas = generate_user_probas(df, user_col, prediction_col)
+    user_values = generate_user_values(df, user_col, value_col, prediction_col)
+
+    final_data = {
+        "user_probas": user_probas,
+        "user_groups": user_groups,
+        "user_values": user_values,
+    }
 
     # save final_data to json in the data folder as prod_data.json
-    with output_path.open("w") as f:
+    with (output_folder / "prod_data.json").open("w") as f:
         json.dump(final_data, f)
@@ -22,15 +22,36 @@ def transform_data(
         [c in data.columns for c in feature_cols]
     ), f"feature_cols {feature_cols} not in data.columns"
 
-    X = data[feature_cols].values
+    X = data[feature_cols].to_numpy(dtype=np.float32)
     X = scaler.transform(X)
-    X = torch.tensor(X, dtype=torch.float32)
+    X = torch.from_numpy(np.ascontiguousarray(X, dtype=np.float32))
 
     assert X.shape[1] == len(feature_cols)
 
     return X
 
 
+def _feature_array(
+    data: pd.DataFrame,
+    feature_cols: Union[list[str], None],
+    label_col: str,
+    grouping_col: str,
+) -> np.ndarray:
+    features = (
+        data[feature_cols]
+        if feature_cols is not None
+        else data.drop(columns=[label_col, grouping_col])
+    )
+    return np.ascontiguousarray(features.to_numpy(dtype=np.float32))
+
+
+def _group_labels(groups: pd.Series) -> np.ndarray:
+    # Integer codes are enough for GroupKFold and avoid materialising the labels
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+        return groups.cat.codes.to_numpy()
+    return groups.to_numpy()
+
+
 def preprocess_data(
     data: pd.DataFrame,
     label_col: str,
@@ -68,7 +89,9 @@ def preprocess_data(
 
     rng = np.random.default_rng(seed=seed)
 
-    groups_values = data[grouping_col].value_counts().to_dict()
+    groups_values = data[grouping_col].value_counts()
+    # Categorical columns also count the unused categories
+    groups_values = groups_values[groups_values > 0].to_dict()
     groups_unique = list(groups_values.keys())
     groups_unique_randomized: list = rng.permutation(groups_unique).tolist()
     total_elements = sum(groups_values.values())
@@ -79,38 +102,32 @@ def preprocess_data(
 
     i = 0
     test_groups = []
-    while sum(groups_values[g] for g in test_groups) < test_elements_min:
+    test_elements = 0
+    while test_elements < test_elements_min:
         test_groups.append(groups_unique_randomized[i])
+        test_elements += groups_values[groups_unique_randomized[i]]
         i += 1
-    train_groups = [g for g in groups_unique if g not in test_groups]
+    test_groups_set = set(test_groups)
+    train_groups = [g for g in groups_unique if g not in test_groups_set]
 
     print(
-        f"Final train elements: {sum(groups_values[g] for g in train_groups)} across {len(train_groups)} groups"
-    )
-    print(
-        f"Final test elements: {sum(groups_values[g] for g in test_groups)} across {len(test_groups)} groups"
+        f"Final train elements: {total_elements - test_elements} across {len(train_groups)} groups"
     )
+    print(f"Final test elements: {test_elements} across {len(test_groups)} groups")
 
     print(f"Label is {label_col}")
 
     # Train test split
-    train_data = data[data[grouping_col].isin(train_groups)]
-    train_groups = train_data[grouping_col].values
+    is_test = data[grouping_col].isin(test_groups).to_numpy()
+    train_data = data[~is_test]
+    train_groups = _group_labels(train_data[grouping_col])
     train_index_new_order = train_data.index
-    train_X = (
-        train_data[feature_cols].values
-        if feature_cols is not None
-        else train_data.drop(columns=[label_col, grouping_col]).values
-    )
+    train_X = _feature_array(train_data, feature_cols, label_col, grouping_col)
     train_y = train_data[label_col].values
 
-    test_data = data[data[grouping_col].isin(test_groups)]
+    test_data = data[is_test]
     test_index_new_order = test_data.index
-    test_X = (
-        test_data[feature_cols].values
-        if feature_cols is not None
-        else test_data.drop(columns=[label_col, grouping_col]).values
-    )
+    test_X = _feature_array(test_data, feature_cols, label_col, grouping_col)
     test_y = test_data[label_col].values
 
     # GroupKFold
@@ -126,7 +143,8 @@ def preprocess_data(
 
     # Feature scaling
     if do_feature_scaling:
-        scaler = StandardScaler()
+        # Scale the float32 arrays in place
+        scaler = StandardScaler(copy=False)
         scaler.fit(train_X)
         train_X = scaler.transform(train_X)
         test_X = scaler.transform(test_X)
@@ -139,8 +157,8 @@ def preprocess_data(
         std = None
 
     # Convert to torch tensors
-    train_X = torch.tensor(train_X, dtype=torch.float32)
-    test_X = torch.tensor(test_X, dtype=torch.float32)
+    train_X = torch.from_numpy(train_X)
+    test_X = torch.from_numpy(test_X)
     if is_classification:
         train_y = torch.tensor(train_y, dtype=torch.long).unsqueeze(1)
         test_y = torch.tensor(test_y, dtype=torch.long).unsqueeze(1)
@@ -0,0 +1,381 @@
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, NamedTuple, Union
+
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.figure import Figure
+
+# Plots are drawn on their own Figure with the object-oriented Agg API,
+# never through pyplot's global state: they render concurrently in threads
+# (the backend) or processes (render_plots), and without a display.
+# The backend draws its SHAP plots with a copy of plot_beeswarm and
+# plot_waterfall (backend/shap_rendering.py): change both together.
+
+POSITIVE_COLOR = "#ff0051"
+NEGATIVE_COLOR = "#008bfb"
+# Low to high feature values in the beeswarm, as shap colors them
+FEATURE_VALUE_CMAP = LinearSegmentedColormap.from_list(
+    "feature_value", [NEGATIVE_COLOR, "#7c27bc", POSITIVE_COLOR]
+)
+
+
+def _figure(figsize: tuple[float, float]) -> Figure:
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _plot_folds(ax: Axes, epochs: list[int], lists: list[list[float]], title: str) -> None:
+    for i, values in enumerate(lists):
+        ax.plot(epochs[: len(values)], values, label=f"Fold {i}")
+    ax.set_title(title)
+    ax.set_xlabel("Epoch")
+    ax.legend()
+    ax.set_xlim(left=0)
+    ax.grid()
+
+
+def plot_losses(curves: dict) -> Figure:
+    """
+    Training and validation loss of every fold, from the curves saved by
+    the train stage.
+    """
+    figure = _figure((10, 8))
+    axes: list[Axes] = figure.subplots(2, 1, sharex=True)
+    for ax, key, title in zip(
+        axes, ("train_loss", "valid_loss"), ("Training loss", "Validation loss")
+    ):
+        _plot_folds(ax, curves["epochs"], curves[key], title)
+        ax.set_ylabel("Loss")
+        ax.set_ylim(bottom=0)
+    return figure
+
+
+def plot_accuracies(curves: dict) -> Figure:
+    figure = _figure((10, 8))
+    axes: list[Axes] = figure.subplots(2, 1, sharex=True)
+    for ax, key, title in zip(
+        axes,
+        ("train_accuracy", "valid_accuracy"),
+        ("Training accuracy", "Validation accuracy"),
+    ):
+        _plot_folds(ax, curves["epochs"], curves[key], title)
+        ax.set_ylabel("Accuracy")
+        ax.set_ylim(top=1)
+    return figure
+
+
+def plot_precision_recall(evaluation: dict) -> Figure:
+    """
+    Precision-recall curve of every model, from the data returned by
+    ml_pipeline.evaluation.evaluate_models_bc.
+    """
+    figure = _figure((6, 6))
+    ax = figure.add_subplot()
+    for i in range(len(evaluation["confusion_matrices"])):
+        ax.plot(
+            evaluation[f"recall_{i}"],
+            evaluation[f"precision_{i}"],
+            marker=".",
+            label=f"Model {i+1}",
+        )
+    ax.set_title("Precision-Recall Curve")
+    ax.set_xlabel("Recall")
+    ax.set_ylabel("Precision")
+    ax.grid()
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.legend()
+    return figure
+
+
+def plot_confusion_matrices(evaluation: dict) -> Figure:
+    matrices = np.asarray(evaluation["confusion_matrices"])
+    figure = _figure((6 * len(matrices), 6))
+    axes = np.atleast_1d(figure.subplots(1, len(matrices)))
+    for i, (ax, matrix) in enumerate(zip(axes, matrices)):
+        image = ax.matshow(matrix, cmap="Blues")
+        figure.colorbar(image, ax=ax)
+        ax.set_title(f"Model {i+1}")
+        ax.set_xlabel("Predicted")
+        ax.set_ylabel("True")
+
+        # Annotate each cell with the numeric value (none for models with
+        # NaN outputs, which were not evaluated)
+        for (j, k), count in np.ndenumerate(matrix):
+            if np.isnan(count):
+                continue
+            ax.text(
+                k,
+                j,
+                f"{count:.0f}",
+                ha="center",
+                va="center",
+                color="white" if count > matrix.max() / 2 else "black",
+                size=40,
+            )
+    figure.tight_layout()
+    return figure
+
+
+def plot_actual_vs_predicted(evaluation: dict) -> Figure:
+    """
+    Predictions against the targets of every model, from the data returned
+    by ml_pipeline.evaluation.evaluate_models_regression.
+    """
+    test_y = np.asarray(evaluation["test_y"])
+    predictions = np.asarray(evaluation["predictions"])
+    figure = _figure((6 * len(predictions), 6))
+    axes = np.atleast_1d(figure.subplots(1, len(predictions)))
+    for i, ax in enumerate(axes):
+        ax.scatter(test_y, predictions[i], alpha=0.3)
+        ax.plot([test_y.min(), test_y.max()], [test_y.min(), test_y.max()], "k--", lw=2)
+        ax.set_title(
+            f"Model {i+1} - MSE: {evaluation['mse'][i]:.2f}, "
+            f"MAE: {evaluation['mae'][i]:.2f}, R²: {evaluation['r2'][i]:.2f}"
+        )
+        ax.set_xlabel("Actual")
+        ax.set_ylabel("Predicted")
+    figure.tight_layout()
+    return figure
+
+
+def plot_beeswarm(
+    values: np.ndarray,
+    features: np.ndarray,
+    feature_names: List[str],
+    max_display: int = 20,
+    max_points: int = 10_000,
+    seed: int = 0,
+) -> Figure:
+    """
+    SHAP values of the rows of features, one row of points per feature
+    (the most important on top), spread vertically where they are dense
+    and colored by the feature value.
+
+    At most max_points rows are drawn, sampled with seed, since more do
+    not change the picture but render slowly.
+    """
+    rng = np.random.default_rng(seed)
+    if len(values) > max_points:
+        # Sorted, so that memory mapped arrays are read in order
+        rows = np.sort(rng.choice(len(values), size=max_points, replace=False))
+        values, features = values[rows], features[rows]
+    values = np.asarray(values, dtype=np.float32)
+    features = np.asarray(features, dtype=np.float32)
+
+    order = np.argsort(-np.abs(values).mean(axis=0), kind="stable")[:max_display]
+    figure = _figure((8, 0.4 * len(order) + 1.5))
+    ax = figure.add_subplot()
+    for position, i in enumerate(order[::-1]):
+        shap_values, feature_values = values[:, i], features[:, i]
+        # Jitter in proportion to the density of points around each value
+        counts, edges = np.histogram(shap_values, bins=100)
+        density = counts[np.clip(np.digitize(shap_values, edges) - 1, 0, len(counts) - 1)]
+        jitter = rng.uniform(-1, 1, len(shap_values)) * 0.4 * density / max(counts.max(), 1)
+
+        low, high = np.nanpercentile(feature_values, [5, 95]) if len(feature_values) else (0, 1)
+        colors = np.clip((feature_values - low) / max(high - low, 1e-9), 0, 1)
+        known = ~np.isnan(colors)
+        ax.scatter(
+            shap_values[~known],
+            position + jitter[~known],
+            color="#777777",
+            s=16,
+            alpha=0.8,
+            linewidth=0,
+            rasterized=True,
+        )
+        points = ax.scatter(
+            shap_values[known],
+            position + jitter[known],
+            c=colors[known],
+            cmap=FEATURE_VALUE_CMAP,
+            vmin=0,
+            vmax=1,
+            s=16,
+            alpha=0.8,
+            linewidth=0,
+            rasterized=True,
+        )
+
+    ax.axvline(0, color="#999999", linewidth=1)
+    ax.set_yticks(np.arange(len(order)), [feature_names[i] for i in order[::-1]])
+    ax.set_xlabel("SHAP value (impact on model output)")
+    for side in ("top", "right", "left"):
+        ax.spines[side].set_visible(False)
+    colorbar = figure.colorbar(points, ax=ax, ticks=[0, 1], aspect=50)
+    colorbar.ax.set_yticklabels(["Low", "High"])
+    colorbar.set_label("Feature value")
+    colorbar.outline.set_visible(False)
+    figure.tight_layout()
+    return figure
+
+
+def plot_waterfall(
+    values: np.ndarray,
+    features: np.ndarray,
+    feature_names: List[str],
+    base_value: float,
+    max_display: int = 10,
+) -> Figure:
+    """
+    Waterfall of the SHAP values of one row: the largest ones, with the
+    rest summed in one bar, stacked from the base value to the output.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(-np.abs(values), kind="stable")
+    shown = order[: max_display - 1] if len(order) > max_display else order
+    bars = values[shown].tolist()
+    labels = [f"{features[i]:.4g} = {feature_names[i]}" for i in shown]
+    if len(order) > len(shown):
+        bars.append(float(values[order[len(shown) :]].sum()))
+        labels.append(f"{len(order) - len(shown)} other features")
+
+    # Bars are drawn bottom up, from the base value to the output
+    bars, labels = bars[::-1], labels[::-1]
+    starts = base_value + np.concatenate([[0], np.cumsum(bars)[:-1]])
+    output = base_value + float(np.sum(bars))
+
+    figure = _figure((8, 0.5 * len(bars) + 1.5))
+    ax = figure.add_subplot()
+    positions = np.arange(len(bars))
+    ax.barh(
+        positions,
+        bars,
+        left=starts,
+        color=[POSITIVE_COLOR if v >= 0 else NEGATIVE_COLOR for v in bars],
+    )
+    for position, start, value in zip(positions, starts, bars):
+        ax.text(
+            start + value,
+            position,
+            f" {value:+.3f} ",
+            va="center",
+            ha="left" if value >= 0 else "right",
+            fontsize=9,
+        )
+    ax.set_yticks(positions, labels)
+    ax.axvline(base_value, color="#999999", linestyle="--", linewidth=1)
+    ax.axvline(output, color="#333333", linewidth=1)
+    ax.set_xlabel(f"E[f(X)] = {base_value:.3f}    f(x) = {output:.3f}")
+    # Room for the value labels
+    ends = np.concatenate([starts, starts + bars, [base_value]])
+    padding = 0.15 * max(ends.max() - ends.min(), 1e-6)
+    ax.set_xlim(ends.min() - padding, ends.max() + padding)
+    for side in ("top", "right", "left"):
+        ax.spines[side].set_visible(False)
+    figure.tight_layout()
+    return figure
+
+
+class PlotJob(NamedTuple):
+    """
+    A plot to render: `plot` names one of RENDERERS, which reads the files
+    in `data` (paths relative to the outputs folder) and draws `output`.
+    """
+
+    plot: str
+    output: str
+    data: tuple[str, ...]
+    # None for no keyword arguments, since a dict default would be shared
+    kwargs: Union[dict, None] = None
+
+
+def _read_json(path: Path) -> dict:
+    with path.open() as f:
+        return json.load(f)
+
+
+def _read_npz(path: Path) -> dict:
+    with np.load(path) as data:
+        return dict(data)
+
+
+def _read_address_shap(folder: Path) -> tuple[np.ndarray, np.ndarray, dict]:
+    # As written by ml_pipeline.shap_plots.save_address_shap
+    return (
+        np.load(folder / "values.npy", mmap_mode="r"),
+        np.load(folder / "features.npy", mmap_mode="r"),
+        _read_json(folder / "meta.json"),
+    )
+
+
+def _render_beeswarm(folder: Path, **kwargs) -> Figure:
+    values, features, meta = _read_address_shap(folder)
+    return plot_beeswarm(values, features, meta["feature_names"], **kwargs)
+
+
+def _render_waterfall(
+    folder: Path,
+    example: int,
+    n_examples: int = 5,
+    seed: int = 0,
+    **kwargs,
+) -> Figure:
+    # The example-th of n_examples rows drawn with seed: with fewer rows,
+    # all of them are drawn and the examples repeat
+    values, features, meta = _read_address_shap(folder)
+    assert len(values) > 0, f"No SHAP values in {folder}"
+    n_examples = min(n_examples, len(values))
+    rows = np.random.default_rng(seed).choice(len(values), size=n_examples, replace=False)
+    row = rows[example % n_examples]
+    return plot_waterfall(
+        values[row], features[row], meta["feature_names"], meta["base_value"], **kwargs
+    )
+
+
+RENDERERS = {
+    "losses": lambda path: plot_losses(_read_json(path)),
+    "accuracies": lambda path: plot_accuracies(_read_json(path)),
+    "precision_recall": lambda path: plot_precision_recall(_read_npz(path)),
+    "confusion_matrices": lambda path: plot_confusion_matrices(_read_npz(path)),
+    "actual_vs_predicted": lambda path: plot_actual_vs_predicted(_read_npz(path)),
+    "beeswarm": _render_beeswarm,
+    "waterfall": _render_waterfall,
+}
+
+
+def render_plot(outputs_folder: Path, job: PlotJob) -> float:
+    """
+    Render one job to its PNG, returning the time it took in seconds.
+    """
+    start = time.perf_counter()
+    figure = RENDERERS[job.plot](
+        *(outputs_folder / path for path in job.data), **(job.kwargs or {})
+    )
+    figure.savefig(outputs_folder / job.output, bbox_inches="tight")
+    return time.perf_counter() - start
+
+
+def render_plots(
+    outputs_folder: Union[str, Path],
+    jobs: list[PlotJob],
+    n_jobs: int = 1,
+) -> dict[str, float]:
+    """
+    Render the jobs from the plot data under outputs_folder, over a pool of
+    n_jobs processes. Returns the render time of each output, in seconds.
+    """
+    outputs_folder = Path(outputs_folder)
+    timings = {}
+    if n_jobs == 1:
+        for job in jobs:
+            timings[job.output] = render_plot(outputs_folder, job)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {executor.submit(render_plot, outputs_folder, job): job for job in jobs}
+            for future in as_completed(futures):
+                timings[futures[future].output] = future.result()
+    for output, seconds in timings.items():
+        print(f"Rendered {output} in {seconds:.2f}s")
+    return timings
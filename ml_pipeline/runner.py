@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Union
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One named step of the pipeline.
+
+    `inputs` and `outputs` are artifact paths relative to the outputs folder:
+    a stage depends on the stages producing its inputs. Everything else its
+    outputs depend on goes in `params` (arguments) and `sources` (external
+    files or folders). Bump `version` when the stage code changes what it
+    writes. Stages that are not `default` only run when asked for.
+    """
+
+    name: str
+    run: Callable[[Any], None]
+    outputs: Callable[[Any], tuple[str, ...]]
+    inputs: tuple[str, ...] = ()
+    params: Callable[[Any], dict] = lambda config: {}
+    sources: Callable[[Any], list[Path]] = lambda config: []
+    version: int = 1
+    default: bool = True
+
+
+class FileHasher:
+    """
+    sha256 of files and folders, memoized on (size, mtime) in a JSON file.
+
+    Large inputs such as the feature CSV are only read again when they
+    change on disk.
+    """
+
+    def __init__(self, cache_file: Path):
+        self.cache_file = Path(cache_file)
+        self._hashes: dict[str, list] = {}
+        if self.cache_file.is_file():
+            self._hashes = json.loads(self.cache_file.read_text())
+
+    def hash(self, path: Path) -> str:
+        path = Path(path)
+        if path.is_dir():
+            # Hidden entries are staging and bookkeeping files, not content
+            digest = hashlib.sha256()
+            for child in sorted(path.rglob("*")):
+                relative = child.relative_to(path)
+                if child.is_file() and not any(p.startswith(".") for p in relative.parts):
+                    digest.update(f"{relative.as_posix()}:{self.hash(child)}\n".encode())
+            return digest.hexdigest()
+
+        stat = path.stat()
+        key = str(path.resolve())
+        cached = self._hashes.get(key)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self._hashes[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save(self) -> None:
+        _write_json(self.cache_file, self._hashes)
+
+
+class PipelineRunner:
+    """
+    Run stages in dependency order, skipping the ones whose outputs are
+    up to date.
+
+    A stage's key hashes its version, params, source files and the content
+    of its input artifacts. The key and the hashes of the outputs it wrote
+    are recorded under outputs_folder / ".pipeline", and the stage is skipped
+    while its key is unchanged and its outputs are still the ones it wrote.
+    Since inputs are hashed by content, a stage that re-runs and writes the
+    same artifacts does not invalidate the stages after it.
+    """
+
+    def __init__(self, stages: list[Stage], config: Any, outputs_folder: Path):
+        self.stages = {stage.name: stage for stage in stages}
+        self.config = config
+        self.outputs_folder = Path(outputs_folder)
+        self.state_folder = self.outputs_folder / ".pipeline"
+        self.hasher = FileHasher(self.state_folder / "file_hashes.json")
+
+        self.producers: dict[str, str] = {}
+        for stage in stages:
+            for output in stage.outputs(config):
+                assert output not in self.producers, f"{output} is produced twice"
+                self.producers[output] = stage.name
+        for stage in stages:
+            for artifact in stage.inputs:
+                assert artifact in self.producers, f"No stage produces {artifact}"
+
+    def dependencies(self, name: str) -> list[str]:
+        return sorted({self.producers[artifact] for artifact in self.stages[name].inputs})
+
+    def plan(self, targets: Union[Iterable[str], None] = None) -> list[str]:
+        """
+        Names of the targets and the stages upstream of them, in run order.
+        """
+        if targets is None:
+            targets = [name for name, stage in self.stages.items() if stage.default]
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            assert name in self.stages, f"Unknown stage {name}"
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.dependencies(name))
+        # Stages are declared in a valid order
+        return [name for name in self.stages if name in needed]
+
+    def key(self, name: str) -> str:
+        stage = self.stages[name]
+        content = dict(
+            stage=name,
+            version=stage.version,
+            params=stage.params(self.config),
+            # Sources the stage creates (a new feature store) may not exist yet
+            sources={
+                str(p): self.hasher.hash(p) if Path(p).exists() else None
+                for p in stage.sources(self.config)
+            },
+            inputs={a: self.hasher.hash(self.outputs_folder / a) for a in stage.inputs},
+        )
+        encoded = json.dumps(content, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def is_cached(self, name: str, key: str) -> bool:
+        record_path = self.state_folder / f"{name}.json"
+        if not record_path.is_file():
+            return False
+        record = json.loads(record_path.read_text())
+        if record["key"] != key:
+            return False
+        for output, output_hash in record["outputs"].items():
+            path = self.outputs_folder / output
+            if not path.exists() or self.hasher.hash(path) != output_hash:
+                return False
+        return True
+
+    def run(
+        self,
+        targets: Union[Iterable[str], None] = None,
+        force: bool = False,
+    ) -> dict[str, float]:
+        """
+        Bring the targets (the default stages by default) up to date.
+
+        With force, the targets run even if cached; the stages upstream of
+        them still only run when stale. Returns the run time of each stage
+        that ran, in seconds.
+        """
+        forced = set(self.plan(targets) if targets is None else targets) if force else set()
+        timings = {}
+        self.state_folder.mkdir(parents=True, exist_ok=True)
+        try:
+            for name in self.plan(targets):
+                stage = self.stages[name]
+                key = self.key(name)
+                if name not in forced and self.is_cached(name, key):
+                    print(f"Stage {name} is up to date, skipping")
+                    continue
+
+                print(f"\nRunning stage {name}")
+                start = time.perf_counter()
+                stage.run(self.config)
+                timings[name] = time.perf_counter() - start
+
+                outputs = {}
+                for output in stage.outputs(self.config):
+                    path = self.outputs_folder / output
+                    assert path.exists(), f"Stage {name} did not write {output}"
+                    outputs[output] = self.hasher.hash(path)
+                _write_json(self.state_folder / f"{name}.json", dict(key=key, outputs=outputs))
+                print(f"Stage {name} done in {timings[name]:.1f}s")
+        finally:
+            self.hasher.save()
+        return timings
+
+
+def _write_json(path: Path, content: Any) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
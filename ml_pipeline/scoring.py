@@ -0,0 +1,365 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet as pq
+from scipy.special import expit
+
+# Monthly re-scoring only needs the exported model and the scaler params:
+# this module does not import the training stack, and torch is only
+# imported to run TorchScript models.
+
+# Model bundle layout, written by the pipeline's export stage:
+#   manifest.json  format and model version, ordered features (and the raw
+#                  columns they are renamed from), scaler params
+#   model.pt       TorchScript model taking raw features (scaler folded in)
+#   model.onnx     the same model as ONNX
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_MANIFEST = "manifest.json"
+BUNDLE_MODEL_FILES = {"torchscript": "model.pt", "onnx": "model.onnx"}
+
+
+def save_scaler_params(scaler, feature_cols: list[str], path: Path) -> None:
+    """
+    Save the mean and scale of a fitted StandardScaler as JSON, with the
+    feature columns they apply to, in order.
+    """
+    with path.open("w") as f:
+        json.dump(
+            dict(
+                features=feature_cols,
+                mean=np.asarray(scaler.mean_).tolist(),
+                scale=np.asarray(scaler.scale_).tolist(),
+            ),
+            f,
+        )
+
+
+def load_scaler_params(path: Path) -> tuple[list[str], np.ndarray, np.ndarray]:
+    with path.open() as f:
+        params = json.load(f)
+    return (
+        params["features"],
+        np.asarray(params["mean"], dtype=np.float32),
+        np.asarray(params["scale"], dtype=np.float32),
+    )
+
+
+def write_bundle_manifest(
+    bundle_path: Path,
+    features: list[str],
+    mean: np.ndarray,
+    scale: np.ndarray,
+    feature_renames: Union[dict[str, str], None] = None,
+) -> dict:
+    """
+    Write the manifest of a bundle whose model files are already saved.
+
+    feature_renames maps the raw feature columns (as in the feature CSV)
+    to the features, so that raw files can be scored too.
+    The model version is a hash of the ONNX graph and the scaler params,
+    so it changes whenever the scores would.
+    """
+    scaler = dict(mean=np.asarray(mean).tolist(), scale=np.asarray(scale).tolist())
+    digest = hashlib.sha256((bundle_path / BUNDLE_MODEL_FILES["onnx"]).read_bytes())
+    digest.update(json.dumps([features, scaler]).encode())
+    manifest = dict(
+        format_version=BUNDLE_FORMAT_VERSION,
+        model_version=digest.hexdigest()[:16],
+        features=features,
+        feature_renames=feature_renames or {},
+        scaler=scaler,
+        # The models output logits and take unscaled features
+        scaler_folded=True,
+        files=BUNDLE_MODEL_FILES,
+    )
+    with (bundle_path / BUNDLE_MANIFEST).open("w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_bundle_manifest(bundle_path: Path) -> dict:
+    with (Path(bundle_path) / BUNDLE_MANIFEST).open() as f:
+        manifest = json.load(f)
+    assert (
+        manifest["format_version"] == BUNDLE_FORMAT_VERSION
+    ), f"Unsupported model bundle format {manifest['format_version']}"
+    return manifest
+
+
+def load_bundle(
+    bundle_path: Path,
+    backend: str = "torchscript",
+    n_threads: int = 1,
+) -> tuple[list[str], Callable[[np.ndarray], np.ndarray]]:
+    """
+    Load the ordered features and the model of a bundle, as a function
+    from unscaled float32 feature chunks to logits.
+    """
+    manifest = read_bundle_manifest(bundle_path)
+    predict = load_model(Path(bundle_path) / manifest["files"][backend], n_threads)
+    return manifest["features"], predict
+
+
+def with_scaling(
+    predict: Callable[[np.ndarray], np.ndarray],
+    mean: np.ndarray,
+    scale: np.ndarray,
+) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Wrap a model taking standardized features to take unscaled ones.
+    """
+    return lambda X: predict(np.ascontiguousarray((X - mean) / scale, dtype=np.float32))
+
+
+def load_model(model_path: Path, n_threads: int = 1) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Load a TorchScript (.pt) or ONNX (.onnx) model as a function from a
+    float32 feature chunk to the model outputs, run with n_threads
+    intra-op threads.
+    """
+    model_path = Path(model_path)
+    if model_path.suffix == ".onnx":
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("Scoring ONNX models requires onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = n_threads
+        options.inter_op_num_threads = 1
+        session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        input_name = session.get_inputs()[0].name
+        return lambda X: session.run(None, {input_name: X})[0]
+
+    import torch
+
+    torch.set_num_threads(n_threads)
+    model = torch.jit.load(str(model_path), map_location="cpu")
+    model.eval()
+
+    def predict(X: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            return model(torch.from_numpy(X)).numpy()
+
+    return predict
+
+
+def input_columns(input_path: Path) -> list[str]:
+    input_path = Path(input_path)
+    if input_path.suffix == ".parquet":
+        return pq.read_schema(input_path).names
+    with input_path.open(newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def resolve_feature_columns(
+    available: list[str],
+    features: list[str],
+    feature_renames: Union[dict[str, str], None] = None,
+) -> list[str]:
+    """
+    Column of each feature among the available ones: the feature itself,
+    or the raw column renamed to it by feature_renames.
+    """
+    raw_columns = {renamed: raw for raw, renamed in (feature_renames or {}).items()}
+    columns = []
+    for feature in features:
+        if feature in available:
+            columns.append(feature)
+        elif raw_columns.get(feature) in available:
+            columns.append(raw_columns[feature])
+        else:
+            raise ValueError(f"Input has no column for feature {feature}")
+    return columns
+
+
+def iter_chunks(
+    input_path: Path,
+    columns: list[str],
+    chunk_size: int,
+    column_types: Union[dict[str, pa.DataType], None] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read the columns of a Parquet or CSV file in record batches of about
+    chunk_size rows.
+
+    CSV types are otherwise inferred from the first block, which later
+    blocks may not fit (e.g. a float in an int-looking column), so the
+    column_types of the columns read should be given.
+    """
+    input_path = Path(input_path)
+    if input_path.suffix == ".parquet":
+        yield from pq.ParquetFile(input_path).iter_batches(batch_size=chunk_size, columns=columns)
+    else:
+        reader = pyarrow.csv.open_csv(
+            input_path,
+            # Batches are blocks of bytes, sized from a rough row length
+            read_options=pyarrow.csv.ReadOptions(block_size=max(chunk_size * 256, 1 << 20)),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=columns,
+                column_types=column_types or {},
+            ),
+        )
+        yield from reader
+
+
+def score_file(
+    predict: Callable[[np.ndarray], np.ndarray],
+    features: list[str],
+    input_path: Path,
+    output_path: Path,
+    user_col: str = "User Address",
+    prediction_col: str = "prediction",
+    chunk_size: int = 65536,
+    feature_renames: Union[dict[str, str], None] = None,
+) -> int:
+    """
+    Score the rows of input_path (Parquet or CSV) with a model loaded by
+    load_bundle, or load_model wrapped with_scaling.
+
+    Each feature is read from its own column or, in raw feature files, from
+    the column feature_renames renames to it (see the bundle manifest).
+    The features are read chunk_size rows at a time, in order, and run
+    through the model. Each chunk's probabilities (the sigmoid of the
+    model output, as in the pipeline's score stage) are appended to
+    output_path (Parquet if it ends in .parquet, else CSV) with the user
+    column. Memory stays bounded by the chunk size.
+    The output is moved into place once complete. Returns the number of
+    rows scored.
+    """
+    output_path = Path(output_path)
+    columns = resolve_feature_columns(input_columns(input_path), features, feature_renames)
+    column_types = {user_col: pa.string(), **{c: pa.float32() for c in columns}}
+    schema = pa.schema([(user_col, pa.string()), (prediction_col, pa.float32())])
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    if output_path.suffix == ".parquet":
+        writer = pq.ParquetWriter(tmp_path, schema)
+    else:
+        writer = pyarrow.csv.CSVWriter(tmp_path, schema)
+
+    start = time.perf_counter()
+    n_rows = 0
+    with writer:
+        for batch in iter_chunks(input_path, [user_col] + columns, chunk_size, column_types):
+            X = np.column_stack(
+                [batch.column(c).to_numpy(zero_copy_only=False) for c in columns]
+            ).astype(np.float32)
+            predictions = expit(predict(X).reshape(-1)).astype(np.float32)
+            writer.write_batch(
+                pa.record_batch(
+                    [batch.column(user_col).cast(pa.string()), pa.array(predictions)],
+                    schema=schema,
+                )
+            )
+            n_rows += len(batch)
+    os.replace(tmp_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Scored {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):.0f} rows/s) "
+        f"into {output_path}"
+    )
+    return n_rows
+
+
+def get_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Score users with an exported model")
+    parser.add_argument(
+        "--bundle",
+        type=str,
+        default=None,
+        help="Path to the model bundle exported by the pipeline (model_bundle)",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=list(BUNDLE_MODEL_FILES),
+        default="torchscript",
+        help="Model of the bundle to score with",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=None,
+        help="Instead of --bundle, path to the TorchScript (model_scripted.pt) "
+        "or ONNX (zkml/network.onnx) model taking scaled features",
+    )
+    parser.add_argument(
+        "--scaler",
+        type=str,
+        default=None,
+        help="With --model, path to the scaler params saved by the pipeline "
+        "(artifacts/scaler.json)",
+    )
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="Parquet or CSV file with the user column and the features "
+        "(or, with --bundle, the raw feature columns)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="Path to write the scores to, as Parquet if it ends in .parquet, else CSV",
+    )
+    parser.add_argument(
+        "--user-col",
+        type=str,
+        default="User Address",
+        help="Column identifying each user",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=65536,
+        help="Rows scored at a time",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Intra-op threads of the model, by default the number of CPUs",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_arguments()
+    n_threads = args.threads or os.cpu_count() or 1
+    feature_renames = None
+    if args.bundle is not None:
+        features, predict = load_bundle(Path(args.bundle), args.backend, n_threads)
+        feature_renames = read_bundle_manifest(Path(args.bundle)).get("feature_renames")
+    else:
+        assert (
+            args.model is not None and args.scaler is not None
+        ), "Either --bundle or --model and --scaler are required"
+        features, mean, scale = load_scaler_params(Path(args.scaler))
+        predict = with_scaling(load_model(Path(args.model), n_threads), mean, scale)
+
+    score_file(
+        predict,
+        features,
+        input_path=Path(args.input),
+        output_path=Path(args.output),
+        user_col=args.user_col,
+        chunk_size=args.chunk_size,
+        feature_renames=feature_renames,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,47 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Union
 
-import matplotlib.pyplot as plt
 import numpy as np
 import shap
 import torch
+from matplotlib.figure import Figure
+from sklearn.cluster import MiniBatchKMeans
 from torch import nn
 
+from ml_pipeline.attribution import DeepLiftExplainer
+from ml_pipeline.postprocessing import (
+    encode_addresses,
+    publish_staged,
+    staged_folder,
+    staged_path,
+)
+from ml_pipeline.rendering import plot_beeswarm, plot_waterfall
 
-def calculate_shap_values(model: nn.Module, X: torch.Tensor):
+# Per-address SHAP layout, read by the backend:
+#   addresses.npy  S20 raw 20-byte addresses, sorted ascending
+#   values.npy     float32 SHAP values, one row of features per address
+#   features.npy   float32 (unscaled) feature values, same shape
+#   meta.json      feature names and base value (mean model output)
+ADDRESS_SHAP_FOLDER = "shap_values"
+
+# "deeplift": closed form DeepLIFT attributions (ml_pipeline.attribution),
+# "gradient": sampled expected gradients (shap.GradientExplainer)
+SHAP_METHODS = ("deeplift", "gradient")
+
+
+def calculate_shap_values(
+    model: nn.Module,
+    X: torch.Tensor,
+    explained_X: Union[torch.Tensor, None] = None,
+):
+    """
+    SHAP values of the rows of explained_X (by default, the background X).
+    """
     # Ensure the model is in evaluation mode
     model.eval()
 
@@ -16,37 +49,210 @@ def calculate_shap_values(model: nn.Module, X: torch.Tensor):
     explainer = shap.GradientExplainer(model, X)
 
     # Get SHAP values for the specific input sample
-    shap_values = explainer.shap_values(X)
+    shap_values = explainer.shap_values(X if explained_X is None else explained_X)
 
     return shap_values
 
 
+def shap_matrix(shap_values) -> np.ndarray:
+    """
+    SHAP values of a single output model as a (samples, features) array,
+    whether shap returned one array per output or an output axis.
+    """
+    if isinstance(shap_values, list):
+        (shap_values,) = shap_values
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim == 3:
+        shap_values = shap_values[..., 0]
+    return shap_values
+
+
+def kmeans_background(
+    X: np.ndarray,
+    n_clusters: int = 100,
+    size: int = 200,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Summary of X as a SHAP background of about size rows: k-means centers,
+    each repeated in proportion to its cluster, since explainers draw
+    background rows uniformly.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) <= size:
+        return X
+    n_clusters = min(n_clusters, len(X))
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3).fit(X)
+    counts = np.bincount(kmeans.labels_, minlength=n_clusters)
+    repeats = np.round(counts / counts.sum() * size).astype(int)
+    return np.repeat(kmeans.cluster_centers_.astype(np.float32), repeats, axis=0)
+
+
+# Per worker state of explain_in_chunks
+_explainer: dict = {}
+
+
+def _init_explainer(
+    model: nn.Module,
+    background: torch.Tensor,
+    n_threads: int,
+    method: str,
+) -> None:
+    assert method in SHAP_METHODS, f"Unknown SHAP method {method}"
+    torch.set_num_threads(n_threads)
+    model.eval()
+    _explainer["method"] = method
+    if method == "deeplift":
+        _explainer["explainer"] = DeepLiftExplainer(model, background)
+    else:
+        _explainer["explainer"] = shap.GradientExplainer(model, background)
+
+
+def _explain_chunk(X: np.ndarray, seed: int) -> np.ndarray:
+    if _explainer["method"] == "deeplift":
+        return _explainer["explainer"].shap_values(X)
+    shap_values = _explainer["explainer"].shap_values(torch.from_numpy(X), rseed=seed)
+    return shap_matrix(shap_values).astype(np.float32)
+
+
+def explain_in_chunks(
+    model: nn.Module,
+    background: torch.Tensor,
+    X: np.ndarray,
+    output_path: Path,
+    chunk_size: int = 1024,
+    n_jobs: int = 1,
+    seed: int = 0,
+    method: str = "deeplift",
+    threads: Union[int, None] = None,
+) -> np.ndarray:
+    """
+    SHAP values of every row of X against the background, computed with
+    method (see SHAP_METHODS), streamed to the .npy file output_path and
+    returned memory mapped.
+
+    The values are written to the staging file of output_path (see
+    postprocessing.staged_path), which is moved into place once every chunk
+    is written.
+
+    Rows are explained in chunks of chunk_size, spread over a pool of
+    n_jobs processes (each one capped to its share of threads, by default
+    all the CPUs), and each
+    chunk is written in place as it arrives. Chunk i is explained with
+    seed + i (for the sampling of the gradient method), so the values do
+    not depend on n_jobs.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    values = np.lib.format.open_memmap(
+        staged_path(output_path), mode="w+", dtype=np.float32, shape=X.shape
+    )
+    starts = range(0, len(X), chunk_size)
+    n_threads = max(1, (threads or os.cpu_count() or 1) // n_jobs)
+
+    start_time = time.perf_counter()
+    explained = 0
+
+    def write(start: int, chunk_values: np.ndarray) -> None:
+        nonlocal explained
+        values[start : start + len(chunk_values)] = chunk_values
+        explained += len(chunk_values)
+        elapsed = time.perf_counter() - start_time
+        print(f"Explained {explained}/{len(X)} rows ({explained / elapsed:.0f} rows/s)")
+
+    if n_jobs == 1:
+        # The explainer runs in this process: restore its thread cap after
+        previous_threads = torch.get_num_threads()
+        try:
+            _init_explainer(model, background, n_threads, method)
+            for i, start in enumerate(starts):
+                write(start, _explain_chunk(X[start : start + chunk_size], seed + i))
+        finally:
+            torch.set_num_threads(previous_threads)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_explainer,
+            initargs=(model, background, n_threads, method),
+        ) as executor:
+            futures = {
+                executor.submit(_explain_chunk, X[start : start + chunk_size], seed + i): start
+                for i, start in enumerate(starts)
+            }
+            for future in as_completed(futures):
+                # Drop the finished chunk so its values are freed once written
+                write(futures.pop(future), future.result())
+
+    values.flush()
+    publish_staged([output_path])
+    return values
+
+
+def save_address_shap(
+    output_folder: Path,
+    model: nn.Module,
+    background: torch.Tensor,
+    addresses: np.ndarray,
+    X: np.ndarray,
+    features: np.ndarray,
+    feature_names: List[str],
+    chunk_size: int = 1024,
+    n_jobs: int = 1,
+    method: str = "deeplift",
+    threads: Union[int, None] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Explain the (scaled) feature rows X of each address and save them with
+    the unscaled features, sorted by address so that the backend looks them
+    up with a binary search.
+
+    The backend memory maps these files, so they are written to a new
+    version of output_folder, only published once the last chunk is
+    explained (see postprocessing.staged_folder).
+    Returns the order of the rows by address and their SHAP values in that
+    order, memory mapped.
+    """
+    keys = encode_addresses(addresses)
+    order = np.argsort(keys, kind="stable")
+    with staged_folder(output_folder) as folder:
+        np.save(folder / "addresses.npy", keys[order])
+        np.save(folder / "features.npy", np.asarray(features, dtype=np.float32)[order])
+
+        with torch.inference_mode():
+            base_value = model(background).mean().item()
+        with (folder / "meta.json").open("w") as f:
+            json.dump(dict(feature_names=feature_names, base_value=base_value), f)
+
+        values = explain_in_chunks(
+            model,
+            background,
+            np.asarray(X)[order],
+            folder / "values.npy",
+            chunk_size=chunk_size,
+            n_jobs=n_jobs,
+            method=method,
+            threads=threads,
+        )
+    return order, values
+
+
 def display_beeswarm(
     model: nn.Module,
     data_X: torch.Tensor,
     feature_names: Union[List[str], None] = None,
     shap_values: Union[np.ndarray, None] = None,
     save_to: Union[str, None] = None,
-):
+) -> Figure:
     if shap_values is None:
         shap_values = calculate_shap_values(model, data_X)
 
     if not feature_names:
         feature_names = [f"Feature_{i}" for i in range(data_X.shape[1])]
 
-    # Plotting the beeswarm plot
-    plt.clf()
-    shap.summary_plot(
-        shap_values,
-        features=data_X,
-        feature_names=feature_names,
-        show=False,
-    )
+    figure = plot_beeswarm(shap_matrix(shap_values), np.asarray(data_X), feature_names)
     if save_to is not None:
-        plt.savefig(save_to, bbox_inches="tight")
-    else:
-        plt.show()
-    plt.close()
+        figure.savefig(save_to, bbox_inches="tight")
+    return figure
 
 
 def display_waterfall(
@@ -57,34 +263,21 @@ def display_waterfall(
     feature_names: Union[List[str], None] = None,
     max_display: int = 10,
     save_to: Union[str, None] = None,
-):
+) -> Figure:
     # Calculate the expected value (mean model output on train data)
     with torch.no_grad():
         expected_value = model(X).mean().item()
 
     if not feature_names:
-        feature_names = [f"Feature_{i}" for i in range(input_sample.shape[1])]
+        feature_names = [f"Feature_{i}" for i in range(X.shape[1])]
 
-    input_sample = X[idx].unsqueeze(0)
-
-    # Prepare the SHAP explanation object
-    shap_explanation = shap.Explanation(
-        values=shap_values[0].squeeze(),  # Adjust based on your output shape
-        base_values=expected_value,
-        data=input_sample.numpy().squeeze(),  # Adjust as needed
-        feature_names=feature_names,
-    )
-
-    # Create the waterfall plot
-    plt.clf()
-    shap.waterfall_plot(
-        shap_explanation,
+    figure = plot_waterfall(
+        shap_matrix(shap_values)[idx],
+        np.asarray(X[idx]),
+        feature_names,
+        expected_value,
         max_display=max_display,
-        show=False,
     )
     if save_to is not None:
-        plt.savefig(save_to, bbox_inches="tight")
-    else:
-        plt.show()
-
-    plt.close()
+        figure.savefig(save_to, bbox_inches="tight")
+    return figure
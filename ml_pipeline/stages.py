@@ -0,0 +1,679 @@
+import asyncio
+import json
+import pickle
+import shutil
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from scipy.special import expit
+
+from ml_pipeline.evaluation import (
+    DEFAULT_THRESHOLDS,
+    evaluate_models,
+    load_metrics,
+    print_metrics,
+    save_evaluation,
+    save_metrics,
+)
+from ml_pipeline.feature_store import FeatureStore
+from ml_pipeline.ingestion import read_feature_file, read_feature_store
+from ml_pipeline.model import FCModel, ModelWrapper, fold_standardization
+from ml_pipeline.postprocessing import PROD_DATA_FOLDER, generate_prod_data
+from ml_pipeline.preprocessing import preprocess_data
+from ml_pipeline.rendering import PlotJob, render_plots
+from ml_pipeline.runner import PipelineRunner, Stage
+from ml_pipeline.scoring import (
+    BUNDLE_MODEL_FILES,
+    load_bundle,
+    load_scaler_params,
+    read_bundle_manifest,
+    save_scaler_params,
+    write_bundle_manifest,
+)
+from ml_pipeline.shap_plots import (
+    ADDRESS_SHAP_FOLDER,
+    kmeans_background,
+    save_address_shap,
+)
+from ml_pipeline.training import (
+    evaluated_epochs,
+    train_cross_validation,
+    train_ensemble,
+)
+from ml_pipeline.zk_cache import DEFAULT_CACHE_FOLDER, ZKArtifactCache
+from ml_pipeline.zkml import (
+    ProverPaths,
+    benchmark_batch_sizes,
+    calibration_sample,
+    choose_batch_size,
+    export_onnx,
+    generate_compiled_model,
+    prove_addresses,
+    read_proof_addresses,
+    setup_proving_keys,
+    write_proof_input,
+)
+
+USER_COL = "User Address"
+MONTH_COL = "month_start"
+LABEL_NAME_BC = "target"
+LABEL_NAME_REG = "target_reg"
+# Rows per forward pass when scoring
+SCORE_CHUNK_ROWS = 65536
+
+# Intermediate artifacts, relative to the outputs folder
+ML_DATA = "artifacts/ml_data.parquet"
+PROD_INPUT = "artifacts/prod_input.parquet"
+PREPROCESSED = "artifacts/preprocessed.pt"
+SCALER = "artifacts/scaler.pkl"
+SCALER_PARAMS = "artifacts/scaler.json"
+MODELS = "artifacts/models.pt"
+CURVES = "artifacts/curves.json"
+# Per-fold training checkpoints, removed once the train stage succeeds
+CHECKPOINTS = "checkpoints"
+# Test set precision-recall curves and confusion matrices, or regression
+# predictions and metrics (see ml_pipeline.evaluation)
+EVALUATION = "artifacts/evaluation.npz"
+# Test set metrics of every fold model and the model selected, comparable
+# across runs
+METRICS = "metrics.json"
+FINAL_MODEL = "artifacts/final_model.pt"
+# Model taking raw features, with its feature list and scaler params, for
+# scoring and proving (see ml_pipeline.scoring)
+MODEL_BUNDLE = "model_bundle"
+CALIBRATION_DATA = "artifacts/calibration.npy"
+PROOF_ADDRESSES = "artifacts/proof_addresses.txt"
+PROOF_FEATURES = "artifacts/proof_features.npy"
+
+
+@dataclass
+class PipelineConfig:
+    outputs_folder: Path
+    feature_renames: dict[str, str]
+    data_file: Union[Path, None] = None
+    feature_store: Union[Path, None] = None
+    holdout_months: list[str] = field(
+        default_factory=lambda: ["2023-09-01", "2023-10-01", "2023-11-01"]
+    )
+    prod_month: str = "2023-09-01"
+    is_classification: bool = False
+    learning_rate: float = 0.00001
+    epochs: int = 30
+    # Index of the exported fold model, the best on selection_metric when None
+    model_selected: Union[int, None] = None
+    # By default pr_auc for classification and mse for regression
+    selection_metric: Union[str, None] = None
+    eval_thresholds: list[float] = field(default_factory=lambda: list(DEFAULT_THRESHOLDS))
+    n_jobs: int = 1
+    # CPU threads the stages share between their n_jobs processes, all the
+    # CPUs when None (the orchestrator gives each protocol its share)
+    threads: Union[int, None] = None
+    # Without early stopping or checkpoints
+    vectorized_folds: bool = False
+    eval_every: int = 1
+    patience: Union[int, None] = None
+    checkpoint_every: int = 1
+    export_json: bool = False
+    srs_path: Union[Path, None] = None
+    zk_cache: Union[Path, None] = DEFAULT_CACHE_FOLDER
+    zk_cache_max_gb: float = 20
+    # Users per proof. ZkMLAirdrop.verifyUserAllocations verifies one user
+    # per proof, so larger batches (or None, benchmarking proof_batch_sizes
+    # to pick one) are opt-in and make proofs that cannot be submitted
+    proof_batch_size: Union[int, None] = 1
+    proof_batch_sizes: list[int] = field(default_factory=lambda: [1, 2, 4, 8, 16])
+    calibration_rows: int = 256
+    # k-means clusters summarizing the training rows as SHAP background
+    shap_background: int = 100
+    shap_chunk_size: int = 1024
+    shap_method: str = "deeplift"
+    # Headless runs save the plot data but only render it with --stage plots
+    render_plots: bool = True
+    groups: list[tuple[str, int, int]] = field(
+        default_factory=lambda: [
+            ("1 - 5", 1, 5),
+            ("5 - 20", 5, 20),
+            ("20 - 50", 20, 50),
+            ("50 - 100", 50, 100),
+            ("100+", 100, 10000000000),
+        ]
+    )
+
+    def __post_init__(self):
+        assert (
+            self.data_file is not None or self.feature_store is not None
+        ), "Either data_file or feature_store is required"
+        self.outputs_folder = Path(self.outputs_folder)
+        if self.data_file is not None:
+            self.data_file = Path(self.data_file)
+            assert self.data_file.is_file(), f"Data file {self.data_file} does not exist"
+        if self.feature_store is not None:
+            self.feature_store = Path(self.feature_store)
+        if self.srs_path is not None:
+            self.srs_path = Path(self.srs_path)
+        if self.zk_cache is not None:
+            self.zk_cache = Path(self.zk_cache)
+        if self.vectorized_folds and self.patience is not None:
+            # The stacked ensemble trains every fold for all the epochs
+            raise ValueError("patience is not supported with vectorized_folds")
+
+    def zk_artifact_cache(self) -> Union[ZKArtifactCache, None]:
+        if self.zk_cache is None:
+            return None
+        return ZKArtifactCache(self.zk_cache, max_bytes=int(self.zk_cache_max_gb * 1024**3))
+
+    @property
+    def feature_selection(self) -> list[str]:
+        return list(self.feature_renames.values())
+
+    def path(self, artifact: str) -> Path:
+        return self.outputs_folder / artifact
+
+
+def _load_models(config: PipelineConfig, path: Path) -> list[nn.Module]:
+    models = []
+    for state_dict in torch.load(path):
+        model = FCModel(len(config.feature_renames))
+        model.load_state_dict(state_dict)
+        model.eval()
+        models.append(model)
+    return models
+
+
+def _load_preprocessed(config: PipelineConfig) -> dict:
+    return torch.load(config.path(PREPROCESSED), weights_only=False)
+
+
+def ingest(config: PipelineConfig) -> None:
+    if config.feature_store is not None:
+        feature_store = FeatureStore(config.feature_store, month_col=MONTH_COL)
+        if config.data_file is not None:
+            feature_store.ingest(
+                config.data_file,
+                numeric_cols=list(config.feature_renames.keys()) + [LABEL_NAME_REG],
+            )
+        df_to_ml, df_to_prod = read_feature_store(
+            store=feature_store,
+            feature_renames=config.feature_renames,
+            label_cols=[LABEL_NAME_REG],
+            holdout_months=config.holdout_months,
+            prod_months=[config.prod_month],
+            user_col=USER_COL,
+        )
+    else:
+        df_to_ml, df_to_prod = read_feature_file(
+            data_file=config.data_file,
+            feature_renames=config.feature_renames,
+            label_cols=[LABEL_NAME_REG],
+            holdout_months=config.holdout_months,
+            prod_months=[config.prod_month],
+            user_col=USER_COL,
+            month_col=MONTH_COL,
+        )
+    config.path(ML_DATA).parent.mkdir(parents=True, exist_ok=True)
+    df_to_ml.to_parquet(config.path(ML_DATA))
+    df_to_prod.to_parquet(config.path(PROD_INPUT))
+
+
+def preprocess(config: PipelineConfig) -> None:
+    df_to_ml = pd.read_parquet(config.path(ML_DATA))
+    df_to_ml[LABEL_NAME_BC] = df_to_ml[LABEL_NAME_REG] < -0.99
+    print(df_to_ml[LABEL_NAME_BC].value_counts())
+
+    (
+        train_X,
+        train_y,
+        test_X,
+        test_y,
+        group_kfold_splits,
+        (scaler, mean, std),
+        train_index_new_order,
+        test_index_new_order,
+    ) = preprocess_data(
+        data=df_to_ml,
+        label_col=LABEL_NAME_BC if config.is_classification else LABEL_NAME_REG,
+        grouping_col=USER_COL,
+        n_splits=5,
+        test_size=0.1,
+        feature_cols=config.feature_selection,
+        do_feature_scaling=True,
+        seed=1534,
+    )
+    torch.save(
+        dict(
+            train_X=train_X,
+            train_y=train_y,
+            test_X=test_X,
+            test_y=test_y,
+            group_kfold_splits=group_kfold_splits,
+        ),
+        config.path(PREPROCESSED),
+    )
+    # Kept apart so that scoring does not depend on the training split
+    with config.path(SCALER).open("wb") as f:
+        pickle.dump(scaler, f)
+    # Loaded by ml_pipeline.scoring, without sklearn
+    save_scaler_params(scaler, config.feature_selection, config.path(SCALER_PARAMS))
+
+
+def train(config: PipelineConfig) -> None:
+    data = _load_preprocessed(config)
+    training_kwargs = dict(
+        model_class=partial(FCModel, len(config.feature_renames)),
+        train_X=data["train_X"],
+        train_y=data["train_y"],
+        group_kfold_splits=data["group_kfold_splits"],
+        batch_size=64,
+        epochs=config.epochs,
+        learning_rate=config.learning_rate,
+        shuffle_batches=False,
+        is_classification=config.is_classification,
+        eval_every=config.eval_every,
+        seed=1534,
+    )
+    (
+        models,
+        train_loss_lists,
+        train_accuracy_lists,
+        valid_loss_lists,
+        valid_accuracy_lists,
+    ) = (
+        train_ensemble(**training_kwargs)
+        if config.vectorized_folds
+        else train_cross_validation(
+            **training_kwargs,
+            n_jobs=config.n_jobs,
+            threads=config.threads,
+            patience=config.patience,
+            checkpoint_dir=config.path(CHECKPOINTS),
+            checkpoint_every=config.checkpoint_every,
+        )
+    )
+
+    torch.save([model.state_dict() for model in models], config.path(MODELS))
+    with config.path(CURVES).open("w") as f:
+        json.dump(
+            dict(
+                epochs=evaluated_epochs(config.epochs, config.eval_every),
+                train_loss=train_loss_lists,
+                train_accuracy=train_accuracy_lists,
+                valid_loss=valid_loss_lists,
+                valid_accuracy=valid_accuracy_lists,
+            ),
+            f,
+        )
+    # Checkpoints only resume an interrupted run: a finished (or forced) one
+    # trains from scratch
+    shutil.rmtree(config.path(CHECKPOINTS), ignore_errors=True)
+
+
+def plot_jobs(config: PipelineConfig) -> list[PlotJob]:
+    jobs = [PlotJob("losses", "losses.png", (CURVES,))]
+    if config.is_classification:
+        jobs += [
+            PlotJob("accuracies", "accuracies.png", (CURVES,)),
+            PlotJob("precision_recall", "precision_recall_curve.png", (EVALUATION,)),
+            PlotJob("confusion_matrices", "confusion_matrices.png", (EVALUATION,)),
+        ]
+    else:
+        jobs.append(PlotJob("actual_vs_predicted", "actual_vs_predicted.png", (EVALUATION,)))
+    jobs.append(PlotJob("beeswarm", "beeswarm.png", (ADDRESS_SHAP_FOLDER,)))
+
+    # A few example explanations (the backend renders any address's own)
+    jobs += [
+        PlotJob("waterfall", f"waterfall_{i}.png", (ADDRESS_SHAP_FOLDER,), dict(example=i))
+        for i in range(5)
+    ]
+    return jobs
+
+
+def render(config: PipelineConfig) -> None:
+    render_plots(config.outputs_folder, plot_jobs(config), n_jobs=config.n_jobs)
+
+
+def evaluate(config: PipelineConfig) -> None:
+    data = _load_preprocessed(config)
+    models = _load_models(config, config.path(MODELS))
+    evaluation, metrics = evaluate_models(
+        models,
+        data["test_X"],
+        data["test_y"],
+        is_classification=config.is_classification,
+        thresholds=config.eval_thresholds,
+        selection_metric=config.selection_metric,
+        model_selected=config.model_selected,
+    )
+    print_metrics(metrics)
+    save_evaluation(evaluation, config.path(EVALUATION))
+    save_metrics(metrics, config.path(METRICS))
+
+
+def export(config: PipelineConfig) -> None:
+    # The model selected by the evaluate stage
+    selected = load_metrics(config.path(METRICS))["selection"]["model"]
+    state_dicts = torch.load(config.path(MODELS))
+    torch.save([state_dicts[selected]], config.path(FINAL_MODEL))
+    (final_model,) = _load_models(config, config.path(FINAL_MODEL))
+
+    # save the model
+    model_scripted = torch.jit.script(final_model)  # Export to TorchScript
+    model_scripted.save(config.outputs_folder / "model_scripted.pt")
+
+    features, mean, scale = load_scaler_params(config.path(SCALER_PARAMS))
+    bundled_model = fold_standardization(final_model, mean, scale)
+    bundle_folder = config.path(MODEL_BUNDLE)
+    bundle_folder.mkdir(parents=True, exist_ok=True)
+    torch.jit.script(bundled_model).save(bundle_folder / BUNDLE_MODEL_FILES["torchscript"])
+    export_onnx(
+        bundled_model,
+        torch.zeros(1, len(features)),
+        bundle_folder / BUNDLE_MODEL_FILES["onnx"],
+    )
+    manifest = write_bundle_manifest(
+        bundle_folder, features, mean, scale, feature_renames=config.feature_renames
+    )
+    print(f"Model bundle {manifest['model_version']} saved to {bundle_folder}")
+
+
+def explain(config: PipelineConfig) -> None:
+    data = _load_preprocessed(config)
+    (final_model,) = _load_models(config, config.path(FINAL_MODEL))
+    model = ModelWrapper(final_model)
+    background = torch.from_numpy(
+        kmeans_background(data["train_X"].numpy(), n_clusters=config.shap_background)
+    )
+
+    # Explain the whole prod population, whose explanations the backend serves
+    df_to_prod = pd.read_parquet(config.path(PROD_INPUT))
+    features, mean, scale = load_scaler_params(config.path(SCALER_PARAMS))
+    prod_features = df_to_prod[features].to_numpy(dtype=np.float32)
+    # Rows without a prediction are not in the prod data either
+    valid = ~np.isnan(prod_features).any(axis=1)
+    prod_X = (prod_features[valid] - mean) / scale
+    save_address_shap(
+        config.path(ADDRESS_SHAP_FOLDER),
+        model,
+        background,
+        addresses=df_to_prod[USER_COL].to_numpy()[valid],
+        X=prod_X,
+        features=prod_features[valid],
+        feature_names=features,
+        chunk_size=config.shap_chunk_size,
+        n_jobs=config.n_jobs,
+        method=config.shap_method,
+        threads=config.threads,
+    )
+
+
+def score(config: PipelineConfig) -> None:
+    df_to_prod = pd.read_parquet(config.path(PROD_INPUT))
+    features, predict = load_bundle(config.path(MODEL_BUNDLE))
+
+    X_to_prod = df_to_prod[features].to_numpy(dtype=np.float32)
+    logits = np.concatenate(
+        [
+            predict(np.ascontiguousarray(X_to_prod[i : i + SCORE_CHUNK_ROWS])).reshape(-1)
+            for i in range(0, len(X_to_prod), SCORE_CHUNK_ROWS)
+        ]
+    )
+    prod_predictions = expit(logits)
+
+    df_final = df_to_prod.copy()
+    df_final["prediction"] = prod_predictions
+
+    generate_prod_data(
+        df=df_final,
+        groups=config.groups,
+        output_folder=config.outputs_folder,
+        user_col=USER_COL,
+        prediction_col="prediction",
+        value_col="Transactions",
+        export_json=config.export_json,
+    )
+
+
+def sample_calibration_data(config: PipelineConfig) -> None:
+    data = _load_preprocessed(config)
+    (final_model,) = _load_models(config, config.path(FINAL_MODEL))
+
+    all_X = torch.cat([data["train_X"], data["test_X"]])
+    with torch.inference_mode():
+        scores = final_model(all_X).numpy()
+    rows = calibration_sample(all_X.numpy(), scores, max_rows=config.calibration_rows)
+    np.save(config.path(CALIBRATION_DATA), all_X[rows].numpy().astype(np.float32))
+    print(f"Calibrating on {len(rows)} of {len(all_X)} rows")
+
+
+def compile_circuit(config: PipelineConfig) -> None:
+    zkml_folder = config.outputs_folder / "zkml"
+    zkml_folder.mkdir(parents=True, exist_ok=True)
+    cal_X = torch.from_numpy(np.load(config.path(CALIBRATION_DATA)))
+    (final_model,) = _load_models(config, config.path(FINAL_MODEL))
+    cache = config.zk_artifact_cache()
+
+    batch_size = config.proof_batch_size
+    if batch_size is None:
+        results = asyncio.run(
+            benchmark_batch_sizes(
+                final_model,
+                cal_X,
+                config.proof_batch_sizes,
+                srs_path=config.srs_path,
+                cache=cache,
+            )
+        )
+        with (zkml_folder / "batch_benchmark.json").open("w") as f:
+            json.dump(results, f, indent=2)
+        batch_size = choose_batch_size(results)
+        print(f"Proving {batch_size} addresses per proof")
+
+    asyncio.run(
+        generate_compiled_model(
+            base_path=zkml_folder,
+            model=final_model,
+            cal_X=cal_X,
+            cache=cache,
+            batch_size=batch_size,
+        )
+    )
+
+
+def prepare_proof_input(config: PipelineConfig) -> None:
+    df_to_prod = pd.read_parquet(config.path(PROD_INPUT))
+    # The circuit takes standardized features
+    manifest = read_bundle_manifest(config.path(MODEL_BUNDLE))
+    X_to_prod = df_to_prod[manifest["features"]].to_numpy(dtype=np.float32)
+    mean = np.asarray(manifest["scaler"]["mean"], dtype=np.float32)
+    scale = np.asarray(manifest["scaler"]["scale"], dtype=np.float32)
+    # Rows without a prediction are not in the prod data either
+    valid = ~np.isnan(X_to_prod).any(axis=1)
+    print(f"Proving {valid.sum()} of {len(valid)} prod rows, without missing features")
+
+    write_proof_input(
+        addresses=df_to_prod[USER_COL].astype(str).to_numpy()[valid].tolist(),
+        X=(X_to_prod[valid] - mean) / scale,
+        addresses_path=config.path(PROOF_ADDRESSES),
+        features_path=config.path(PROOF_FEATURES),
+    )
+
+
+def prove(config: PipelineConfig) -> None:
+    zkml_folder = config.outputs_folder / "zkml"
+    proofs_folder = config.outputs_folder / "proofs"
+    keys_folder = proofs_folder / "keys"
+    paths = ProverPaths.from_folders(zkml_folder, keys_folder, config.srs_path)
+
+    cache = config.zk_artifact_cache()
+    # Without a cache, keys made for this circuit by an interrupted run are
+    # reused, so that its proofs are too
+    keys_are_current = cache is None and all(
+        p.is_file() and p.stat().st_mtime > paths.compiled_model.stat().st_mtime
+        for p in (paths.pk, paths.vk)
+    )
+    if not keys_are_current:
+        asyncio.run(setup_proving_keys(zkml_folder, keys_folder, config.srs_path, cache))
+
+    prove_addresses(
+        paths,
+        addresses=read_proof_addresses(config.path(PROOF_ADDRESSES)),
+        features_path=config.path(PROOF_FEATURES),
+        output_path=proofs_folder,
+        n_jobs=config.n_jobs,
+        threads=config.threads,
+    )
+
+
+def _training_params(config: PipelineConfig) -> dict:
+    # n_jobs, threads and checkpoint_every change how training runs, not its result:
+    # folds are seeded on their own (see training.train_fold)
+    return dict(
+        feature_renames=config.feature_renames,
+        learning_rate=config.learning_rate,
+        epochs=config.epochs,
+        vectorized_folds=config.vectorized_folds,
+        eval_every=config.eval_every,
+        patience=config.patience,
+    )
+
+
+STAGES = [
+    Stage(
+        name="ingest",
+        run=ingest,
+        outputs=lambda config: (ML_DATA, PROD_INPUT),
+        params=lambda config: dict(
+            feature_renames=config.feature_renames,
+            holdout_months=config.holdout_months,
+            prod_month=config.prod_month,
+        ),
+        sources=lambda config: [p for p in (config.data_file, config.feature_store) if p],
+    ),
+    Stage(
+        name="preprocess",
+        run=preprocess,
+        inputs=(ML_DATA,),
+        outputs=lambda config: (PREPROCESSED, SCALER, SCALER_PARAMS),
+        params=lambda config: dict(
+            feature_renames=config.feature_renames,
+            is_classification=config.is_classification,
+        ),
+        version=2,
+    ),
+    Stage(
+        name="train",
+        run=train,
+        inputs=(PREPROCESSED,),
+        outputs=lambda config: (MODELS, CURVES),
+        params=_training_params,
+        version=2,
+    ),
+    Stage(
+        name="evaluate",
+        run=evaluate,
+        inputs=(PREPROCESSED, MODELS),
+        outputs=lambda config: (EVALUATION, METRICS),
+        params=lambda config: dict(
+            is_classification=config.is_classification,
+            eval_thresholds=config.eval_thresholds,
+            selection_metric=config.selection_metric,
+            model_selected=config.model_selected,
+        ),
+        version=3,
+    ),
+    Stage(
+        name="export",
+        run=export,
+        inputs=(MODELS, SCALER_PARAMS, METRICS),
+        outputs=lambda config: (FINAL_MODEL, "model_scripted.pt", MODEL_BUNDLE),
+        version=4,
+    ),
+    Stage(
+        name="shap",
+        run=explain,
+        inputs=(PREPROCESSED, FINAL_MODEL, PROD_INPUT, SCALER_PARAMS),
+        outputs=lambda config: (ADDRESS_SHAP_FOLDER,),
+        # Chunks are seeded in order, so the chunk size changes the values
+        params=lambda config: dict(
+            feature_renames=config.feature_renames,
+            shap_background=config.shap_background,
+            shap_chunk_size=config.shap_chunk_size,
+            shap_method=config.shap_method,
+        ),
+        version=3,
+    ),
+    Stage(
+        name="plots",
+        run=render,
+        inputs=(CURVES, EVALUATION, ADDRESS_SHAP_FOLDER),
+        outputs=lambda config: tuple(job.output for job in plot_jobs(config)),
+        params=lambda config: dict(is_classification=config.is_classification),
+        version=2,
+    ),
+    Stage(
+        name="score",
+        run=score,
+        inputs=(PROD_INPUT, MODEL_BUNDLE),
+        outputs=lambda config: (PROD_DATA_FOLDER,)
+        + (("prod_data.json",) if config.export_json else ()),
+        params=lambda config: dict(groups=config.groups, export_json=config.export_json),
+    ),
+    Stage(
+        name="calibration",
+        run=sample_calibration_data,
+        inputs=(PREPROCESSED, FINAL_MODEL),
+        outputs=lambda config: (CALIBRATION_DATA,),
+        params=lambda config: dict(calibration_rows=config.calibration_rows),
+    ),
+    Stage(
+        name="zkml",
+        run=compile_circuit,
+        inputs=(CALIBRATION_DATA, FINAL_MODEL),
+        outputs=lambda config: ("zkml",),
+        params=lambda config: dict(
+            proof_batch_size=config.proof_batch_size,
+            proof_batch_sizes=config.proof_batch_sizes,
+        ),
+        sources=lambda config: [config.srs_path] if config.srs_path else [],
+    ),
+    Stage(
+        name="proof_input",
+        run=prepare_proof_input,
+        inputs=(PROD_INPUT, MODEL_BUNDLE),
+        outputs=lambda config: (PROOF_ADDRESSES, PROOF_FEATURES),
+        version=2,
+        # Only needed by the proofs stage
+        default=False,
+    ),
+    Stage(
+        name="proofs",
+        run=prove,
+        inputs=(PROOF_ADDRESSES, PROOF_FEATURES, "zkml"),
+        outputs=lambda config: ("proofs/proofs.json",),
+        sources=lambda config: [config.srs_path] if config.srs_path else [],
+        # Proving every prod address takes hours, so it is run explicitly
+        default=False,
+    ),
+]
+
+
+def run_pipeline(
+    config: PipelineConfig,
+    stages: Union[list[str], None] = None,
+    force: bool = False,
+) -> dict[str, float]:
+    """
+    Run the pipeline stages (all by default) that are not up to date.
+
+    Without config.render_plots, the default stages run without the plots
+    stage, whose data is saved all the same.
+    """
+    if stages is None and not config.render_plots:
+        stages = [stage.name for stage in STAGES if stage.default and stage.name != "plots"]
+    runner = PipelineRunner(STAGES, config, config.outputs_folder)
+    return runner.run(stages, force=force)
@@ -1,112 +1,569 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5
+from math import ceil
+from pathlib import Path
+from typing import Any, Callable, Iterator, Union
+
 import numpy as np
 import torch
-from sklearn.metrics import accuracy_score
+import torch.multiprocessing
 from torch import nn
-from torch.utils.data import DataLoader, TensorDataset
+from torch.func import functional_call, stack_module_state, vmap
 
 
-def train_cross_validation(
-    model_class: nn.Module,
+def iterate_batches(
+    X: torch.Tensor,
+    y: torch.Tensor,
+    batch_size: int,
+    shuffle: bool = True,
+    generator: Union[torch.Generator, None] = None,
+) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Yield (X, y) batches as contiguous slices of in-memory tensors.
+
+    When shuffling, the rows are permuted once per epoch with a single
+    gather, instead of indexing and collating sample by sample.
+    """
+    if shuffle:
+        permutation = torch.randperm(len(X), generator=generator)
+        X, y = X[permutation], y[permutation]
+    for start in range(0, len(X), batch_size):
+        yield X[start : start + batch_size], y[start : start + batch_size]
+
+
+def evaluated_epochs(epochs: int, eval_every: int = 1) -> list[int]:
+    """
+    Epochs at which the training and validation logs are computed.
+    """
+    return [
+        epoch
+        for epoch in range(epochs)
+        if (epoch + 1) % eval_every == 0 or epoch == epochs - 1
+    ]
+
+
+def _accuracy(logits: torch.Tensor, target: torch.Tensor) -> float:
+    return ((logits > 0) == (target > 0.5)).to(torch.float32).mean().item()
+
+
+def _save_checkpoint(checkpoint_path: Path, checkpoint: dict[str, Any]) -> None:
+    # Write then rename, so a kill mid-save never leaves a corrupt checkpoint
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint_path.with_suffix(".tmp")
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _content_hash(*arrays: Union[torch.Tensor, np.ndarray]) -> str:
+    digest = md5()
+    for array in arrays:
+        array = np.ascontiguousarray(np.asarray(array))
+        digest.update(f"{array.dtype}{array.shape}".encode())
+        digest.update(array.data)
+    return digest.hexdigest()
+
+
+def train_fold(
+    model_class: Callable[[], nn.Module],
     train_X: torch.Tensor,
     train_y: torch.Tensor,
-    group_kfold_splits: list[tuple[np.ndarray, np.ndarray]],
+    train_idx: np.ndarray,
+    validation_idx: np.ndarray,
+    fold_idx: int = 0,
     batch_size: int = 64,
     epochs: int = 30,
     learning_rate: float = 0.03,
     shuffle_batches=True,
     is_classification=True,
-):
-    models = []
-    train_loss_lists = []
-    train_accuracy_lists = []
-    valid_loss_lists = []
-    valid_accuracy_lists = []
+    eval_every: int = 1,
+    patience: Union[int, None] = None,
+    checkpoint_path: Union[Path, None] = None,
+    checkpoint_every: int = 1,
+    seed: int = 0,
+) -> tuple[nn.Module, list[float], list[float], list[float], list[float]]:
+    """
+    Train one fold, optionally with early stopping and resumable checkpoints.
 
-    # train in cross validation folds
-    for fold_idx, (train_idx, validation_idx) in enumerate(group_kfold_splits):
-        fold_model = model_class()
-        optimizer = torch.optim.Adam(fold_model.parameters(), lr=learning_rate)
-        if is_classification:
-            criterion = nn.BCEWithLogitsLoss()
-        else:
-            criterion = nn.MSELoss()
+    The torch RNG is seeded with seed + fold_idx before the model is built,
+    so a fold trains the same whichever process (and after whichever other
+    folds) it runs in.
+
+    With patience, training stops after that many evaluations without a
+    better validation loss and the best weights are restored. With
+    checkpoint_path, the model, optimizer, RNG and curves are saved every
+    checkpoint_every epochs; a later call with the same settings resumes
+    from there, or returns right away if the fold already finished.
+    """
+    torch.manual_seed(seed + fold_idx)
+    fold_model = model_class()
+    optimizer = torch.optim.Adam(fold_model.parameters(), lr=learning_rate)
+    if is_classification:
+        criterion = nn.BCEWithLogitsLoss()
+    else:
+        criterion = nn.MSELoss()
 
-        print(f"\nFold {fold_idx}")
-        # prepare data
-        train_x_fold = train_X[train_idx]
-        train_y_fold = train_y[train_idx]
-        validation_x_fold = train_X[validation_idx]
-        validation_y_fold = train_y[validation_idx]
+    print(f"\nFold {fold_idx}")
+    # prepare data, with the targets cast once
+    train_x_fold = train_X[train_idx]
+    train_y_fold = train_y[train_idx].to(torch.float32)
+    validation_x_fold = train_X[validation_idx]
+    validation_y_fold = train_y[validation_idx].to(torch.float32)
 
-        train_dataset = TensorDataset(train_x_fold, train_y_fold)
-        validation_dataset = TensorDataset(validation_x_fold, validation_y_fold)
+    # Checkpoints are only resumed by runs with the same settings, model,
+    # data and split
+    settings = dict(
+        model=type(fold_model).__qualname__,
+        parameter_shapes={k: tuple(v.shape) for k, v in fold_model.state_dict().items()},
+        input_size=train_X.shape[1],
+        data=_content_hash(train_X, train_y),
+        batch_size=batch_size,
+        epochs=epochs,
+        learning_rate=learning_rate,
+        shuffle_batches=shuffle_batches,
+        is_classification=is_classification,
+        eval_every=eval_every,
+        patience=patience,
+        seed=seed + fold_idx,
+        split=_content_hash(train_idx, validation_idx),
+    )
+    state = dict(
+        settings=settings,
+        epoch=0,
+        done=False,
+        best_loss=float("inf"),
+        best_state=None,
+        bad_evaluations=0,
+        curves=([], [], [], []),
+    )
+    if checkpoint_path is not None and checkpoint_path.is_file():
+        checkpoint = torch.load(checkpoint_path)
+        if checkpoint["settings"] == settings:
+            state = checkpoint
+            fold_model.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            torch.set_rng_state(checkpoint["rng"])
+            print(f"Resuming fold {fold_idx} from epoch {state['epoch']}")
+        else:
+            print(f"Ignoring checkpoint {checkpoint_path} from a different run")
+
+    (
+        train_loss_list,
+        train_accuracy_list,
+        valid_loss_list,
+        valid_accuracy_list,
+    ) = state["curves"]
 
-        train_loader = DataLoader(
-            train_dataset, batch_size=batch_size, shuffle=shuffle_batches
+    def save_checkpoint() -> None:
+        _save_checkpoint(
+            checkpoint_path,
+            {
+                **state,
+                "model": fold_model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "rng": torch.get_rng_state(),
+            },
         )
 
-        train_loss_list = []
-        train_accuracy_list = []
+    log_epochs = set(evaluated_epochs(epochs, eval_every))
 
-        valid_loss_list = []
-        valid_accuracy_list = []
+    for epoch in range(state["epoch"], epochs):
+        if state["done"]:
+            break
 
-        for epoch in range(epochs):
-            fold_model.train()
-            for batch_idx, (data, target) in enumerate(train_loader):
-                optimizer.zero_grad()
-                output = fold_model(data)
-                target = target.to(torch.float32)
-                loss = criterion(output, target)
-                loss.backward()
-                optimizer.step()
+        fold_model.train()
+        for data, target in iterate_batches(
+            train_x_fold, train_y_fold, batch_size, shuffle=shuffle_batches
+        ):
+            optimizer.zero_grad()
+            output = fold_model(data)
+            loss = criterion(output, target)
+            loss.backward()
+            optimizer.step()
 
+        state["epoch"] = epoch + 1
+
+        if epoch in log_epochs:
             fold_model.eval()
-            with torch.no_grad():
+            with torch.inference_mode():
                 # calculate training logs
                 train_pred = fold_model(train_x_fold)
-                train_y_fold = train_y_fold.to(torch.float32)
                 train_loss = criterion(train_pred, train_y_fold).item()
                 train_loss_list.append(train_loss)
 
                 if is_classification:
-                    train_pred = torch.sigmoid(train_pred) > 0.5
-                    train_accuracy = accuracy_score(
-                        train_y_fold, train_pred.cpu().numpy()
-                    )
+                    train_accuracy = _accuracy(train_pred, train_y_fold)
                     train_accuracy_list.append(train_accuracy)
 
                 # calculate validation logs
                 valid_pred = fold_model(validation_x_fold)
-                validation_y_fold = validation_y_fold.to(torch.float32)
-
                 valid_loss = criterion(valid_pred, validation_y_fold).item()
                 valid_loss_list.append(valid_loss)
 
                 if is_classification:
-                    valid_pred = torch.sigmoid(valid_pred) > 0.5
-                    valid_accuracy = accuracy_score(
-                        validation_y_fold, valid_pred.cpu().numpy()
-                    )
+                    valid_accuracy = _accuracy(valid_pred, validation_y_fold)
                     valid_accuracy_list.append(valid_accuracy)
 
-            if epoch % 10 == 0:
+            if len(train_loss_list) % 10 == 1:
                 print(
-                    f"Epoch: {epoch} Train loss: {train_loss:.4f} Validation loss: {valid_loss:.4f}"
+                    f"Fold {fold_idx} Epoch: {epoch} Train loss: {train_loss:.4f} Validation loss: {valid_loss:.4f}"
                 )
 
-        models.append(fold_model)
-        train_loss_lists.append(train_loss_list)
-        train_accuracy_lists.append(train_accuracy_list)
-        valid_loss_lists.append(valid_loss_list)
-        valid_accuracy_lists.append(valid_accuracy_list)
-
-        print(f"Fold {fold_idx} done, metrics:")
-        print(f"  Train loss: {train_loss:.4f}")
-        print(f"  Validation loss: {valid_loss:.4f}")
-        if is_classification:
-            print(f"  Train accuracy: {train_accuracy:.4f}")
-            print(f"  Validation accuracy: {valid_accuracy:.4f}")
+            if patience is not None:
+                if valid_loss < state["best_loss"]:
+                    state["best_loss"] = valid_loss
+                    state["best_state"] = copy.deepcopy(fold_model.state_dict())
+                    state["bad_evaluations"] = 0
+                else:
+                    state["bad_evaluations"] += 1
+                if state["bad_evaluations"] >= patience:
+                    print(f"Fold {fold_idx} early stopping at epoch {epoch}")
+                    state["done"] = True
+
+        if checkpoint_path is not None and state["epoch"] % checkpoint_every == 0:
+            save_checkpoint()
+
+    state["done"] = True
+    if patience is not None and state["best_state"] is not None:
+        fold_model.load_state_dict(state["best_state"])
+    if checkpoint_path is not None:
+        save_checkpoint()
+
+    print(f"Fold {fold_idx} done, metrics:")
+    print(f"  Train loss: {train_loss_list[-1]:.4f}")
+    print(f"  Validation loss: {valid_loss_list[-1]:.4f}")
+    if is_classification:
+        print(f"  Train accuracy: {train_accuracy_list[-1]:.4f}")
+        print(f"  Validation accuracy: {valid_accuracy_list[-1]:.4f}")
+
+    return (
+        fold_model,
+        train_loss_list,
+        train_accuracy_list,
+        valid_loss_list,
+        valid_accuracy_list,
+    )
+
+
+def _init_worker(n_threads: int) -> None:
+    torch.set_num_threads(n_threads)
+
+
+def train_cross_validation(
+    model_class: Callable[[], nn.Module],
+    train_X: torch.Tensor,
+    train_y: torch.Tensor,
+    group_kfold_splits: list[tuple[np.ndarray, np.ndarray]],
+    batch_size: int = 64,
+    epochs: int = 30,
+    learning_rate: float = 0.03,
+    shuffle_batches=True,
+    is_classification=True,
+    n_jobs: int = 1,
+    threads_per_job: Union[int, None] = None,
+    threads: Union[int, None] = None,
+    eval_every: int = 1,
+    patience: Union[int, None] = None,
+    checkpoint_dir: Union[Path, None] = None,
+    checkpoint_every: int = 1,
+    seed: int = 0,
+):
+    """
+    Train one model per GroupKFold split.
+
+    With n_jobs > 1 the folds are trained concurrently in a pool of spawned
+    processes, each one limited to threads_per_job torch threads (by default
+    threads, or all the CPUs, split evenly between jobs). The training tensors are moved to
+    shared memory so workers receive a handle instead of a pickled copy.
+    model_class must be picklable (e.g. a module-level class or a partial of
+    one). Results always come back in fold order, and do not depend on n_jobs
+    since each fold is seeded from seed (see train_fold).
+
+    The loss and accuracy curves hold one value per evaluated epoch, see
+    evaluated_epochs for the eval_every cadence.
+
+    patience enables per-fold early stopping with best-weights restoration.
+    With checkpoint_dir, each fold checkpoints to fold_{i}.pt in it, so
+    re-running the same training skips finished folds and resumes the
+    interrupted one from its last checkpoint (see train_fold).
+    """
+    fold_kwargs = dict(
+        batch_size=batch_size,
+        epochs=epochs,
+        learning_rate=learning_rate,
+        shuffle_batches=shuffle_batches,
+        is_classification=is_classification,
+        eval_every=eval_every,
+        patience=patience,
+        checkpoint_every=checkpoint_every,
+        seed=seed,
+    )
+
+    def checkpoint_path(fold_idx: int) -> Union[Path, None]:
+        if checkpoint_dir is None:
+            return None
+        return Path(checkpoint_dir) / f"fold_{fold_idx}.pt"
+
+    # train in cross validation folds
+    if n_jobs <= 1:
+        fold_results = [
+            train_fold(
+                model_class,
+                train_X,
+                train_y,
+                train_idx,
+                validation_idx,
+                fold_idx=fold_idx,
+                checkpoint_path=checkpoint_path(fold_idx),
+                **fold_kwargs,
+            )
+            for fold_idx, (train_idx, validation_idx) in enumerate(group_kfold_splits)
+        ]
+    else:
+        n_jobs = min(n_jobs, len(group_kfold_splits))
+        if threads_per_job is None:
+            threads_per_job = max(1, (threads or os.cpu_count() or 1) // n_jobs)
+
+        train_X = train_X.share_memory_()
+        train_y = train_y.share_memory_()
+
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=torch.multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(threads_per_job,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    train_fold,
+                    model_class,
+                    train_X,
+                    train_y,
+                    train_idx,
+                    validation_idx,
+                    fold_idx=fold_idx,
+                    checkpoint_path=checkpoint_path(fold_idx),
+                    **fold_kwargs,
+                )
+                for fold_idx, (train_idx, validation_idx) in enumerate(
+                    group_kfold_splits
+                )
+            ]
+            fold_results = [future.result() for future in futures]
+
+    models = [result[0] for result in fold_results]
+    train_loss_lists = [result[1] for result in fold_results]
+    train_accuracy_lists = [result[2] for result in fold_results]
+    valid_loss_lists = [result[3] for result in fold_results]
+    valid_accuracy_lists = [result[4] for result in fold_results]
+
+    return (
+        models,
+        train_loss_lists,
+        train_accuracy_lists,
+        valid_loss_lists,
+        valid_accuracy_lists,
+    )
+
+
+class StackedAdam:
+    """
+    Adam over parameters stacked along a leading member dimension, with one
+    learning rate per member. Equivalent to an independent torch.optim.Adam
+    per member, since every Adam update is elementwise.
+    """
+
+    def __init__(
+        self,
+        params: list[torch.Tensor],
+        learning_rates: torch.Tensor,
+        betas: tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-8,
+    ):
+        self.params = params
+        self.learning_rates = learning_rates
+        self.betas = betas
+        self.eps = eps
+        self.step_count = 0
+        self.exp_avgs = [torch.zeros_like(p) for p in params]
+        self.exp_avg_sqs = [torch.zeros_like(p) for p in params]
+
+    def zero_grad(self) -> None:
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self) -> None:
+        beta1, beta2 = self.betas
+        self.step_count += 1
+        bias_correction1 = 1 - beta1**self.step_count
+        bias_correction2_sqrt = (1 - beta2**self.step_count) ** 0.5
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avgs, self.exp_avg_sqs):
+            exp_avg.lerp_(p.grad, 1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+            denom = (exp_avg_sq.sqrt() / bias_correction2_sqrt).add_(self.eps)
+            step_size = self.learning_rates.view(-1, *[1] * (p.dim() - 1)) / bias_correction1
+            p.sub_(step_size * exp_avg / denom)
+
+
+def _masked_mean(values: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+    # Mean over the rows of each member (dim 1) selected by its mask
+    return (values * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+
+def train_ensemble(
+    model_class: Callable[..., nn.Module],
+    train_X: torch.Tensor,
+    train_y: torch.Tensor,
+    group_kfold_splits: list[tuple[np.ndarray, np.ndarray]],
+    batch_size: int = 64,
+    epochs: int = 30,
+    learning_rate: float = 0.03,
+    shuffle_batches=True,
+    is_classification=True,
+    eval_every: int = 1,
+    learning_rates: Union[list[float], None] = None,
+    model_kwargs: Union[list[dict[str, Any]], None] = None,
+    eval_chunk_size: int = 65536,
+    seed: int = 0,
+):
+    """
+    Train all the folds (and optionally a grid of settings) as one batched model.
+
+    Every member (setting x fold) shares the architecture of its setting, so
+    their parameters are stacked and the forward pass is vmapped: each step
+    runs one larger matmul per layer instead of one small matmul per fold.
+    All members see the same batch of the shared train tensor, and each one
+    only learns from the rows of its fold's training split (per-fold masks).
+    The shared batch is enlarged so each member still averages over about
+    batch_size rows per step.
+
+    learning_rates and model_kwargs (passed to model_class) define the grid
+    of settings. Members with different model_kwargs cannot be stacked, so
+    each architecture is trained as its own batched computation. Returns the
+    same lists as train_cross_validation, ordered by setting and then fold.
+    The members are initialized from the torch RNG seeded with seed.
+    """
+    learning_rates = learning_rates or [learning_rate]
+    model_kwargs = model_kwargs or [{}]
+    n_folds = len(group_kfold_splits)
+    n_rows = len(train_X)
+
+    train_masks = torch.zeros(n_folds, n_rows)
+    valid_masks = torch.zeros(n_folds, n_rows)
+    for fold_idx, (train_idx, validation_idx) in enumerate(group_kfold_splits):
+        train_masks[fold_idx, train_idx] = 1
+        valid_masks[fold_idx, validation_idx] = 1
+
+    mean_fold_rows = train_masks.sum(dim=1).mean().item()
+    shared_batch_size = ceil(batch_size * n_rows / mean_fold_rows)
+
+    train_y = train_y.to(torch.float32)
+    if is_classification:
+        criterion = nn.BCEWithLogitsLoss(reduction="none")
+    else:
+        criterion = nn.MSELoss(reduction="none")
+
+    models = []
+    train_loss_lists = []
+    train_accuracy_lists = []
+    valid_loss_lists = []
+    valid_accuracy_lists = []
+
+    log_epochs = set(evaluated_epochs(epochs, eval_every))
+    torch.manual_seed(seed)
+
+    for kwargs in model_kwargs:
+        n_members = len(learning_rates) * n_folds
+        print(f"\nTraining {n_members} stacked members with {kwargs}")
+        member_models = [model_class(**kwargs) for _ in range(n_members)]
+        params, buffers = stack_module_state(member_models)
+        base_model = copy.deepcopy(member_models[0]).to("meta")
+
+        def forward(member_params, member_buffers, x):
+            return functional_call(base_model, (member_params, member_buffers), (x,))
+
+        batched_forward = vmap(forward, in_dims=(0, 0, None))
+
+        # members are ordered learning rate first, then fold
+        member_lrs = torch.tensor(learning_rates, dtype=torch.float32).repeat_interleave(n_folds)
+        member_train_masks = train_masks.repeat(len(learning_rates), 1)
+        member_valid_masks = valid_masks.repeat(len(learning_rates), 1)
+        optimizer = StackedAdam(list(params.values()), member_lrs)
+
+        curves = {name: [[] for _ in range(n_members)] for name in ("tl", "ta", "vl", "va")}
+        rows = torch.arange(n_rows)
+
+        for epoch in range(epochs):
+            for data, batch_rows in iterate_batches(
+                train_X, rows, shared_batch_size, shuffle=shuffle_batches
+            ):
+                target = train_y[batch_rows]
+                optimizer.zero_grad()
+                output = batched_forward(params, buffers, data).squeeze(-1)
+                losses = criterion(output, target.squeeze(-1).expand_as(output))
+                loss = _masked_mean(losses, member_train_masks[:, batch_rows]).sum()
+                loss.backward()
+                optimizer.step()
+
+            if epoch not in log_epochs:
+                continue
+
+            with torch.inference_mode():
+                sums = torch.zeros(4, n_members)
+                for start in range(0, n_rows, eval_chunk_size):
+                    chunk = slice(start, start + eval_chunk_size)
+                    output = batched_forward(params, buffers, train_X[chunk]).squeeze(-1)
+                    target = train_y[chunk].squeeze(-1).expand_as(output)
+                    losses = criterion(output, target)
+                    correct = ((output > 0) == (target > 0.5)).to(torch.float32)
+                    train_mask = member_train_masks[:, chunk]
+                    valid_mask = member_valid_masks[:, chunk]
+                    sums += torch.stack(
+                        [
+                            (losses * train_mask).sum(dim=1),
+                            (correct * train_mask).sum(dim=1),
+                            (losses * valid_mask).sum(dim=1),
+                            (correct * valid_mask).sum(dim=1),
+                        ]
+                    )
+                counts = torch.stack(
+                    [member_train_masks.sum(dim=1)] * 2 + [member_valid_masks.sum(dim=1)] * 2
+                ).clamp(min=1)
+                means = (sums / counts).tolist()
+
+            for member in range(n_members):
+                curves["tl"][member].append(means[0][member])
+                curves["vl"][member].append(means[2][member])
+                if is_classification:
+                    curves["ta"][member].append(means[1][member])
+                    curves["va"][member].append(means[3][member])
+
+            if len(curves["tl"][0]) % 10 == 1:
+                print(
+                    f"Epoch: {epoch} Train loss: {np.mean([c[-1] for c in curves['tl']]):.4f} "
+                    f"Validation loss: {np.mean([c[-1] for c in curves['vl']]):.4f} (mean over members)"
+                )
+
+        for member in range(n_members):
+            member_model = model_class(**kwargs)
+            member_model.load_state_dict(
+                {
+                    name: tensor[member].detach().clone()
+                    for name, tensor in {**params, **buffers}.items()
+                }
+            )
+            models.append(member_model)
+            train_loss_lists.append(curves["tl"][member])
+            train_accuracy_lists.append(curves["ta"][member])
+            valid_loss_lists.append(curves["vl"][member])
+            valid_accuracy_lists.append(curves["va"][member])
+
+            print(
+                f"Member {member} (lr {member_lrs[member].item():g}, fold {member % n_folds}): "
+                f"Train loss: {curves['tl'][member][-1]:.4f} Validation loss: {curves['vl'][member][-1]:.4f}"
+            )
 
     return (
         models,
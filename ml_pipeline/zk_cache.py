@@ -0,0 +1,100 @@
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+DEFAULT_CACHE_FOLDER = Path(
+    os.environ.get("ZK_CACHE_FOLDER", Path.home() / ".cache" / "ml_pipeline" / "zk")
+)
+
+
+class ZKArtifactCache:
+    """
+    Content-addressed store of ezkl artifacts shared by pipeline runs.
+
+    Each entry is a folder root / "{kind}-{key}" holding the files built for
+    that key (circuit settings and compiled circuit, SRS, proving and
+    verification keys), so an unchanged model or circuit skips straight to
+    the next step. Entries are built in a staging folder and renamed into
+    place, so concurrent runs never see a partial entry. The total size is
+    bounded by evicting the least recently used entries.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 20 * 1024**3):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def entry_path(self, kind: str, key: str) -> Path:
+        return self.root / f"{kind}-{key}"
+
+    def lookup(self, kind: str, key: str) -> Union[Path, None]:
+        """
+        Return the entry folder of (kind, key), or None if it is not cached.
+        """
+        entry = self.entry_path(kind, key)
+        marker = entry / ".complete"
+        if not marker.is_file():
+            return None
+        # The marker mtime is the entry's last use
+        os.utime(marker)
+        print(f"Using cached {kind} {key[:12]}")
+        return entry
+
+    @contextmanager
+    def build(self, kind: str, key: str) -> Iterator[Path]:
+        """
+        Yield a staging folder to write the files of (kind, key) into, which
+        becomes the entry once the block completes.
+        """
+        entry = self.entry_path(kind, key)
+        staging = self.root / f".staging-{uuid.uuid4().hex}"
+        staging.mkdir(parents=True)
+        try:
+            yield staging
+            (staging / ".complete").touch()
+            try:
+                staging.rename(entry)
+            except OSError:
+                # Built concurrently by another run
+                assert (entry / ".complete").is_file(), f"Cache entry {entry} is incomplete"
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict(keep=entry)
+
+    def evict(self, keep: Union[Path, None] = None) -> None:
+        """
+        Remove the least recently used entries (but `keep`) while the cache
+        is larger than max_bytes.
+        """
+        entries = []
+        for entry in self.root.iterdir():
+            marker = entry / ".complete"
+            if entry.name.startswith(".") or not marker.is_file():
+                continue
+            size = sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            entries.append((marker.stat().st_mtime, entry, size))
+
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            print(f"Evicting {entry.name} ({size / 1024**2:.0f} MB) from the ZK cache")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def link_file(source: Path, destination: Path) -> None:
+    """
+    Hard link source to destination (copying across file systems), so that
+    the file outlives the eviction of its cache entry.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
@@ -1,34 +1,164 @@
 import asyncio
+import hashlib
+import inspect
 import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import ceil
 from pathlib import Path
+from typing import NamedTuple, Union
 
 import ezkl
+import numpy as np
 import torch
 
+from ml_pipeline.zk_cache import ZKArtifactCache, link_file
+
+# Argument sizes of IVerifier.verifyProof, used by ZkMLAirdrop
+VERIFIER_PROOF_WORDS = 24
+VERIFIER_PUB_SIGNALS = 4
+
+
+# "fixed" for params means that the committed to params are used for all proofs
+RUN_ARGS = dict(input_visibility="public", output_visibility="public", param_visibility="fixed")
+
+
+async def _resolve(result):
+    # Some ezkl versions return awaitables, others plain values
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
 
 async def calibrate(
     cal_data_path: Path,
     model_path: Path,
     settings_path: Path,
 ) -> bool:
-    return await ezkl.calibrate_settings(
-        cal_data_path, model_path, settings_path, "resources"
+    return await _resolve(
+        ezkl.calibrate_settings(str(cal_data_path), str(model_path), str(settings_path), "resources")
     )
 
 
+def export_onnx(model: torch.nn.Module, sample_input: torch.Tensor, model_path: Path) -> None:
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # opset 10 is only supported by the TorchScript based exporter
+        export_kwargs["dynamo"] = False
+
+    model.eval()
+    torch.onnx.export(
+        model,  # model being run
+        sample_input,  # model input (or a tuple for multiple inputs)
+        model_path,  # where to save the model (can be a file or file-like object)
+        export_params=True,  # store the trained parameter weights inside the model file
+        opset_version=10,  # the ONNX version to export the model to
+        do_constant_folding=True,  # whether to execute constant folding for optimization
+        input_names=["input"],  # the model's input names
+        output_names=["output"],  # the model's output names
+        dynamic_axes={
+            "input": {0: "batch_size"},  # variable length axes
+            "output": {0: "batch_size"},
+        },
+        **export_kwargs,
+    )
+
+
+async def calibrate_and_compile(
+    folder: Path,
+    model_path: Path,
+    cal_data_path: Path,
+    batch_size: int = 1,
+) -> None:
+    """
+    Generate, calibrate and compile the circuit of an ONNX model into
+    folder / "settings.json" and folder / "network.ezkl", with the dynamic
+    batch axis fixed to batch_size rows.
+    """
+    settings_path = folder / "settings.json"
+    compiled_model_path = folder / "network.ezkl"
+
+    py_run_args = ezkl.PyRunArgs()
+    for name, value in RUN_ARGS.items():
+        setattr(py_run_args, name, value)
+    py_run_args.variables = [("batch_size", batch_size)]
+
+    res = ezkl.gen_settings(str(model_path), str(settings_path), py_run_args=py_run_args)
+    assert res == True, "Failed to generate settings"
+
+    res = await calibrate(cal_data_path, model_path, settings_path)
+    assert res == True, "Failed to calibrate settings"
+
+    res = ezkl.compile_circuit(str(model_path), str(compiled_model_path), str(settings_path))
+    assert res == True, "Failed to compile the circuit"
+
+
+def calibration_sample(
+    X: np.ndarray,
+    scores: np.ndarray,
+    max_rows: int = 256,
+    n_buckets: int = 10,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Indexes of a stratified sample of at most max_rows rows of X to
+    calibrate the circuit on.
+
+    The rows holding the min and max of each feature are always in, so the
+    fixed point scales cover the real feature range. The rest is drawn
+    evenly from n_buckets quantile buckets of the model scores, so that
+    calibration sees the whole output range however large X is.
+    """
+    X = np.asarray(X)
+    scores = np.asarray(scores).reshape(-1)
+    if len(X) <= max_rows:
+        return np.arange(len(X))
+
+    extremes = np.unique(np.concatenate([X.argmin(axis=0), X.argmax(axis=0)]))
+    selected = extremes[:max_rows]
+
+    rng = np.random.default_rng(seed)
+    edges = np.quantile(scores, np.linspace(0, 1, n_buckets + 1)[1:-1])
+    buckets = np.digitize(scores, edges)
+    available = np.ones(len(X), dtype=bool)
+    available[selected] = False
+    remaining = max_rows - len(selected)
+    samples = [selected]
+    for i, bucket in enumerate(np.unique(buckets)):
+        members = np.flatnonzero((buckets == bucket) & available)
+        # Rows left over by small buckets go to the next ones
+        n_rows = min(remaining // (len(np.unique(buckets)) - i), len(members))
+        samples.append(rng.choice(members, size=n_rows, replace=False))
+        remaining -= n_rows
+    return np.sort(np.concatenate(samples))
+
+
 async def generate_compiled_model(
     base_path: Path,
     model: torch.nn.Module,
-    test_X: torch.Tensor,
+    cal_X: torch.Tensor,
+    cache: Union[ZKArtifactCache, None] = None,
+    batch_size: int = 1,
 ):
+    """
+    Export the model to ONNX and compile its circuit into base_path,
+    calibrated on the rows of cal_X (see calibration_sample).
+
+    The circuit takes batch_size feature rows and outputs batch_size
+    scores, so one proof covers that many users. With a cache, the circuit
+    is looked up by the hash of the ONNX graph, the calibration data, the
+    run args, the batch size and the ezkl version, and only calibrated and
+    compiled if it is not there.
+    """
     model_path = base_path / "network.onnx"
     compiled_model_path = base_path / "network.ezkl"
-    settings_path = base_path / "settings.json"
     data_path = base_path / "input_data.json"
     cal_data_path = base_path / "cal_data.json"
-    proof_data_path = base_path / "proof_data.json"
 
-    sample_input = test_X[0].reshape(1, -1)
+    sample_input = cal_X[torch.arange(batch_size) % len(cal_X)]
 
     data_array = (sample_input.detach().numpy()).reshape([-1]).tolist()
 
@@ -38,67 +168,468 @@ async def generate_compiled_model(
     with data_path.open("w") as f:
         json.dump(data, f)
 
-    # use the test set to calibrate the circuit
-    cal_data = dict(input_data=[float(v) for v in test_X[:20].flatten().tolist()])
+    # calibrate on whole batches (one flattened list per model input)
+    cal_rows = torch.arange(ceil(len(cal_X) / batch_size) * batch_size) % len(cal_X)
+    cal_data = dict(input_data=[[float(v) for v in cal_X[cal_rows].flatten().tolist()]])
 
     # Serialize calibration data into file:
-    json.dump(cal_data, open(cal_data_path, "w"))
+    with cal_data_path.open("w") as f:
+        json.dump(cal_data, f)
 
-    model.eval()
+    export_onnx(model, sample_input, model_path)
 
-    torch.onnx.export(
-        model,  # model being run
-        sample_input,  # model input (or a tuple for multiple inputs)
-        model_path,  # where to save the model (can be a file or file-like object)
-        export_params=True,  # store the trained parameter weights inside the model file
-        opset_version=10,  # the ONNX version to export the model to
-        do_constant_folding=True,  # whether to execute constant folding for optimization
-        input_names=["input"],  # the model's input names
-        output_names=["output"],  # the model's output names
-        dynamic_axes={
-            "input": {0: "batch_size"},  # variable length axes
-            "output": {0: "batch_size"},
-        },
+    if cache is None:
+        await calibrate_and_compile(base_path, model_path, cal_data_path, batch_size)
+    else:
+        key = hashlib.sha256()
+        for path in (model_path, cal_data_path):
+            key.update(path.read_bytes())
+        key.update(
+            json.dumps([RUN_ARGS, batch_size, ezkl.__version__], sort_keys=True).encode()
+        )
+
+        entry = cache.lookup("circuit", key.hexdigest())
+        if entry is None:
+            with cache.build("circuit", key.hexdigest()) as folder:
+                await calibrate_and_compile(folder, model_path, cal_data_path, batch_size)
+            entry = cache.entry_path("circuit", key.hexdigest())
+        for name in ("settings.json", "network.ezkl"):
+            link_file(entry / name, base_path / name)
+
+    print(f"Compiled model saved to {compiled_model_path}")
+
+
+async def setup_proving_keys(
+    base_path: Path,
+    keys_path: Path,
+    srs_path: Union[Path, None] = None,
+    cache: Union[ZKArtifactCache, None] = None,
+) -> None:
+    """
+    Create the proving and verification keys of the circuit compiled in
+    base_path, into keys_path.
+
+    The public SRS is downloaded for the circuit size unless an SRS file is
+    given (e.g. one made with ezkl.gen_srs to test locally). With a cache,
+    the public SRS and the keys are reused across runs: keys are looked up
+    by the hash of the compiled circuit, its settings and the SRS.
+    """
+    keys_path.mkdir(parents=True, exist_ok=True)
+    compiled_model_path = base_path / "network.ezkl"
+    settings_path = base_path / "settings.json"
+
+    async def get_srs(srs_file: Path) -> None:
+        res = await _resolve(
+            ezkl.get_srs(settings_path=str(settings_path), srs_path=str(srs_file))
+        )
+        assert res == True, "Failed to get the SRS"
+
+    def setup(folder: Path, srs_file: Path) -> None:
+        res = ezkl.setup(
+            str(compiled_model_path),
+            str(folder / "vk.key"),
+            str(folder / "pk.key"),
+            srs_path=str(srs_file),
+        )
+        assert res == True, "Failed to set up the proving keys"
+
+    if cache is None:
+        if srs_path is None:
+            srs_path = keys_path / "kzg.srs"
+            if not srs_path.is_file():
+                await get_srs(srs_path)
+        setup(keys_path, srs_path)
+    else:
+        if srs_path is None:
+            with settings_path.open() as f:
+                logrows = json.load(f)["run_args"]["logrows"]
+            # The public SRS only depends on the circuit size
+            srs_id = f"public-k{logrows}".encode()
+            srs_entry = cache.lookup("srs", f"k{logrows}")
+            if srs_entry is None:
+                with cache.build("srs", f"k{logrows}") as folder:
+                    await get_srs(folder / "kzg.srs")
+                srs_entry = cache.entry_path("srs", f"k{logrows}")
+            srs_path = keys_path / "kzg.srs"
+            link_file(srs_entry / "kzg.srs", srs_path)
+        else:
+            srs_id = srs_path.read_bytes()
+
+        key = hashlib.sha256(srs_id)
+        for path in (compiled_model_path, settings_path):
+            key.update(path.read_bytes())
+        keys_entry = cache.lookup("keys", key.hexdigest())
+        if keys_entry is None:
+            with cache.build("keys", key.hexdigest()) as folder:
+                setup(folder, srs_path)
+            keys_entry = cache.entry_path("keys", key.hexdigest())
+        for name in ("pk.key", "vk.key"):
+            link_file(keys_entry / name, keys_path / name)
+
+    print(f"Proving keys saved to {keys_path}")
+
+
+class ProverPaths(NamedTuple):
+    compiled_model: Path
+    settings: Path
+    pk: Path
+    vk: Path
+    srs: Path
+
+    @classmethod
+    def from_folders(
+        cls,
+        base_path: Path,
+        keys_path: Path,
+        srs_path: Union[Path, None] = None,
+    ) -> "ProverPaths":
+        return cls(
+            compiled_model=base_path / "network.ezkl",
+            settings=base_path / "settings.json",
+            pk=keys_path / "pk.key",
+            vk=keys_path / "vk.key",
+            srs=srs_path if srs_path is not None else keys_path / "kzg.srs",
+        )
+
+
+def generate_witness(paths: ProverPaths, input_data: list[float], work_path: Path) -> Path:
+    data_path = work_path / "input.json"
+    witness_path = work_path / "witness.json"
+    with data_path.open("w") as f:
+        json.dump(dict(input_data=[input_data]), f)
+
+    ezkl.gen_witness(
+        str(data_path),
+        str(paths.compiled_model),
+        str(witness_path),
+        vk_path=str(paths.vk),
+        srs_path=str(paths.srs),
     )
+    return witness_path
 
-    # concat test_X and train_X
-    all_X = test_X
 
-    proof_input = all_X
-    proof_data_array = proof_input.detach().numpy().tolist()
-    proof_data = dict(input_data=proof_data_array)
+def generate_proof(paths: ProverPaths, witness_path: Path, work_path: Path) -> Path:
+    proof_path = work_path / "proof.json"
+    ezkl.prove(
+        str(witness_path),
+        str(paths.compiled_model),
+        str(paths.pk),
+        str(proof_path),
+        srs_path=str(paths.srs),
+    )
+    return proof_path
 
-    with proof_data_path.open("w") as f:
-        json.dump(proof_data, f)
 
-    py_run_args = ezkl.PyRunArgs()
-    py_run_args.input_visibility = "public"
-    py_run_args.output_visibility = "public"
-    py_run_args.param_visibility = "fixed"  # "fixed" for params means that the committed to params are used for all proofs
+def verify_proof(paths: ProverPaths, proof_path: Path) -> bool:
+    return ezkl.verify(
+        str(proof_path),
+        str(paths.settings),
+        str(paths.vk),
+        srs_path=str(paths.srs),
+    )
+
+
+def proof_calldata(proof: dict) -> tuple[list[str], list[str]]:
+    """
+    Encode an ezkl proof as the (proof, pubSignals) arguments of the
+    verifier: the proof bytes as bytes32 words and the public instances
+    (little-endian field elements) as uint256 values.
+    """
+    proof_bytes = bytes(proof["proof"])
+    proof_bytes += bytes(-len(proof_bytes) % 32)
+    proof_words = [
+        "0x" + proof_bytes[i : i + 32].hex() for i in range(0, len(proof_bytes), 32)
+    ]
+    pub_signals = [
+        str(int.from_bytes(bytes.fromhex(felt), "little"))
+        for instance in proof["instances"]
+        for felt in instance
+    ]
+    return proof_words, pub_signals
+
+
+# Per worker state of prove_addresses
+_prover: dict = {}
+
+
+def _init_prover(
+    paths: ProverPaths, features_path: Path, n_threads: int, verify: bool, work_root: Path
+) -> None:
+    # ezkl parallelizes with rayon, which reads this when its pool starts
+    os.environ["RAYON_NUM_THREADS"] = str(n_threads)
+    _prover["paths"] = paths
+    # Rows are read from the file as needed, not sent to every worker
+    _prover["X"] = np.load(features_path, mmap_mode="r")
+    _prover["verify"] = verify
+    # Under the caller's temporary folder, which is removed with the pool
+    _prover["work_path"] = Path(tempfile.mkdtemp(prefix="prover-", dir=work_root))
 
-    res = ezkl.gen_settings(model_path, settings_path, py_run_args=py_run_args)
-    assert res == True, "Failed to generate settings"
 
-    res = await ezkl.calibrate_settings(
-        cal_data_path, model_path, settings_path, "resources"
+def circuit_batch_size(settings_path: Path) -> int:
+    """
+    Number of feature rows the compiled circuit takes per proof.
+    """
+    with settings_path.open() as f:
+        variables = dict(json.load(f)["run_args"].get("variables") or [])
+    return variables.get("batch_size", 1)
+
+
+def _prove_chunk(batches: list[list[str]], rows: list[list[int]]) -> list[dict]:
+    paths: ProverPaths = _prover["paths"]
+    X: np.ndarray = _prover["X"]
+    work_path: Path = _prover["work_path"]
+
+    records = []
+    for addresses, batch_rows in zip(batches, rows):
+        x = np.asarray(X[batch_rows], dtype=np.float32)
+        witness_path = generate_witness(paths, x.flatten().tolist(), work_path)
+        proof_path = generate_proof(paths, witness_path, work_path)
+        if _prover["verify"]:
+            assert verify_proof(paths, proof_path), f"Proof of {addresses} does not verify"
+
+        with proof_path.open() as f:
+            proof_words, pub_signals = proof_calldata(json.load(f))
+        records.append(dict(addresses=addresses, proof=proof_words, pub_signals=pub_signals))
+    return records
+
+
+def _read_proof_records(records_path: Path, vk_hash: str) -> dict[str, dict]:
+    records = {}
+    if records_path.is_file():
+        with records_path.open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Line cut short by an interrupted run
+                    continue
+                # Proofs of another circuit are proven again
+                if record["vk"] == vk_hash:
+                    for address in record["addresses"]:
+                        records[address] = record
+    return records
+
+
+def write_proof_input(
+    addresses: list[str],
+    X: np.ndarray,
+    addresses_path: Path,
+    features_path: Path,
+) -> None:
+    """
+    Write the inputs of prove_addresses: the addresses one per line, and
+    their (scaled) feature rows as a float32 .npy array that the provers
+    memory map.
+    """
+    assert len(addresses) == len(X), "addresses and X must have the same length"
+    with addresses_path.open("w") as f:
+        f.writelines(f"{address}\n" for address in addresses)
+    np.save(features_path, np.asarray(X, dtype=np.float32))
+
+
+def read_proof_addresses(addresses_path: Path) -> list[str]:
+    with addresses_path.open() as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def prove_addresses(
+    paths: ProverPaths,
+    addresses: list[str],
+    features_path: Path,
+    output_path: Path,
+    n_jobs: int = 1,
+    chunk_size: int = 1,
+    verify: bool = False,
+    threads: Union[int, None] = None,
+) -> Path:
+    """
+    Prove the model output of each address on its (scaled) feature row, in
+    the .npy file written by write_proof_input.
+
+    Addresses are grouped in batches of the circuit's batch size, one proof
+    per batch (the last batch is padded by repeating its last row). Chunks
+    of chunk_size proofs are proven in a pool of n_jobs processes, each one
+    capped to its share of threads (by default all the CPUs). Every
+    finished proof is appended to output_path / "proofs.jsonl" as it
+    arrives, and addresses already in there are skipped, so an interrupted
+    run resumes where it stopped. A failing chunk does not stop the others:
+    their proofs are kept and a RuntimeError is raised once all are done.
+    At the end, the proofs are written to output_path / "proofs.json" as
+    the beneficiaryArray, proofArray and pubSignalsArray arguments of
+    ZkMLAirdrop.verifyUserAllocations. With batches of more than one
+    address, each beneficiaryArray item is the list of addresses of the
+    proof, whose outputs are the last pubSignals in the same order.
+    """
+    n_rows = np.load(features_path, mmap_mode="r").shape[0]
+    assert len(addresses) == n_rows, "addresses and features must have the same length"
+    output_path.mkdir(parents=True, exist_ok=True)
+    records_path = output_path / "proofs.jsonl"
+    batch_size = circuit_batch_size(paths.settings)
+
+    with paths.vk.open("rb") as f:
+        vk_hash = hashlib.sha256(f.read()).hexdigest()
+    records = _read_proof_records(records_path, vk_hash)
+    pending = [i for i, address in enumerate(addresses) if address not in records]
+    print(
+        f"Proving {len(pending)} addresses in batches of {batch_size} "
+        f"({len(records)} already proven)"
     )
-    assert res == True, "Failed to calibrate settings"
+    if batch_size > 1:
+        print(
+            f"Warning: ZkMLAirdrop.verifyUserAllocations verifies one address per proof, "
+            f"proofs of {batch_size} addresses cannot be submitted to it"
+        )
 
-    res = ezkl.compile_circuit(model_path, compiled_model_path, settings_path)
-    assert res == True
-    print(f"Compiled model saved to {compiled_model_path}")
+    batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+    batch_rows = [batch + batch[-1:] * (batch_size - len(batch)) for batch in batches]
+    chunks = [
+        range(i, min(i + chunk_size, len(batches))) for i in range(0, len(batches), chunk_size)
+    ]
+    n_threads = max(1, (threads or os.cpu_count() or 1) // n_jobs)
 
+    if records_path.is_file() and records_path.stat().st_size > 0:
+        with records_path.open("rb") as f:
+            f.seek(-1, os.SEEK_END)
+            ends_with_newline = f.read() == b"\n"
+        if not ends_with_newline:
+            with records_path.open("a") as f:
+                f.write("\n")
 
-def generate_witness(base_path: Path):
-    ...
+    start = time.perf_counter()
+    proven = 0
+    failed = []
+    with records_path.open("a") as f, tempfile.TemporaryDirectory(
+        prefix="prover-"
+    ) as work_root, ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_prover,
+        initargs=(paths, features_path, n_threads, verify, Path(work_root)),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _prove_chunk,
+                [[addresses[i] for i in batches[b]] for b in chunk],
+                [batch_rows[b] for b in chunk],
+            ): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                chunk_records = future.result()
+            except Exception as e:
+                chunk_addresses = [addresses[i] for b in futures[future] for i in batches[b]]
+                failed += chunk_addresses
+                print(f"Failed to prove {len(chunk_addresses)} addresses: {e!r}")
+                continue
+            for record in chunk_records:
+                record["vk"] = vk_hash
+                f.write(json.dumps(record) + "\n")
+                for address in record["addresses"]:
+                    records[address] = record
+                proven += len(record["addresses"])
+            f.flush()
+            elapsed = time.perf_counter() - start
+            print(
+                f"Proven {proven}/{len(pending)} ({proven / elapsed * 3600:.0f} addresses/hour)"
+            )
 
+    if failed:
+        raise RuntimeError(
+            f"Failed to prove {len(failed)} addresses (e.g. {failed[0]}), "
+            f"run again to retry them, the other proofs are kept in {records_path}"
+        )
 
-def generate_proof(base_path: Path):
-    ...
+    # One entry per proof, in the order of their first address
+    proven_records = list({id(records[a]): records[a] for a in addresses}.values())
+    proof_sizes = {len(r["proof"]) for r in proven_records}
+    signal_sizes = {len(r["pub_signals"]) for r in proven_records}
+    if proof_sizes - {VERIFIER_PROOF_WORDS} or signal_sizes - {VERIFIER_PUB_SIGNALS}:
+        print(
+            f"Warning: proofs have {sorted(proof_sizes)} words and {sorted(signal_sizes)} "
+            f"public signals, the verifier expects bytes32[{VERIFIER_PROOF_WORDS}] "
+            f"and uint256[{VERIFIER_PUB_SIGNALS}]"
+        )
 
+    proofs_path = output_path / "proofs.json"
+    with proofs_path.open("w") as f:
+        json.dump(
+            dict(
+                beneficiaryArray=[
+                    r["addresses"][0] if batch_size == 1 else r["addresses"]
+                    for r in proven_records
+                ],
+                proofArray=[r["proof"] for r in proven_records],
+                pubSignalsArray=[r["pub_signals"] for r in proven_records],
+            ),
+            f,
+        )
+    print(
+        f"{len(proven_records)} proofs of {len(addresses)} addresses saved to {proofs_path}"
+    )
+    return proofs_path
 
-def verify_proof(base_path: Path):
-    ...
+
+async def benchmark_batch_sizes(
+    model: torch.nn.Module,
+    cal_X: torch.Tensor,
+    batch_sizes: list[int],
+    srs_path: Union[Path, None] = None,
+    cache: Union[ZKArtifactCache, None] = None,
+) -> list[dict]:
+    """
+    Measure the proving throughput of the circuit compiled for each batch
+    size on this machine.
+
+    For each size, the circuit is compiled, its keys set up (both through
+    the cache, if given) and one batch proven. Sizes are tried in increasing
+    order and the benchmark stops once the throughput drops below the best
+    one, or a circuit cannot be built (e.g. too large for the given SRS).
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="zk-benchmark-") as tmp:
+        for batch_size in sorted(batch_sizes):
+            base_path = Path(tmp) / f"batch_{batch_size}"
+            base_path.mkdir()
+            try:
+                await generate_compiled_model(base_path, model, cal_X, cache, batch_size)
+                await setup_proving_keys(base_path, base_path / "keys", srs_path, cache)
+
+                paths = ProverPaths.from_folders(base_path, base_path / "keys", srs_path)
+                X = cal_X[torch.arange(batch_size) % len(cal_X)].numpy()
+                start = time.perf_counter()
+                witness_path = generate_witness(paths, X.flatten().tolist(), base_path)
+                generate_proof(paths, witness_path, base_path)
+                prove_seconds = time.perf_counter() - start
+            except (AssertionError, RuntimeError) as e:
+                print(f"Batch size {batch_size} failed: {e}")
+                break
+
+            with paths.settings.open() as f:
+                settings = json.load(f)
+            result = dict(
+                batch_size=batch_size,
+                logrows=settings["run_args"]["logrows"],
+                num_rows=settings["num_rows"],
+                prove_seconds=prove_seconds,
+                addresses_per_hour=batch_size / prove_seconds * 3600,
+            )
+            print(
+                f"Batch size {batch_size}: 2^{result['logrows']} rows, "
+                f"{prove_seconds:.1f}s per proof, "
+                f"{result['addresses_per_hour']:.0f} addresses/hour"
+            )
+            best = max((r["addresses_per_hour"] for r in results), default=0)
+            results.append(result)
+            if result["addresses_per_hour"] < best:
+                break
+
+    return results
+
+
+def choose_batch_size(results: list[dict]) -> int:
+    assert results, "No batch size could be benchmarked"
+    return max(results, key=lambda r: r["addresses_per_hour"])["batch_size"]
 
 
 def deplot_verification_contract(base_path: Path):
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from ml_pipeline import attribution
+from ml_pipeline.attribution import DeepLiftExplainer
+from ml_pipeline.model import DynamicFCModel, FCModel, ModelWrapper
+
+N_FEATURES = 6
+
+
+def make_model(name: str) -> nn.Module:
+    torch.manual_seed(0)
+    if name == "fc":
+        return FCModel(N_FEATURES)
+    if name == "wrapped":
+        return ModelWrapper(FCModel(N_FEATURES))
+    if name == "dynamic":
+        return DynamicFCModel(N_FEATURES, 16, n_layers=4)
+    if name == "sequential":
+        return nn.Sequential(nn.Linear(N_FEATURES, 8), nn.ReLU(), nn.Linear(8, 1), nn.Sigmoid())
+    raise ValueError(name)
+
+
+def make_data(n: int, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, N_FEATURES)).astype(np.float32)
+
+
+def outputs(model: nn.Module, X: np.ndarray) -> np.ndarray:
+    with torch.no_grad():
+        return model.eval()(torch.from_numpy(X)).numpy()[:, 0]
+
+
+@pytest.mark.parametrize("name", ["fc", "wrapped", "dynamic", "sequential"])
+def test_attributions_add_up_to_the_output_difference(name):
+    model = make_model(name)
+    background = make_data(32, seed=1)
+    X = make_data(200, seed=2)
+    # Some rows equal to background rows, where the secants degenerate
+    X[:5] = background[:5]
+
+    explainer = DeepLiftExplainer(model, background)
+    values = explainer.shap_values(X)
+
+    assert values.shape == X.shape
+    assert values.dtype == np.float32
+    np.testing.assert_allclose(
+        explainer.expected_value, outputs(model, background).mean(), atol=1e-5
+    )
+    np.testing.assert_allclose(
+        values.sum(axis=1), outputs(model, X) - explainer.expected_value, atol=1e-4
+    )
+
+
+def test_linear_model_attributions():
+    model = nn.Linear(N_FEATURES, 1)
+    background = make_data(10, seed=1)
+    X = make_data(20, seed=2)
+    values = DeepLiftExplainer(model, background).shap_values(X)
+    expected = model.weight.detach().numpy() * (X - background.mean(axis=0))
+    np.testing.assert_allclose(values, expected, atol=1e-5)
+
+
+def test_repeated_background_rows_are_weighted():
+    model = make_model("fc")
+    background = make_data(8, seed=1)
+    repeated = np.concatenate([background, background[:3], background[:1]])
+    X = make_data(50, seed=2)
+
+    explainer = DeepLiftExplainer(model, repeated)
+    assert len(explainer.references) == len(background)
+    np.testing.assert_allclose(explainer.expected_value, outputs(model, repeated).mean(), atol=1e-5)
+    np.testing.assert_allclose(
+        explainer.shap_values(X).sum(axis=1),
+        outputs(model, X) - explainer.expected_value,
+        atol=1e-4,
+    )
+
+
+def test_chunks_do_not_change_the_attributions(monkeypatch):
+    model = make_model("fc")
+    background = make_data(16, seed=1)
+    X = make_data(100, seed=2)
+    values = DeepLiftExplainer(model, background).shap_values(X)
+    # A few rows per chunk
+    monkeypatch.setattr(attribution, "MAX_MULTIPLIER_ELEMENTS", 16 * 40 * 3)
+    np.testing.assert_allclose(
+        DeepLiftExplainer(model, background).shap_values(X), values, atol=1e-6
+    )
+
+
+def test_unsupported_model():
+    with pytest.raises(TypeError):
+        DeepLiftExplainer(nn.Sequential(nn.Linear(N_FEATURES, 1), nn.Tanh()), make_data(4, 0))
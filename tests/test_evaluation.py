@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from ml_pipeline.evaluation import evaluate_models, print_metrics, select_model
+from ml_pipeline.rendering import plot_confusion_matrices, plot_precision_recall
+
+
+def linear_models(weights: list[list[float]]) -> list[nn.Module]:
+    models = []
+    for w in weights:
+        model = nn.Linear(len(w), 1)
+        with torch.no_grad():
+            model.weight.copy_(torch.tensor([w]))
+            model.bias.zero_()
+        models.append(model)
+    return models
+
+
+def make_data(n_rows: int = 200, seed: int = 0) -> tuple[torch.Tensor, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, 2)).astype(np.float32)
+    # The label is mostly the sign of the first feature
+    y = ((X[:, 0] + 0.5 * rng.normal(size=n_rows)) > 0).astype(np.float32)
+    return torch.tensor(X), y
+
+
+def test_select_model_skips_missing_metrics():
+    metrics = [{"pr_auc": np.nan}, {"pr_auc": 0.3}, {"pr_auc": None}, {"pr_auc": 0.5}]
+    assert select_model(metrics, "classification") == 3
+    # Lower is better
+    metrics = [{"mse": np.nan}, {"mse": 0.3}, {"mse": 0.1}, {"mse": None}]
+    assert select_model(metrics, "regression") == 2
+
+
+def test_select_model_without_any_metric():
+    with pytest.raises(ValueError):
+        select_model([{"pr_auc": None}, {"pr_auc": np.nan}], "classification")
+
+
+def test_models_with_non_finite_outputs_are_not_evaluated(capsys):
+    X, y = make_data()
+    models = linear_models([[1.0, 0.0], [np.nan, 0.0], [-1.0, 0.0], [3.0, 0.0]])
+
+    evaluation, metrics = evaluate_models(models, X, y, is_classification=True)
+
+    assert metrics["models"][1] is None
+    assert metrics["models"][0]["pr_auc"] > metrics["models"][2]["pr_auc"]
+    # Same ranking, so the same pr_auc: the first one wins
+    assert metrics["selection"] == dict(metric="pr_auc", model=0, automatic=True)
+    assert len(evaluation["precision_1"]) == len(evaluation["recall_1"]) == 0
+    assert np.isnan(evaluation["confusion_matrices"][1]).all()
+    assert evaluation["confusion_matrices"][0].sum() == len(y)
+    assert "model 1 has non-finite outputs" in capsys.readouterr().out
+
+    # The report and the plots skip the model
+    print_metrics(metrics)
+    plot_precision_recall(evaluation)
+    plot_confusion_matrices(evaluation)
+
+
+def test_regression_models_with_non_finite_outputs():
+    X, y = make_data()
+    models = linear_models([[np.inf, 0.0], [0.1, 0.0], [0.0, 0.0]])
+
+    evaluation, metrics = evaluate_models(models, X, y, is_classification=False)
+
+    assert metrics["models"][0] is None
+    assert np.isnan(evaluation["mse"][0]) and np.isfinite(evaluation["mse"][1:]).all()
+    assert metrics["selection"]["model"] == int(np.argmin(evaluation["mse"][1:])) + 1
+
+
+def test_single_class_test_set_falls_back_to_log_loss(capsys):
+    X, _ = make_data()
+    y = np.zeros(len(X), dtype=np.float32)
+    models = linear_models([[1.0, 0.0], [0.0, 0.0], [-1.0, 0.0]])
+
+    _, metrics = evaluate_models(models, X, y, is_classification=True)
+
+    assert all(m["pr_auc"] is None and m["roc_auc"] is None for m in metrics["models"])
+    log_losses = [m["log_loss"] for m in metrics["models"]]
+    assert metrics["selection"] == dict(
+        metric="log_loss", model=int(np.argmin(log_losses)), automatic=True
+    )
+    assert "no model has a pr_auc, selected on log_loss" in capsys.readouterr().out
+
+
+def test_first_model_when_none_can_be_evaluated(capsys):
+    X, y = make_data()
+    models = linear_models([[np.nan, 0.0], [0.0, np.inf]])
+
+    _, metrics = evaluate_models(models, X, y, is_classification=True)
+
+    assert metrics["models"] == [None, None]
+    assert metrics["selection"] == dict(metric=None, model=0, automatic=True)
+    print_metrics(metrics)
+    assert "no model could be evaluated" in capsys.readouterr().out
+
+
+def test_given_model_is_selected():
+    X, y = make_data()
+    models = linear_models([[1.0, 0.0], [-1.0, 0.0]])
+
+    _, metrics = evaluate_models(models, X, y, is_classification=True, model_selected=1)
+
+    assert metrics["selection"] == dict(metric="pr_auc", model=1, automatic=False)
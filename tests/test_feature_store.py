@@ -0,0 +1,160 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ml_pipeline.feature_store import FeatureStore
+from ml_pipeline.ingestion import read_feature_file, read_feature_store
+from ml_pipeline.runner import PipelineRunner, Stage
+
+FEATURE_RENAMES = {"Active Days": "days", "Transactions Count": "transactions"}
+LABEL_COLS = ["label"]
+NUMERIC_COLS = list(FEATURE_RENAMES) + LABEL_COLS
+
+
+def write_csv(
+    path: Path, months: list[str], rows_per_month: int = 7, seed: int = 0
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n = len(months) * rows_per_month
+    df = pd.DataFrame(
+        {
+            "User Address": [f"0x{i:040x}" for i in range(n)],
+            # Interleaved, so that every chunk has rows of several months
+            "month_start": [months[i % len(months)] for i in range(n)],
+            "Active Days": rng.integers(0, 30, n).astype(float),
+            "Transactions Count": rng.random(n) * 100,
+            "label": rng.integers(0, 2, n).astype(float),
+        }
+    )
+    df.loc[3, "Active Days"] = np.nan
+    df.to_csv(path, index=False)
+    return df
+
+
+def read_all(store: FeatureStore) -> pd.DataFrame:
+    df = store.read(store.months())
+    return df.sort_values("User Address").reset_index(drop=True)
+
+
+def test_partitions_by_month(tmp_path):
+    df = write_csv(tmp_path / "features.csv", ["2023-08-01", "2023-09-01", "2023-10-01"])
+    store = FeatureStore(tmp_path / "store")
+
+    written = store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS, chunksize=5)
+
+    assert written == store.months() == ["2023-08-01", "2023-09-01", "2023-10-01"]
+    for month in written:
+        partition = store.read([month])
+        assert (partition["month_start"] == pd.Timestamp(month)).all()
+        assert len(partition) == (df["month_start"] == month).sum()
+        # One part file per chunk with rows of the month
+        assert len(list(store.partition_path(month).glob("part-*.parquet"))) > 1
+    assert not list(store.root.glob(".staging-*"))
+
+
+def test_round_trip(tmp_path):
+    df = write_csv(tmp_path / "features.csv", ["2023-08-01", "2023-09-01"])
+    store = FeatureStore(tmp_path / "store")
+    store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS, chunksize=4)
+
+    stored = read_all(store)
+    assert list(stored.columns) == list(df.columns)
+    np.testing.assert_array_equal(stored["User Address"], df["User Address"])
+    for col in NUMERIC_COLS:
+        assert stored[col].dtype == np.float32
+        np.testing.assert_allclose(stored[col], df[col].astype(np.float32))
+
+
+def test_append_only_new_months(tmp_path):
+    first = write_csv(tmp_path / "first.csv", ["2023-08-01", "2023-09-01"], seed=1)
+    write_csv(tmp_path / "second.csv", ["2023-09-01", "2023-10-01"], seed=2)
+    store = FeatureStore(tmp_path / "store")
+
+    assert store.ingest(tmp_path / "first.csv", numeric_cols=NUMERIC_COLS) == [
+        "2023-08-01",
+        "2023-09-01",
+    ]
+    assert store.ingest(tmp_path / "second.csv", numeric_cols=NUMERIC_COLS) == ["2023-10-01"]
+    assert store.months() == ["2023-08-01", "2023-09-01", "2023-10-01"]
+    # Existing months are left as first ingested
+    september = store.read(["2023-09-01"]).sort_values("User Address")
+    expected = first[first["month_start"] == "2023-09-01"].sort_values("User Address")
+    np.testing.assert_allclose(september["Transactions Count"], expected["Transactions Count"])
+
+
+def test_reingesting_is_skipped(tmp_path, monkeypatch):
+    write_csv(tmp_path / "features.csv", ["2023-08-01"])
+    store = FeatureStore(tmp_path / "store")
+    store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The CSV was parsed again")
+
+    monkeypatch.setattr(pd, "read_csv", fail)
+    assert store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS) == []
+    monkeypatch.undo()
+
+    # Changed, but without new months: only the month column is read
+    write_csv(tmp_path / "features.csv", ["2023-08-01"], rows_per_month=9)
+    assert store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS) == []
+    assert len(store.read(["2023-08-01"])) == 7
+
+
+def test_failed_ingestion_leaves_the_store_untouched(tmp_path):
+    write_csv(tmp_path / "first.csv", ["2023-08-01"])
+    df = write_csv(tmp_path / "second.csv", ["2023-09-01", "2023-10-01"], rows_per_month=10)
+    df = df.astype({"Transactions Count": object})
+    df.loc[15, "Transactions Count"] = "not a number"
+    df.to_csv(tmp_path / "second.csv", index=False)
+    store = FeatureStore(tmp_path / "store")
+    store.ingest(tmp_path / "first.csv", numeric_cols=NUMERIC_COLS)
+
+    with pytest.raises(ValueError):
+        store.ingest(tmp_path / "second.csv", numeric_cols=NUMERIC_COLS, chunksize=5)
+    assert store.months() == ["2023-08-01"]
+    assert not list(store.root.glob(".staging-*"))
+
+
+def test_store_reads_as_the_csv(tmp_path):
+    months = ["2023-08-01", "2023-09-01", "2023-10-01"]
+    write_csv(tmp_path / "features.csv", months)
+    store = FeatureStore(tmp_path / "store")
+    store.ingest(tmp_path / "features.csv", numeric_cols=NUMERIC_COLS, chunksize=5)
+    kwargs = dict(
+        feature_renames=FEATURE_RENAMES,
+        label_cols=LABEL_COLS,
+        holdout_months=["2023-10-01"],
+        prod_months=["2023-10-01"],
+    )
+
+    from_file = read_feature_file(tmp_path / "features.csv", **kwargs)
+    from_store = read_feature_store(store, **kwargs)
+    for file_df, store_df in zip(from_file, from_store):
+        file_df = file_df.sort_values("User Address").reset_index(drop=True)
+        store_df = store_df.sort_values("User Address").reset_index(drop=True)
+        pd.testing.assert_frame_equal(file_df, store_df, check_categorical=False)
+
+
+def test_runner_with_a_new_feature_store(tmp_path):
+    write_csv(tmp_path / "features.csv", ["2023-08-01"])
+    config = SimpleNamespace(
+        data_file=tmp_path / "features.csv", feature_store=tmp_path / "store"
+    )
+
+    def ingest(config):
+        store = FeatureStore(config.feature_store)
+        store.ingest(config.data_file, numeric_cols=NUMERIC_COLS)
+        store.read(store.months()).to_csv(tmp_path / "outputs" / "ml_data.csv")
+
+    stage = Stage(
+        name="ingest",
+        run=ingest,
+        outputs=lambda config: ("ml_data.csv",),
+        sources=lambda config: [config.data_file, config.feature_store],
+    )
+    (tmp_path / "outputs").mkdir()
+    assert set(PipelineRunner([stage], config, tmp_path / "outputs").run()) == {"ingest"}
+    assert FeatureStore(config.feature_store).months() == ["2023-08-01"]
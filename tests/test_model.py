@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import torch
+from sklearn.preprocessing import StandardScaler
+
+from ml_pipeline.model import DynamicFCModel, FCModel, fold_standardization
+from ml_pipeline.scoring import load_scaler_params, save_scaler_params
+
+
+def raw_features(n_rows: int = 200, seed: int = 0) -> np.ndarray:
+    # Features of very different ranges, like transaction counts and days
+    rng = np.random.default_rng(seed)
+    return np.column_stack(
+        [
+            rng.integers(0, 365, n_rows),
+            rng.lognormal(5, 2, n_rows),
+            rng.random(n_rows),
+            rng.normal(-40, 0.01, n_rows),
+        ]
+    ).astype(np.float32)
+
+
+@pytest.mark.parametrize(
+    "make_model",
+    [lambda: FCModel(4, hidden_size=8), lambda: DynamicFCModel(4, 8, n_layers=4)],
+)
+def test_folded_model_matches_the_scaler_and_the_model(make_model, tmp_path):
+    torch.manual_seed(0)
+    model = make_model().eval()
+    X = raw_features()
+    scaler = StandardScaler().fit(X)
+    # Through the saved params, as the export stage does
+    save_scaler_params(scaler, ["a", "b", "c", "d"], tmp_path / "scaler.json")
+    _, mean, scale = load_scaler_params(tmp_path / "scaler.json")
+
+    folded = fold_standardization(model, mean, scale)
+
+    with torch.no_grad():
+        expected = model(torch.tensor(scaler.transform(X), dtype=torch.float32))
+        actual = folded(torch.tensor(X))
+        scripted = torch.jit.script(folded)(torch.tensor(X))
+    np.testing.assert_allclose(actual.numpy(), expected.numpy(), rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(scripted.numpy(), actual.numpy())
+
+
+def test_folding_leaves_the_model_unchanged():
+    torch.manual_seed(0)
+    model = FCModel(4, hidden_size=8)
+    state_dict = {k: v.clone() for k, v in model.state_dict().items()}
+
+    fold_standardization(model, np.arange(4, dtype=np.float32), np.full(4, 2, dtype=np.float32))
+
+    for name, value in model.state_dict().items():
+        assert torch.equal(value, state_dict[name]), name
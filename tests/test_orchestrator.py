@@ -0,0 +1,115 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from ml_pipeline import stages
+from ml_pipeline.orchestrator import format_report, read_manifest, run_protocol
+
+
+def write_manifest(path: Path, manifest: dict) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest))
+    return path
+
+
+def test_manifest_overrides_defaults(tmp_path):
+    manifest_file = write_manifest(
+        tmp_path / "manifest.json",
+        {
+            "defaults": {"epochs": 30, "is_classification": True},
+            "protocols": {
+                "arbitrum": {"epochs": 5},
+                "base": {"model_selected": 1},
+                "blast": None,
+            },
+        },
+    )
+
+    configs = read_manifest(manifest_file)
+
+    assert list(configs) == ["arbitrum", "base", "blast"]
+    assert configs["arbitrum"] == {"epochs": 5, "is_classification": True}
+    assert configs["base"] == {"epochs": 30, "is_classification": True, "model_selected": 1}
+    assert configs["blast"] == {"epochs": 30, "is_classification": True}
+
+
+def test_manifest_paths_are_relative_to_the_manifest(tmp_path):
+    manifest_file = write_manifest(
+        tmp_path / "manifests" / "manifest.json",
+        {
+            "defaults": {"feature_store": "store"},
+            "protocols": {
+                "arbitrum": {"data_file": "data/arbitrum.csv"},
+                "base": {"data_file": "/data/base.csv", "feature_store": None},
+            },
+        },
+    )
+
+    configs = read_manifest(manifest_file)
+
+    folder = tmp_path / "manifests"
+    assert configs["arbitrum"]["data_file"] == str(folder / "data" / "arbitrum.csv")
+    assert configs["arbitrum"]["feature_store"] == str(folder / "store")
+    assert configs["base"]["data_file"] == "/data/base.csv"
+    assert configs["base"]["feature_store"] is None
+
+
+def test_manifest_without_protocols(tmp_path):
+    manifest_file = write_manifest(tmp_path / "manifest.json", {"defaults": {}})
+
+    with pytest.raises(KeyError):
+        read_manifest(manifest_file)
+
+
+def test_report_has_a_column_per_stage():
+    report = {
+        "arbitrum": {
+            "stages": {"ingest": 1.2, "train": 12.0},
+            "wall_time": 13.5,
+            "error": None,
+        },
+        "base": {
+            "stages": {"ingest": 0.5, "preprocess": 2.0},
+            "wall_time": 3.0,
+            "error": "Traceback ...",
+        },
+    }
+
+    lines = format_report(report).splitlines()
+
+    assert [line.split() for line in lines] == [
+        ["protocol", "ingest", "train", "preprocess", "total", "status"],
+        ["arbitrum", "1.2", "12.0", "-", "13.5", "ok"],
+        ["base", "0.5", "-", "2.0", "3.0", "failed"],
+    ]
+    # Columns are aligned
+    assert lines[1].index("13.5") == lines[0].index("total")
+    assert lines[2].index("3.0") == lines[0].index("total")
+
+
+def test_report_of_a_protocol_that_failed_before_any_stage():
+    report = {"arbitrum": {"stages": {}, "wall_time": 0.0, "error": "Traceback ..."}}
+
+    lines = format_report(report).splitlines()
+
+    assert [line.split() for line in lines] == [
+        ["protocol", "total", "status"],
+        ["arbitrum", "0.0", "failed"],
+    ]
+
+
+def test_protocol_stages_share_the_worker_threads(tmp_path, monkeypatch):
+    configs = []
+
+    def run_pipeline(config, stages=None, force=False):
+        configs.append(config)
+        return {}
+
+    monkeypatch.setattr(stages, "run_pipeline", run_pipeline)
+
+    store = str(tmp_path / "store")
+    run_protocol("arbitrum", {"feature_store": store, "n_jobs": 2}, tmp_path / "a", threads=3)
+    run_protocol("base", {"feature_store": store, "threads": 1}, tmp_path / "b", threads=3)
+
+    assert [(config.n_jobs, config.threads) for config in configs] == [(2, 3), (1, 1)]
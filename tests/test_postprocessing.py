@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ml_pipeline.postprocessing import (
+    PROD_DATA_FOLDER,
+    encode_addresses,
+    generate_user_groups,
+    generate_user_probas,
+    save_prod_arrays,
+    staged_folder,
+)
+
+GROUPS = [
+    ("0-10", 0, 10),
+    ("10-50", 10, 50),
+    ("50-100", 50, 100),
+    ("100-500", 100, 500),
+    # Empty groups at the end are dropped
+    ("500+", 500, np.inf),
+]
+
+
+def pandas_user_groups(groups, data, prediction_col, value_col):
+    # The original pandas groupby implementation, as a reference
+    groups_data = []
+    for label, lower, higher in groups:
+        data_group = data[(data[value_col] >= lower) & (data[value_col] < higher)]
+        predictions = data_group[prediction_col]
+        values = data_group[value_col]
+        groups_data.append(
+            {
+                "label": label,
+                "lower": float(lower),
+                "higher": float(higher),
+                "count": float(len(data_group)),
+                "mean": float(predictions.mean()),
+                "median": float(predictions.median()),
+                "pct25": float(predictions.quantile(0.25)),
+                "pct75": float(predictions.quantile(0.75)),
+                "pct10": float(predictions.quantile(0.1)),
+                "pct90": float(predictions.quantile(0.9)),
+                "value_generated": float(values.sum()),
+                "value_generated_mean": float(values.mean()),
+                "value_generated_median": float(values.median()),
+            }
+        )
+    while groups_data[-1]["count"] == 0:
+        groups_data.pop()
+    return groups_data
+
+
+def make_data(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    predictions = rng.random(n)
+    predictions[rng.random(n) < 0.05] = np.nan
+    return pd.DataFrame(
+        {
+            "User Address": [f"0x{i:040x}" for i in range(n)],
+            "prediction": predictions,
+            # Integer counts, so that many rows sit on the group bounds
+            "Transactions Count": rng.integers(0, 300, size=n).astype(float),
+        }
+    )
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 1000])
+def test_user_groups_match_pandas(n):
+    data = make_data(n, seed=n)
+    groups = generate_user_groups(GROUPS, data, "prediction", "Transactions Count")
+    expected = pandas_user_groups(GROUPS, data, "prediction", "Transactions Count")
+
+    assert [g["label"] for g in groups] == [g["label"] for g in expected]
+    for group, expected_group in zip(groups, expected):
+        assert group.keys() == expected_group.keys()
+        for name, value in expected_group.items():
+            if name == "label":
+                assert group[name] == value
+            else:
+                np.testing.assert_allclose(group[name], value, rtol=1e-12, err_msg=name)
+
+
+def test_user_probas_drop_missing_predictions():
+    data = make_data(1000)
+    user_probas = generate_user_probas(data)
+    expected = {
+        row["User Address"]: float(row["prediction"])
+        for _, row in data.iterrows()
+        if not np.isnan(row["prediction"])
+    }
+    assert user_probas == expected
+
+
+def test_staged_folder_swaps_versions(tmp_path):
+    folder = tmp_path / PROD_DATA_FOLDER
+    # A folder written before versioning
+    folder.mkdir()
+    (folder / "probas.npy").write_text("legacy")
+
+    versions = []
+    for i in range(3):
+        with staged_folder(folder) as version:
+            (version / "probas.npy").write_text(str(i))
+            # Readers still see the previous version until the block exits
+            assert (folder / "probas.npy").read_text() == (str(i - 1) if i else "legacy")
+        versions.append(version)
+        assert folder.is_symlink()
+        assert folder.resolve() == version.resolve()
+        assert (folder / "probas.npy").read_text() == str(i)
+
+    # The current and previous versions are kept, older ones removed
+    kept = sorted(p.name for p in tmp_path.glob(f".{PROD_DATA_FOLDER}-*"))
+    assert kept == sorted(v.name for v in versions[-2:])
+
+
+def test_staged_folder_failure_keeps_the_current_version(tmp_path):
+    folder = tmp_path / PROD_DATA_FOLDER
+    with staged_folder(folder) as version:
+        (version / "probas.npy").write_text("good")
+    with pytest.raises(RuntimeError):
+        with staged_folder(folder) as version:
+            (version / "probas.npy").write_text("partial")
+            raise RuntimeError
+    assert (folder / "probas.npy").read_text() == "good"
+    assert not version.exists()
+
+
+def test_save_prod_arrays(tmp_path):
+    folder = tmp_path / PROD_DATA_FOLDER
+    addresses = encode_addresses([f"0x{i:040x}" for i in range(3)])
+    probas = np.array([0.1, 0.5, 0.9], dtype=np.float32)
+    values = np.array([1, 2, 3], dtype=np.float32)
+    save_prod_arrays(folder, addresses, probas, values, [])
+    np.testing.assert_array_equal(np.load(folder / "addresses.npy"), addresses)
+    np.testing.assert_array_equal(np.load(folder / "probas.npy"), probas)
+    assert not list(folder.resolve().glob(".*"))
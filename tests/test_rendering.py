@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+
+from ml_pipeline.rendering import PlotJob, render_plots
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def write_address_shap(folder, n_rows: int, n_features: int = 4) -> None:
+    # As written by ml_pipeline.shap_plots.save_address_shap
+    rng = np.random.default_rng(0)
+    folder.mkdir()
+    np.save(folder / "values.npy", rng.normal(size=(n_rows, n_features)).astype(np.float32))
+    np.save(folder / "features.npy", rng.random((n_rows, n_features)).astype(np.float32))
+    with (folder / "meta.json").open("w") as f:
+        json.dump(dict(feature_names=[f"f{i}" for i in range(n_features)], base_value=0.5), f)
+
+
+def test_more_waterfall_examples_than_rows(tmp_path):
+    write_address_shap(tmp_path / "shap_values", n_rows=3)
+    jobs = [
+        PlotJob("waterfall", f"waterfall_{i}.png", ("shap_values",), dict(example=i))
+        for i in range(5)
+    ]
+
+    render_plots(tmp_path, jobs)
+
+    images = [(tmp_path / job.output).read_bytes() for job in jobs]
+    assert all(image.startswith(PNG_SIGNATURE) for image in images)
+    # The 3 rows, then the first ones again
+    assert len(set(images[:3])) == 3
+    assert images[3:] == images[:2]
+
+
+def test_jobs_do_not_share_keyword_arguments(tmp_path):
+    write_address_shap(tmp_path / "shap_values", n_rows=10)
+    job = PlotJob("beeswarm", "beeswarm.png", ("shap_values",))
+
+    assert job.kwargs is None
+    render_plots(tmp_path, [job])
+
+    assert (tmp_path / "beeswarm.png").read_bytes().startswith(PNG_SIGNATURE)
@@ -0,0 +1,100 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from ml_pipeline.runner import PipelineRunner, Stage
+
+
+def write(path: Path, text: str) -> None:
+    path.write_text(text)
+    # Hashes are memoized on (size, mtime): make every write visible
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def upper(config) -> None:
+    write(config.outputs_folder / "upper.txt", config.source.read_text().upper())
+
+
+def repeat(config) -> None:
+    text = (config.outputs_folder / "upper.txt").read_text()
+    write(config.outputs_folder / "repeated.txt", text * config.times)
+
+
+def make_runner(config) -> PipelineRunner:
+    stages = [
+        Stage(
+            name="upper",
+            run=upper,
+            outputs=lambda config: ("upper.txt",),
+            sources=lambda config: [config.source],
+        ),
+        Stage(
+            name="repeat",
+            run=repeat,
+            inputs=("upper.txt",),
+            outputs=lambda config: ("repeated.txt",),
+            params=lambda config: dict(times=config.times),
+        ),
+    ]
+    return PipelineRunner(stages, config, config.outputs_folder)
+
+
+@pytest.fixture
+def config(tmp_path):
+    source = tmp_path / "source.txt"
+    write(source, "abc")
+    outputs_folder = tmp_path / "outputs"
+    outputs_folder.mkdir()
+    return SimpleNamespace(source=source, outputs_folder=outputs_folder, times=2)
+
+
+def test_unchanged_inputs_are_skipped(config):
+    assert set(make_runner(config).run()) == {"upper", "repeat"}
+    # A new runner only has the records on disk to go on
+    assert make_runner(config).run() == {}
+    assert (config.outputs_folder / "repeated.txt").read_text() == "ABCABC"
+
+
+def test_changed_source_reruns_downstream(config):
+    make_runner(config).run()
+    write(config.source, "abcd")
+    assert set(make_runner(config).run()) == {"upper", "repeat"}
+    assert (config.outputs_folder / "repeated.txt").read_text() == "ABCDABCD"
+
+
+def test_same_output_does_not_invalidate_downstream(config):
+    make_runner(config).run()
+    # Different source, same upper.txt
+    write(config.source, "ABC")
+    assert set(make_runner(config).run()) == {"upper"}
+
+
+def test_changed_params_rerun_the_stage(config):
+    make_runner(config).run()
+    config.times = 3
+    assert set(make_runner(config).run()) == {"repeat"}
+    assert (config.outputs_folder / "repeated.txt").read_text() == "ABCABCABC"
+
+
+def test_modified_or_missing_output_reruns_the_stage(config):
+    make_runner(config).run()
+    write(config.outputs_folder / "repeated.txt", "edited")
+    assert set(make_runner(config).run()) == {"repeat"}
+    (config.outputs_folder / "repeated.txt").unlink()
+    assert set(make_runner(config).run()) == {"repeat"}
+
+
+def test_force_reruns_the_targets_only(config):
+    make_runner(config).run()
+    assert set(make_runner(config).run(["repeat"], force=True)) == {"repeat"}
+    assert set(make_runner(config).run(force=True)) == {"upper", "repeat"}
+
+
+def test_targets_run_their_stale_upstream_stages(config):
+    assert set(make_runner(config).run(["repeat"])) == {"upper", "repeat"}
+    write(config.source, "abcd")
+    assert set(make_runner(config).run(["upper"])) == {"upper"}
+    assert set(make_runner(config).run(["repeat"])) == {"repeat"}
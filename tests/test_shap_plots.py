@@ -0,0 +1,19 @@
+import numpy as np
+
+from ml_pipeline.shap_plots import kmeans_background
+
+
+def test_background_of_fewer_rows_than_clusters():
+    X = np.random.default_rng(0).random((60, 3))
+
+    background = kmeans_background(X, n_clusters=100, size=50)
+
+    assert background.dtype == np.float32
+    assert background.shape[1] == 3
+    assert 0 < len(background) <= len(X)
+
+
+def test_small_data_is_its_own_background():
+    X = np.random.default_rng(0).random((20, 3))
+
+    np.testing.assert_array_equal(kmeans_background(X, size=50), X.astype(np.float32))
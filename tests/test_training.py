@@ -0,0 +1,148 @@
+from functools import partial
+
+import numpy as np
+import pytest
+import torch
+
+from ml_pipeline.model import FCModel
+from ml_pipeline.training import evaluated_epochs, train_cross_validation, train_fold
+
+N_FEATURES = 4
+
+
+def make_data(n: int = 120, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, N_FEATURES)).astype(np.float32)
+    y = (X[:, :1] + 0.5 * rng.normal(size=(n, 1)) > 0).astype(np.float32)
+    folds = np.arange(n) % 3
+    splits = [(np.flatnonzero(folds != k), np.flatnonzero(folds == k)) for k in range(3)]
+    return torch.from_numpy(X), torch.from_numpy(y), splits
+
+
+def assert_same_models(first, second):
+    for model, other in zip(first, second):
+        for name, tensor in model.state_dict().items():
+            torch.testing.assert_close(tensor, other.state_dict()[name], rtol=0, atol=0)
+
+
+def test_folds_do_not_depend_on_n_jobs():
+    X, y, splits = make_data()
+    kwargs = dict(
+        model_class=partial(FCModel, N_FEATURES, 8),
+        train_X=X,
+        train_y=y,
+        group_kfold_splits=splits,
+        batch_size=16,
+        epochs=3,
+        shuffle_batches=True,
+        seed=7,
+    )
+    serial = train_cross_validation(**kwargs, n_jobs=1)
+    parallel = train_cross_validation(**kwargs, n_jobs=2, threads_per_job=1)
+
+    assert_same_models(serial[0], parallel[0])
+    assert serial[1:] == parallel[1:]
+    # Whatever ran before in this process
+    torch.manual_seed(123)
+    assert_same_models(serial[0], train_cross_validation(**kwargs, n_jobs=1)[0])
+
+
+class CountingModel(FCModel):
+    # Lengths of the inputs of every forward pass
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_lengths = []
+
+    def forward(self, x):
+        self.input_lengths.append(len(x))
+        return super().forward(x)
+
+
+def test_eval_every_skips_full_fold_passes():
+    X, y, splits = make_data()
+    train_idx, validation_idx = splits[0]
+    model, train_loss, train_accuracy, valid_loss, valid_accuracy = train_fold(
+        partial(CountingModel, N_FEATURES, 8),
+        X,
+        y,
+        train_idx,
+        validation_idx,
+        batch_size=16,
+        epochs=7,
+        eval_every=3,
+    )
+
+    # Evaluated after epochs 2 and 5, and after the last one
+    assert evaluated_epochs(7, 3) == [2, 5, 6]
+    assert len(train_loss) == len(train_accuracy) == len(valid_loss) == len(valid_accuracy) == 3
+    assert model.input_lengths.count(len(train_idx)) == 3
+    assert model.input_lengths.count(len(validation_idx)) == 3
+    # The rest are the training batches
+    n_batches = -(-len(train_idx) // 16)
+    assert len(model.input_lengths) == 7 * n_batches + 6
+
+    # The last logged losses are those of the final weights
+    criterion = torch.nn.BCEWithLogitsLoss()
+    with torch.inference_mode():
+        final_loss = criterion(model(X[validation_idx]), y[validation_idx]).item()
+    assert valid_loss[-1] == pytest.approx(final_loss, rel=1e-6)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptibleModel(FCModel):
+    # Raises on the forward pass number fail_at (counted over all instances)
+    fail_at = None
+    calls = 0
+
+    def forward(self, x):
+        InterruptibleModel.calls += 1
+        if InterruptibleModel.calls == InterruptibleModel.fail_at:
+            raise Interrupted
+        return super().forward(x)
+
+
+@pytest.mark.parametrize("patience", [None, 2])
+def test_resumed_fold_matches_an_uninterrupted_one(tmp_path, patience, monkeypatch):
+    X, y, splits = make_data()
+    train_idx, validation_idx = splits[1]
+    kwargs = dict(
+        model_class=partial(InterruptibleModel, N_FEATURES, 8),
+        train_X=X,
+        train_y=y,
+        train_idx=train_idx,
+        validation_idx=validation_idx,
+        fold_idx=1,
+        batch_size=16,
+        epochs=12,
+        learning_rate=0.01,
+        shuffle_batches=True,
+        # Stops at epoch 9, after the interruption
+        patience=patience,
+        checkpoint_every=2,
+    )
+    expected = train_fold(**kwargs)
+
+    # Killed in the middle of epoch 6 (5 batches and 2 evaluation passes per
+    # epoch), after the checkpoint of epoch 4
+    checkpoint_path = tmp_path / "fold_1.pt"
+    monkeypatch.setattr(InterruptibleModel, "calls", 0)
+    monkeypatch.setattr(InterruptibleModel, "fail_at", 5 * 7 + 3)
+    with pytest.raises(Interrupted):
+        train_fold(**kwargs, checkpoint_path=checkpoint_path)
+    assert torch.load(checkpoint_path)["epoch"] == 4
+
+    # Whatever the RNG state of the resuming process
+    torch.manual_seed(99)
+    monkeypatch.setattr(InterruptibleModel, "fail_at", None)
+    resumed = train_fold(**kwargs, checkpoint_path=checkpoint_path)
+    assert_same_models([resumed[0]], [expected[0]])
+    assert resumed[1:] == expected[1:]
+
+    # A finished fold comes back without training
+    monkeypatch.setattr(InterruptibleModel, "calls", 0)
+    finished = train_fold(**kwargs, checkpoint_path=checkpoint_path)
+    assert InterruptibleModel.calls == 0
+    assert_same_models([finished[0]], [expected[0]])
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import tempfile
+
+import pytest
+import torch
+
+ezkl = pytest.importorskip("ezkl")
+
+from ml_pipeline.model import FCModel  # noqa: E402
+from ml_pipeline.zkml import (  # noqa: E402
+    ProverPaths,
+    generate_compiled_model,
+    prove_addresses,
+    setup_proving_keys,
+    write_proof_input,
+)
+
+ADDRESSES = [f"0x{i:040x}" for i in range(2)]
+
+
+@pytest.fixture(scope="module")
+def circuit(tmp_path_factory):
+    # A 3 -> 4 model keeps the circuit small enough to prove in seconds
+    torch.manual_seed(0)
+    folder = tmp_path_factory.mktemp("circuit")
+    X = torch.rand(16, 3)
+    asyncio.run(generate_compiled_model(folder, FCModel(3, hidden_size=4), X))
+
+    with (folder / "settings.json").open() as f:
+        logrows = json.load(f)["run_args"]["logrows"]
+    srs_path = folder / "kzg.srs"
+    ezkl.gen_srs(str(srs_path), logrows)
+    asyncio.run(setup_proving_keys(folder, folder / "keys", srs_path=srs_path))
+
+    write_proof_input(
+        ADDRESSES, X[: len(ADDRESSES)].numpy(), folder / "addresses.txt", folder / "X.npy"
+    )
+    return ProverPaths.from_folders(folder, folder / "keys", srs_path), folder / "X.npy"
+
+
+@pytest.fixture
+def temp_folder(tmp_path, monkeypatch):
+    folder = tmp_path / "tmp"
+    folder.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(folder))
+    return folder
+
+
+def test_proofs_verify(circuit, tmp_path, temp_folder):
+    paths, features_path = circuit
+
+    proofs_path = prove_addresses(paths, ADDRESSES, features_path, tmp_path / "proofs", verify=True)
+
+    with proofs_path.open() as f:
+        proofs = json.load(f)
+    assert proofs["beneficiaryArray"] == ADDRESSES
+    assert len(proofs["proofArray"]) == len(proofs["pubSignalsArray"]) == len(ADDRESSES)
+    # The provers' work folders are removed
+    assert list(temp_folder.iterdir()) == []
+
+    # Nothing is left to prove
+    records_path = tmp_path / "proofs" / "proofs.jsonl"
+    records = records_path.read_text()
+    prove_addresses(paths, ADDRESSES, features_path, tmp_path / "proofs")
+    assert records_path.read_text() == records
+
+
+def test_failed_chunks_are_reported_once_all_are_done(circuit, tmp_path, temp_folder):
+    paths, features_path = circuit
+    missing_pk = paths._replace(pk=tmp_path / "missing.key")
+
+    with pytest.raises(RuntimeError, match=f"Failed to prove {len(ADDRESSES)} addresses"):
+        prove_addresses(missing_pk, ADDRESSES, features_path, tmp_path / "proofs")
+
+    assert (tmp_path / "proofs" / "proofs.jsonl").read_text() == ""
+    assert not (tmp_path / "proofs" / "proofs.json").exists()
+    assert list(temp_folder.iterdir()) == []